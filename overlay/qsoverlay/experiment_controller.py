@@ -14,12 +14,6 @@ from quantumsim.sparsedm import SparseDM
 from .circuit_builder import Builder
 from .experiment_setup import Setup
 
-sx = np.array([[0, 1], [1, 0]])
-sy = np.array([[0, -1j], [1j, 0]])
-sz = np.array([[1, 0], [0, -1]])
-s0 = np.array([[1, 0], [0, 1]])
-pauli_dic = {1: s0, 'X': sx, 'Y': sy, 'Z': sz}
-
 
 # noinspection PyStatementEffect
 class Controller:
@@ -218,8 +212,7 @@ class Controller:
             self < circuit
             self < tomo_circuit
             self.state.renormalize()
-            rho_dist = self.state.peak_multiple_measurements(
-                measurement_model.qubits)
+            rho_dist = self.state.marginal(measurement_model.qubits)
             data.append(measurement_model.sample(
                 rho_dist, num_measurements, data_type=data_type,
                 output_format=output_format))
@@ -238,36 +231,10 @@ class Controller:
         """
 
         results = []
-        self.state.apply_all_pending()
         self.state.renormalize()
-        dm = self.state.full_dm.to_array()
-
-        for msmt in msmts:
-
-            mult = 1
-
-            # Make Pauli list
-            pauli_list = [1] * len(self.state.idx_in_full_dm)
-            for qubit in msmt:
-                if qubit not in self.state.idx_in_full_dm:
-                    if msmt[qubit] == 'Z':
-                        mult *= (-1) ** self.state.classical[qubit]
-                    elif msmt[qubit] in ['X', 'Y']:
-                        mult = 0
-                    else:
-                        raise ValueError('qubit measurements must be X, Y, Z')
-                else:
-                    pauli_list[self.state.idx_in_full_dm[qubit]] = msmt[qubit]
-
-            # Make measurement operator
-            op = pauli_dic[pauli_list[0]]
-            for label in pauli_list[1:]:
-                op = np.kron(pauli_dic[label], op)
 
-            result = mult * np.trace(op @ dm)
-
-            assert np.imag(result) < 1e-9
-            result = float(np.real(result))
+        for result in self.state.expectation(msmts):
+            result = float(result)
 
             if num_repetitions is not None:
                 bernoulli_rv = (1 - result) / 2
@@ -300,11 +267,63 @@ class Controller:
         measurement).
         """
 
-        self.state.apply_all_pending()
-        self.state.renormalize()
+        return self.get_probabilities([{q: 0 for q in qubits}])[0]
+
+    def get_probabilities(self, queries):
 
-        indices = [self.state.idx_in_full_dm[q] for q in qubits]
-        diagonal = self.state.full_dm.get_diag()
+        """
+        Returns the probabilities of a list of measurement outcomes
+        of the current state, all evaluated from one pass over the
+        diagonal of the density matrix.
+
+        Each query is either:
+        a) a dictionary {qubit: result}: the probability that the
+            qubits return the given results (0 or 1), e.g.
+            {q: 0 for q in qubits} for all zero.
+        b) a tuple ('parity', qubits, parity): the probability that
+            the sum of the results of the qubits is even (parity 0)
+            or odd (parity 1).
+
+        The probabilities are normalized, and all queries are evaluated
+        from a single state.marginal of the qubits involved.
+        """
+
+        parsed = []
+        for query in queries:
+            if isinstance(query, dict):
+                parsed.append((False, list(query), list(query.values())))
+            elif len(query) == 3 and query[0] == 'parity':
+                parsed.append((True, list(query[1]), [query[2]]))
+            else:
+                raise ValueError('Unknown probability query {}'.format(query))
+            for qubit in parsed[-1][1]:
+                if qubit not in self.state.names:
+                    raise ValueError('Unknown qubit {}'.format(qubit))
+            if any(v not in [0, 1] for v in parsed[-1][2]):
+                raise ValueError('Results must be 0 or 1: {}'.format(query))
+
+        qubits = []
+        for _, query_qubits, _ in parsed:
+            qubits += [q for q in query_qubits if q not in qubits]
+
+        marginal = self.state.marginal(qubits)
+        trace = marginal.sum()
+        if not trace > 0:
+            raise ValueError('The state has zero trace, the probabilities '
+                             'are undefined')
+        # row j of results holds the outcome of each qubit, and the first
+        # qubit is the least significant bit of j
+        marginal = marginal.transpose().reshape(-1) / trace
+        results = (np.arange(len(marginal))[:, None] >>
+                   np.arange(len(qubits))) & 1
+
+        probabilities = []
+        for parity, query_qubits, values in parsed:
+            columns = results[:, [qubits.index(q) for q in query_qubits]]
+            if parity:
+                selected = columns.sum(axis=1) % 2 == values[0]
+            else:
+                selected = np.all(columns == values, axis=1)
+            probabilities.append(marginal[selected].sum())
 
-        return sum([x for j, x in enumerate(diagonal) if
-                    all([(j // 2 ** i) % 2 == 0 for i in indices])])
+        return np.array(probabilities)
@@ -23,35 +23,75 @@ class CorrelatedMeasurement:
             ***as reported by an experimentalist*** - i.e.
             not the cross-correlation matrix that takes into
             account residual population.
+            Either a dense 2**n x 2**n matrix, or a list of
+            factors (qubit_indices, matrix), where matrix is a
+            2**k x 2**k matrix acting on the results of the k
+            qubits self.qubits[i] for i in qubit_indices (bit j of
+            its index belongs to qubit_indices[j]). The factors are
+            applied in order, e.g. a 2x2 assignment matrix per qubit
+            followed by a few 4x4 terms for correlated pairs. They
+            are never multiplied into a dense matrix.
         @populations: the residual excitations of the qubits
             in order.
         """
 
         self.qubits = qubits
         self.num_qubits = len(qubits)
-        self.lit_string = r'{' + '0:0{}b'.format(self.num_qubits) + r'}'
         self.random_state = random_state
         self.EQ_TOL = 1e-9
 
-        pop_matrix = np.zeros([2**self.num_qubits, 2**self.num_qubits])
-
-        # Make pop_matrix
-        for j in range(2**self.num_qubits):
-            for k in range(2**self.num_qubits):
-                diff = j ^ k
-                pop_matrix[j, k] = 1
-                for n in range(self.num_qubits):
-                    if diff % 2 == 1:
-                        pop_matrix[j, k] *= populations[n]
-                    else:
-                        pop_matrix[j, k] *= (1-populations[n])
-                    diff = diff // 2
-                pop_matrix[k, j] = pop_matrix[j, k]
+        if is_factor_list(cc_matrix):
+            factors = [(tuple(int(i) for i in indices),
+                        np.array(matrix, dtype=float))
+                       for indices, matrix in cc_matrix]
+        else:
+            factors = [(tuple(range(self.num_qubits)),
+                        np.array(cc_matrix, dtype=float))]
+        for indices, matrix in factors:
+            if matrix.shape != (2**len(indices),) * 2:
+                raise ValueError('A cross-correlation matrix on {} qubits '
+                                 'must have shape {}, not {}'.format(
+                                     len(indices), (2**len(indices),) * 2,
+                                     matrix.shape))
+            if any(not 0 <= i < self.num_qubits for i in indices):
+                raise ValueError('Qubit indices out of range: {}'.format(
+                    indices))
 
         # Calculate the real cc matrix taking into account the
         # fact that the experimental cc matrix is poisoned by
-        # the residual excitations not accounted for in experiment.
-        self.cc_matrix = cc_matrix @ np.linalg.inv(pop_matrix)
+        # the residual excitations not accounted for in experiment:
+        # the inverse of the population matrix, the Kronecker product
+        # of per-qubit matrices, is applied first.
+        self.cc_factors = [
+            ((n,), np.linalg.inv(population_matrix(p)))
+            for n, p in enumerate(populations)] + factors
+
+    @property
+    def cc_matrix(self):
+        """
+        The real cross-correlation matrix as a dense matrix (for
+        inspection, this takes O(4**n) memory).
+        """
+        return apply_factors(self.cc_factors,
+                             np.eye(2**self.num_qubits)).T
+
+    def apply_cc(self, rho_vec):
+        """
+        Returns the measured distribution of outcomes given the
+        distribution rho_vec of the state, applying the factors of the
+        cross-correlation matrix one by one.
+        """
+        return apply_factors(self.cc_factors, rho_vec)
+
+    def correct_distribution(self, m_vec):
+        """
+        Inverse of apply_cc: estimates the distribution of outcomes of
+        the state from a measured distribution, inverting the factors
+        one by one.
+        """
+        inverse = [(indices, np.linalg.inv(matrix))
+                   for indices, matrix in reversed(self.cc_factors)]
+        return apply_factors(inverse, m_vec)
 
     def sample(self, rho_dist,
                num_measurements,
@@ -63,28 +103,35 @@ class CorrelatedMeasurement:
         peak_multiple_measurement function given in quantumsim,
         and generates a sampling of num_measurements measurements
         from this distribution.
-        """
-        # rho_vec will hold the leading diagonal of the density matrix
-        # (This is horribly inefficient, should be directly integrated
-        # with quantumsim.)
-        rho_vec = np.zeros(2**self.num_qubits)
 
-        for j in range(2**self.num_qubits):
-            j_list = list(reversed(self.lit_string.format(j)))
+        rho_dist may also be the array returned by
+        SparseDM.marginal(self.qubits).
 
-            rho_vec[j] = sum([
-                x[1] for x in rho_dist if all([
-                    x[0][q] == int(j_list[n])
-                    for n, q in enumerate(self.qubits)])])
+        Shots are returned as an array of shape
+        (num_measurements, num_qubits), or of shape
+        (num_measurements, len(output_format)) holding the parities
+        of the results of each list of qubit indices in output_format.
+        Averages are the probabilities of the outcomes, or for
+        output_format the probabilities that all qubits of each list
+        return 1.
+        """
+        # rho_vec will hold the leading diagonal of the density matrix,
+        # where bit n of the index is the result of qubit n
+        rho_vec = self.outcome_distribution(rho_dist)
 
         if np.abs(sum(rho_vec) - 1) > self.EQ_TOL:
             raise ValueError('my rho normalization is: ', sum(rho_vec))
 
         # M_vec contains the measurement distributions.
-        M_vec = self.cc_matrix @ rho_vec
+        M_vec = self.apply_cc(rho_vec)
 
         if np.abs(sum(M_vec) - 1) > self.EQ_TOL:
             raise ValueError('my measurement normalization is: ', sum(M_vec))
+        if M_vec.min() < -self.EQ_TOL:
+            raise ValueError('negative measurement probability: ',
+                             M_vec.min())
+        # Remove rounding errors of the inverse population matrices
+        M_vec = np.maximum(M_vec, 0)
 
         if data_type == 'shots':
 
@@ -93,31 +140,108 @@ class CorrelatedMeasurement:
                 size=num_measurements,
                 p=M_vec)
 
-            measurements = [
-                np.array(list(reversed(self.lit_string.format(m))),
-                         dtype=int)
-                for m in measurements]
-
-            if output_format is not 'full':
-                measurements = [[sum(m[indices]) % 2
-                                 for indices in output_format]
-                                for m in measurements]
+            if output_format != 'full':
+                measurements = parities(measurements, output_format)
+            else:
+                measurements = unpack_bits(measurements, self.num_qubits)
 
         else:
             measurements = M_vec
-            if output_format is not 'full':
-                measurements = [sum([m for j, m in enumerate(measurements)
-                                     if self.indices_in_j(indices, j)])
-                                for indices in output_format]
+            if output_format != 'full':
+                bits = unpack_bits(np.arange(2**self.num_qubits),
+                                   self.num_qubits)
+                all_ones = np.array([bits[:, indices].all(axis=1)
+                                     for indices in output_format])
+                measurements = all_ones @ M_vec
 
         return measurements
 
-    @staticmethod
-    def indices_in_j(indices, j):
-        n = 0
-        while j > 0:
-            if n in indices and j % 2 == 0:
-                return False
-            n += 1
-            j = j // 2
-        return True
+    def outcome_distribution(self, rho_dist):
+        """
+        Returns the probabilities of all outcomes of the qubits as a
+        vector, where bit n of the index is the result of qubit n.
+
+        rho_dist is either the output of
+        SparseDM.peak_multiple_measurements, or the array returned by
+        SparseDM.marginal(self.qubits).
+        """
+        if isinstance(rho_dist, np.ndarray):
+            assert rho_dist.shape == (2,) * self.num_qubits
+            return rho_dist.transpose().reshape(-1)
+
+        probabilities = np.array([x[1] for x in rho_dist], dtype=float)
+        indices = np.zeros(len(rho_dist), dtype=int)
+        for n, q in enumerate(self.qubits):
+            indices |= np.array([x[0][q] for x in rho_dist],
+                                dtype=int) << n
+        return np.bincount(indices, weights=probabilities,
+                           minlength=2**self.num_qubits)
+
+
+def population_matrix(population):
+    """
+    The probabilities of the residual excitation flipping a single
+    qubit result (or not).
+    """
+    return np.array([[1 - population, population],
+                     [population, 1 - population]])
+
+
+def is_factor_list(cc_matrix):
+    """
+    Whether cc_matrix is a list of (qubit_indices, matrix) factors
+    rather than a dense matrix.
+    """
+    if isinstance(cc_matrix, np.ndarray):
+        return False
+    return all(len(factor) == 2 and
+               isinstance(factor[0], (list, tuple, range, np.ndarray))
+               for factor in cc_matrix)
+
+
+def apply_factors(factors, array):
+    """
+    Multiplies the last axis of array, which is indexed by outcomes
+    with bit n belonging to qubit n, with the matrices of the
+    (qubit_indices, matrix) factors in order. A factor on k qubits
+    takes O(2**k 2**n) operations per vector.
+    """
+    shape = array.shape
+    num_qubits = int(np.log2(shape[-1]))
+    assert shape[-1] == 2**num_qubits
+    batch = len(shape) - 1
+    # the least significant bit is the last axis
+    array = array.reshape(shape[:-1] + (2,) * num_qubits)
+    for indices, matrix in factors:
+        k = len(indices)
+        # out bits k-1, ..., 0 followed by in bits k-1, ..., 0
+        tensor = matrix.reshape((2,) * 2 * k)
+        axes = [batch + num_qubits - 1 - i for i in reversed(indices)]
+        array = np.moveaxis(
+            np.tensordot(tensor, array, axes=(list(range(k, 2 * k)), axes)),
+            list(range(k)), axes)
+    return array.reshape(shape)
+
+
+def unpack_bits(outcomes, num_bits):
+    """
+    Returns the bits of integer outcomes as an array of shape
+    (len(outcomes), num_bits), least significant bit first.
+    """
+    return (np.asarray(outcomes)[:, None] >> np.arange(num_bits)) & 1
+
+
+def parities(outcomes, index_lists):
+    """
+    Returns the parities of the bits of the integer outcomes at each
+    list of indices, as an array of shape (len(outcomes),
+    len(index_lists)).
+    """
+    outcomes = np.asarray(outcomes)
+    result = np.zeros((len(outcomes), len(index_lists)), dtype=int)
+    for k, indices in enumerate(index_lists):
+        masked = outcomes & sum(1 << int(i) for i in indices)
+        while masked.any():
+            result[:, k] ^= masked & 1
+            masked = masked >> 1
+    return result
@@ -0,0 +1,131 @@
+from qsoverlay.experiment_controller import Controller
+from quantumsim import ptm
+import numpy as np
+import pytest
+
+
+paulis = {'I': np.eye(2),
+          'X': np.array([[0, 1], [1, 0]]),
+          'Y': np.array([[0, -1j], [1j, 0]]),
+          'Z': np.diag([1, -1])}
+
+
+def dense_expectation(state, msmt):
+    labels = ['I'] * state.full_dm.no_qubits
+    for qubit, label in msmt.items():
+        labels[state.idx_in_full_dm[qubit]] = label
+    op = paulis[labels[0]]
+    for label in labels[1:]:
+        op = np.kron(paulis[label], op)
+    dm = state.full_dm.to_array() * state.classical_probability
+    return np.trace(op @ dm).real
+
+
+class TestController:
+
+    def test_get_expectation_values(self):
+        c = Controller(qubits=['q0', 'q1', 'q2'])
+        c.state.apply_ptm('q0', ptm.rotate_y_ptm(0.7))
+        c.state.apply_ptm('q1', ptm.rotate_x_ptm(1.3))
+        c.state.cphase('q0', 'q1')
+        c.state.apply_ptm('q2', ptm.gen_amp_damping_ptm(0.8, 0.2))
+        c.state.classical_probability = 0.5
+        msmts = [{'q0': 'X'}, {'q0': 'Z', 'q1': 'Y'}, {'q2': 'Z'},
+                 {'q1': 'X', 'q2': 'X'}]
+
+        values = c.get_expectation_values(msmts)
+
+        reference = c.state.copy()
+        reference.apply_all_pending()
+        reference.ensure_dense('q2')
+        assert np.isclose(reference.trace(), 1)
+        assert np.allclose(values, [dense_expectation(reference, m)
+                                    for m in msmts])
+        assert np.isclose(values[2], 0.6)
+        assert np.isclose(c.state.trace(), 1)
+
+    @pytest.fixture
+    def controller(self):
+        c = Controller(qubits=['q0', 'q1', 'q2', 'q3'])
+        rng = np.random.RandomState(4)
+        for q in c.qubits:
+            c.state.apply_ptm(q, ptm.rotate_y_ptm(3 * rng.rand()))
+        c.state.cphase('q0', 'q1')
+        c.state.cphase('q1', 'q2')
+        # q3 is a classical mixture
+        c.state.apply_ptm('q3', ptm.gen_amp_damping_ptm(0.7, 0.1))
+        c.state.combine_and_apply_single_ptm('q3')
+        c.state.classical_probability = 0.3
+        return c
+
+    def brute_force(self, c, condition):
+        reference = c.state.copy()
+        reference.apply_all_pending()
+        reference.ensure_dense('q3')
+        diag = reference.full_dm.get_diag()
+        total = 0
+        for j, p in enumerate(diag):
+            results = {q: (j >> reference.idx_in_full_dm[q]) & 1
+                       for q in c.qubits}
+            if condition(results):
+                total += p
+        return total * reference.classical_probability / reference.trace()
+
+    def test_get_prob_all_zero(self, controller):
+        for qubits in (['q0'], ['q1', 'q3'], ['q0', 'q1', 'q2', 'q3']):
+            expected = self.brute_force(
+                controller, lambda r: all(r[q] == 0 for q in qubits))
+            assert np.isclose(controller.get_prob_all_zero(qubits), expected)
+
+    def test_get_probabilities(self, controller):
+        queries = [{'q0': 1, 'q2': 0}, {'q3': 1, 'q1': 0},
+                   ('parity', ['q0', 'q1', 'q3'], 1),
+                   ('parity', ['q2', 'q3'], 0), {}]
+        expected = [
+            self.brute_force(controller,
+                             lambda r: r['q0'] == 1 and r['q2'] == 0),
+            self.brute_force(controller,
+                             lambda r: r['q3'] == 1 and r['q1'] == 0),
+            self.brute_force(controller,
+                             lambda r: (r['q0'] + r['q1'] + r['q3']) % 2),
+            self.brute_force(controller,
+                             lambda r: (r['q2'] + r['q3']) % 2 == 0),
+            1]
+        assert np.allclose(controller.get_probabilities(queries), expected)
+
+        with pytest.raises(ValueError):
+            controller.get_probabilities([{'q0': 2}])
+        with pytest.raises(ValueError):
+            controller.get_probabilities([{'q7': 0}])
+        with pytest.raises(ValueError):
+            controller.get_probabilities([('majority', ['q0'], 0)])
+
+    def test_diagonal_read_once(self, controller):
+        calls = []
+        get_diag = controller.state.full_dm.get_diag
+
+        def counting_get_diag():
+            calls.append(1)
+            return get_diag()
+        controller.state.full_dm.get_diag = counting_get_diag
+
+        controller.get_probabilities([{'q1': 1}, ('parity', ['q0'], 0),
+                                      {'q0': 0, 'q3': 1}])
+        assert len(calls) == 1
+
+    def test_sees_state_changes(self):
+        c = Controller(qubits=['q0', 'q1'])
+        c.state.hadamard('q0')
+        c.state.ensure_dense('q1')
+        assert np.isclose(c.get_probabilities([{'q0': 0, 'q1': 0}])[0], 0.5)
+
+        c.state.apply_two_ptm('q0', 'q1', ptm.double_kraus_to_ptm(np.kron(
+            np.array([[0, 1], [1, 0]]), np.eye(2))))
+        assert np.isclose(c.get_probabilities([{'q0': 0, 'q1': 0}])[0], 0)
+
+    def test_zero_trace(self):
+        c = Controller(qubits=['q0'])
+        c.state.ensure_dense('q0')
+        c.state.project_measurement('q0', 1)
+        with pytest.raises(ValueError):
+            c.get_probabilities([{'q0': 0}])
@@ -0,0 +1,204 @@
+from qsoverlay.measurement_models import (
+    CorrelatedMeasurement, apply_factors, population_matrix, parities,
+    unpack_bits)
+from quantumsim.sparsedm import SparseDM
+from quantumsim import ptm
+import numpy as np
+import pytest
+
+
+def dense_kron(factors):
+    matrix = np.ones((1, 1))
+    for factor in factors:
+        matrix = np.kron(factor, matrix)
+    return matrix
+
+
+def dense_factor(indices, matrix, num_qubits):
+    """The 2**n x 2**n matrix of a factor on the qubits indices."""
+    dense = np.zeros((2**num_qubits,) * 2)
+    mask = sum(1 << i for i in indices)
+    for out in range(2**num_qubits):
+        for inp in range(2**num_qubits):
+            if out & ~mask == inp & ~mask:
+                dense[out, inp] = matrix[
+                    sum(((out >> i) & 1) << j for j, i in enumerate(indices)),
+                    sum(((inp >> i) & 1) << j for j, i in enumerate(indices))]
+    return dense
+
+
+@pytest.fixture
+def setup():
+    n = 4
+    rng = np.random.RandomState(0)
+    populations = 0.05 * rng.rand(n)
+    real = 0.9 * np.eye(2**n) + 0.1 * rng.rand(2**n, 2**n) / 2**n
+    real /= real.sum(axis=0)
+    pop_matrix = dense_kron([population_matrix(p) for p in populations])
+    model = CorrelatedMeasurement(list(range(n)), real @ pop_matrix,
+                                  populations, np.random.RandomState(1))
+
+    sdm = SparseDM(n)
+    for bit in range(n):
+        sdm.apply_ptm(bit, ptm.rotate_y_ptm(3 * rng.rand()))
+    for bit in range(n - 1):
+        sdm.cphase(bit, bit + 1)
+    sdm.renormalize()
+    return model, real, sdm
+
+
+class TestHelpers:
+
+    def test_apply_single_qubit_factors(self):
+        rng = np.random.RandomState(2)
+        factors = [rng.rand(2, 2) for _ in range(3)]
+        array = rng.rand(5, 8)
+        assert np.allclose(
+            apply_factors([((n,), f) for n, f in enumerate(factors)], array),
+            array @ dense_kron(factors).T)
+
+    def test_apply_factors(self):
+        rng = np.random.RandomState(3)
+        pair = rng.rand(4, 4)
+        single = rng.rand(2, 2)
+        array = rng.rand(2, 16)
+        result = apply_factors([((3, 1), pair), ((2,), single)], array)
+        expected = array @ dense_factor((3, 1), pair, 4).T @ \
+            dense_factor((2,), single, 4).T
+        assert np.allclose(result, expected)
+
+    def test_unpack_bits(self):
+        assert np.array_equal(unpack_bits([0, 5, 6], 3),
+                              [[0, 0, 0], [1, 0, 1], [0, 1, 1]])
+
+    def test_parities(self):
+        assert np.array_equal(parities([0, 5, 6, 7], [[0], [0, 2], [1, 2]]),
+                              [[0, 0, 0], [1, 0, 1], [0, 1, 0], [1, 0, 0]])
+
+
+class TestCorrelatedMeasurement:
+
+    def test_cc_matrix(self, setup):
+        model, real, _ = setup
+        assert np.allclose(model.cc_matrix, real)
+
+    def test_outcome_distribution(self, setup):
+        model, _, sdm = setup
+        rho_dist = sdm.peak_multiple_measurements([3, 1, 0, 2])
+        rho_vec = model.outcome_distribution(rho_dist)
+        for outcome, p in rho_dist:
+            j = sum(outcome[q] << n for n, q in enumerate(model.qubits))
+            assert np.isclose(rho_vec[j], p)
+        assert np.allclose(
+            model.outcome_distribution(sdm.marginal(model.qubits)), rho_vec)
+
+    def test_shots(self, setup):
+        model, real, sdm = setup
+        rho_dist = sdm.peak_multiple_measurements(model.qubits)
+        shots = model.sample(rho_dist, 20000)
+        assert shots.shape == (20000, 4)
+
+        m_vec = real @ model.outcome_distribution(rho_dist)
+        assert np.allclose(shots.mean(axis=0),
+                           [m_vec[(np.arange(16) >> n) & 1 == 1].sum()
+                            for n in range(4)], atol=0.02)
+
+    def test_averages(self, setup):
+        model, real, sdm = setup
+        output_format = [[0], [1, 2], [0, 1, 3]]
+        rho_dist = sdm.marginal(model.qubits)
+        averages = model.sample(rho_dist, 0, data_type='averages',
+                                output_format=output_format)
+
+        m_vec = real @ model.outcome_distribution(rho_dist)
+        bits = (np.arange(16)[:, None] >> np.arange(4)) & 1
+        expected = [m_vec[bits[:, indices].all(axis=1)].sum()
+                    for indices in output_format]
+        assert np.allclose(averages, expected)
+
+        # the shots of a single qubit are its probability to return 1
+        shots = model.sample(rho_dist, 20000, output_format=[[0], [3]])
+        assert np.allclose(shots.mean(axis=0),
+                           model.sample(rho_dist, 0, data_type='averages',
+                                        output_format=[[0], [3]]),
+                           atol=0.02)
+
+    def test_averages_high_bits(self):
+        model = CorrelatedMeasurement([0, 1, 2], np.eye(8), [0, 0, 0],
+                                      np.random.RandomState(0))
+        rho_dist = np.zeros((2, 2, 2))
+        rho_dist[1, 0, 0] = 1
+        # qubit 2 returns 0, even though it is above the highest 1
+        assert np.allclose(
+            model.sample(rho_dist, 0, data_type='averages',
+                         output_format=[[0], [0, 2], [2]]), [1, 0, 0])
+
+    def test_normalization_error(self, setup):
+        model, _, sdm = setup
+        with pytest.raises(ValueError):
+            model.sample(2 * sdm.marginal(model.qubits), 10)
+
+
+class TestStructuredCrossTalk:
+
+    @pytest.fixture
+    def factors(self):
+        rng = np.random.RandomState(5)
+        factors = []
+        for n in range(5):
+            e0, e1 = 0.02 * rng.rand(2)
+            factors.append(([n], [[1 - e0, e1], [e0, 1 - e1]]))
+        pair = np.eye(4) * 0.95 + 0.05 * rng.rand(4, 4) / 4
+        factors.append(((4, 1), pair / pair.sum(axis=0)))
+        return factors
+
+    def dense(self, factors, n):
+        matrix = np.eye(2**n)
+        for indices, m in factors:
+            matrix = dense_factor(indices, np.array(m), n) @ matrix
+        return matrix
+
+    def test_matches_dense(self, factors):
+        populations = [0.01, 0.02, 0.0, 0.03, 0.01]
+        pop_matrix = dense_kron([population_matrix(p) for p in populations])
+        dense_cc = self.dense(factors, 5)
+        structured = CorrelatedMeasurement(
+            list('abcde'), factors, populations, np.random.RandomState(1))
+        dense = CorrelatedMeasurement(
+            list('abcde'), dense_cc, populations, np.random.RandomState(1))
+
+        assert np.allclose(structured.cc_matrix, dense.cc_matrix)
+        assert np.allclose(structured.cc_matrix @ pop_matrix, dense_cc)
+
+        rho_vec = np.random.RandomState(2).rand(32)
+        rho_vec /= rho_vec.sum()
+        m_vec = structured.apply_cc(rho_vec)
+        assert np.allclose(m_vec, dense.cc_matrix @ rho_vec)
+        assert np.allclose(structured.correct_distribution(m_vec), rho_vec)
+
+        rho_dist = rho_vec.reshape((2,) * 5).transpose()
+        assert np.array_equal(structured.sample(rho_dist, 100),
+                              dense.sample(rho_dist, 100))
+
+    def test_invalid_factors(self):
+        with pytest.raises(ValueError):
+            CorrelatedMeasurement([0, 1], [((0, 1), np.eye(2))], [0, 0],
+                                  np.random.RandomState(0))
+        with pytest.raises(ValueError):
+            CorrelatedMeasurement([0, 1], [((2,), np.eye(2))], [0, 0],
+                                  np.random.RandomState(0))
+
+    def test_many_qubits(self):
+        n = 17
+        model = CorrelatedMeasurement(
+            list(range(n)), [([i], [[0.99, 0.02], [0.01, 0.98]])
+                             for i in range(n)],
+            [0.01] * n, np.random.RandomState(0))
+        rho_vec = np.zeros(2**n)
+        rho_vec[0] = 1
+        shots = model.sample(rho_vec.reshape((2,) * n), 1000,
+                             output_format=[[0, 1], [2]])
+        assert shots.shape == (1000, 2)
+        single = np.array([[0.99, 0.02], [0.01, 0.98]]) @ \
+            np.linalg.inv(population_matrix(0.01))
+        assert np.isclose(model.apply_cc(rho_vec)[0], single[0, 0]**n)
@@ -0,0 +1,72 @@
+"""Measure the startup time of ConfigurableParser and the time to construct
+the gates of many circuits, with and without reusing the compiled gate
+prototypes between circuits.
+
+Usage: python benchmarks/bench_configurable_parser.py [--circuits 200]
+                                                      [--gates 50]
+"""
+
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+
+from quantumsim.qasm import ConfigurableParser
+
+test_dir = os.path.join(os.path.dirname(__file__), '..', 'quantumsim', 'test')
+config_qasm = os.path.join(test_dir, 'config_qasm_5q.json')
+config_sim = os.path.join(test_dir, 'config_simulator.json')
+
+
+def random_circuits(parser, no_circuits, no_gates, rng):
+    """Random circuits of the gates defined in the config, like a
+    randomized benchmarking sweep."""
+    instructions = [instr for instr, spec in parser._instructions.items()
+                    if spec['type'] not in ('none', 'readout')]
+    return [list(rng.choice(instructions, no_gates))
+            for _ in range(no_circuits)]
+
+
+def make_gates(parser, circuits, reuse):
+    """The part of ConfigurableParser._parse_circuit that turns instructions
+    into scheduled gates."""
+    for source in circuits:
+        if not reuse:
+            parser._prototypes.clear()
+        prototypes = [parser.prototype(line) for line in source]
+        qubits = set(q for p in prototypes for q in p.qubits)
+        parser._gates_order_alap(qubits, prototypes, None, None, None)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--circuits", type=int, default=200)
+    parser.add_argument("--gates", type=int, default=50)
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    t_init, cp = timed(lambda: ConfigurableParser(config_qasm, config_sim))
+    t_precompile, _ = timed(cp.precompile)
+    print("config load:       {:8.2f} ms".format(1e3 * t_init))
+    print("precompile {:3d} instructions: {:8.2f} ms".format(
+        len(cp._instructions), 1e3 * t_precompile))
+
+    circuits = random_circuits(cp, args.circuits, args.gates,
+                               np.random.RandomState(0))
+    for name, reuse in (("uncached", False), ("prototypes", True)):
+        cp = ConfigurableParser(config_qasm, config_sim)
+        t_gates, _ = timed(lambda: make_gates(cp, circuits, reuse))
+        print("gates of {} circuits, {:>10}: {:8.2f} ms".format(
+            args.circuits, name, 1e3 * t_gates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the einsum based DensityNP gate kernels with the precompiled
+contraction plans now used by quantumsim.dm_np.
+
+Usage: python benchmarks/bench_dm_np.py [--min-qubits 2] [--max-qubits 15]
+                                       [--threads 1]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+import quantumsim.dm_np as dm_np
+import quantumsim.ptm as ptm
+
+
+def einsum_apply_ptm(dm, no_qubits, bit, one_ptm):
+    in_indices = list(reversed(range(no_qubits)))
+    in_indices[no_qubits - bit - 1] = no_qubits
+    return np.einsum(dm, in_indices, one_ptm, [bit, no_qubits],
+                     list(reversed(range(no_qubits))), optimize=True)
+
+
+def einsum_apply_two_ptm(dm, no_qubits, bit0, bit1, two_ptm):
+    in_indices = list(reversed(range(no_qubits)))
+    in_indices[no_qubits - bit0 - 1] = no_qubits
+    in_indices[no_qubits - bit1 - 1] = no_qubits + 1
+    return np.einsum(dm, in_indices, two_ptm.reshape((4, 4, 4, 4)),
+                     [bit1, bit0, no_qubits + 1, no_qubits],
+                     list(reversed(range(no_qubits))), optimize=True)
+
+
+def einsum_get_diag(dm, no_qubits):
+    no_trace_tensor = np.array([[1, 0, 0, 0], [0, 0, 0, 1]]).T
+    trace_argument = []
+    for i in range(no_qubits):
+        trace_argument.append(no_trace_tensor)
+        trace_argument.append([i, i + no_qubits])
+    return np.einsum(dm, list(reversed(range(no_qubits))), *trace_argument,
+                     list(reversed(range(no_qubits, 2 * no_qubits))),
+                     optimize=True).reshape(2**no_qubits)
+
+
+def einsum_circuit(dm, no_qubits, gates):
+    for bits, gate_ptm in gates:
+        if len(bits) == 1:
+            dm = einsum_apply_ptm(dm, no_qubits, bits[0], gate_ptm)
+        else:
+            dm = einsum_apply_two_ptm(dm, no_qubits, bits[0], bits[1],
+                                      gate_ptm)
+    return dm
+
+
+def plan_circuit(dm, gates):
+    for bits, gate_ptm in gates:
+        if len(bits) == 1:
+            dm.apply_ptm(bits[0], gate_ptm)
+        else:
+            dm.apply_two_ptm(bits[0], bits[1], gate_ptm)
+
+
+def random_gates(no_qubits, one_ptm, two_ptm, rng, length=20):
+    """A layer of single qubit gates followed by two qubit gates on random
+    pairs, so that the einsum path also pays for its non-contiguous
+    results."""
+    gates = []
+    for _ in range(length):
+        bit0, bit1 = rng.choice(no_qubits, 2, replace=False)
+        gates.append(((bit0,), one_ptm))
+        gates.append(((bit0, bit1), two_ptm))
+    return gates
+
+
+def best_time(function, repeat):
+    number = max(1, repeat)
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-qubits", type=int, default=2)
+    parser.add_argument("--max-qubits", type=int, default=15)
+    parser.add_argument("--threads", type=int, default=1,
+                        help="num_threads of the new DensityNP")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    one_ptm = ptm.rotate_x_ptm(0.3)
+    two_ptm = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1]))
+
+    print("{:>3} {:>10} {:>12} {:>12} {:>8}".format(
+        "n", "kernel", "einsum [us]", "plan [us]", "speedup"))
+    for n in range(args.min_qubits, args.max_qubits + 1):
+        dm = dm_np.DensityNP(n, num_threads=args.threads)
+        # fewer repetitions for large states, where a call takes seconds
+        repeat = max(1, 200 // 4**max(0, n - 6))
+        bit, bit0, bit1 = n // 2, 0, n - 1
+        gates = random_gates(n, one_ptm, two_ptm, rng)
+        tensor = dm.dm
+
+        cases = [
+            ("ptm",
+             lambda: einsum_apply_ptm(tensor, n, bit, one_ptm),
+             lambda: dm.apply_ptm(bit, one_ptm)),
+            ("two_ptm",
+             lambda: einsum_apply_two_ptm(tensor, n, bit0, bit1, two_ptm),
+             lambda: dm.apply_two_ptm(bit0, bit1, two_ptm)),
+            ("diag",
+             lambda: einsum_get_diag(tensor, n),
+             lambda: dm.get_diag()),
+            ("circuit",
+             lambda: einsum_circuit(tensor, n, gates),
+             lambda: plan_circuit(dm, gates)),
+        ]
+        for name, old, new in cases:
+            t_old = best_time(old, repeat)
+            t_new = best_time(new, repeat)
+            print("{:>3} {:>10} {:>12.1f} {:>12.1f} {:>8.1f}".format(
+                n, name, 1e6 * t_old, 1e6 * t_new, t_old / t_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare throughput and peak memory of the grammar based QASMParser with
+the line oriented StreamingQASMParser.
+
+Usage: python benchmarks/bench_qasm_parser.py [--circuits 500] [--gates 20]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from quantumsim import qasm
+
+qubit_pars = {'T1': 30000, 'T2': 30000, 'frac1_0': 0.01, 'frac1_1': 0.99}
+single_gates = ['ry90', 'rym90', 'rx180', 'ry180', 'x90', 'i']
+
+
+def random_qasm(no_circuits, no_gates, rng, no_qubits=3):
+    lines = ["qubits {}".format(no_qubits), ""]
+    for i in range(no_circuits):
+        lines.append(".circuit{}".format(i))
+        lines.extend("   prepz q{}".format(q) for q in range(no_qubits))
+        for _ in range(no_gates):
+            q0, q1 = rng.choice(no_qubits, 2, replace=False)
+            if rng.rand() < 0.2:
+                lines.append("   cz q{},q{}".format(q0, q1))
+            elif rng.rand() < 0.2:
+                lines.append("   {{ {} q{} | {} q{} }}".format(
+                    rng.choice(single_gates), q0,
+                    rng.choice(single_gates), q1))
+            else:
+                lines.append("   {} q{}".format(rng.choice(single_gates), q0))
+        lines.append("   measure q0")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--circuits", type=int, default=500)
+    parser.add_argument("--gates", type=int, default=20)
+    args = parser.parse_args()
+
+    source = random_qasm(args.circuits, args.gates, np.random.RandomState(0))
+    no_lines = source.count("\n") + 1
+
+    def grammar():
+        qasm.QASMParser({'default': qubit_pars}).parse(source)
+
+    def streaming():
+        qasm.StreamingQASMParser({'default': qubit_pars}).parse(source)
+
+    def streaming_discard():
+        for _ in qasm.StreamingQASMParser(
+                {'default': qubit_pars}).gen_circuits(source.splitlines()):
+            pass
+
+    print("{} lines, {} circuits".format(no_lines, args.circuits))
+    print("{:>24} {:>12} {:>14}".format("parser", "lines/s", "peak [MiB]"))
+    for name, function in (("QASMParser", grammar),
+                           ("StreamingQASMParser", streaming),
+                           ("  gen_circuits only", streaming_discard)):
+        elapsed, peak = measure(function)
+        print("{:>24} {:>12.0f} {:>14.1f}".format(
+            name, no_lines / elapsed, peak / 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the Python loop of the old SparseDM.peak_multiple_measurements and
+the uncached popcount of majority_vote with the vectorized versions.
+
+Usage: python benchmarks/bench_sparsedm_readout.py [--min-qubits 9]
+                                                  [--max-qubits 15]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from quantumsim.sparsedm import SparseDM
+
+
+def loop_marginal(diagonal, mask):
+    probs = {}
+    for idx, prob in enumerate(diagonal):
+        if idx & mask in probs:
+            probs[idx & mask] += prob
+        else:
+            probs[idx & mask] = prob
+    return probs
+
+
+def loop_majority(diagonal, no_qubits, flip):
+    adresses = np.arange(2**no_qubits) ^ flip
+    majority = np.zeros_like(adresses)
+    for _ in range(no_qubits):
+        majority += adresses & 1
+        adresses >>= 1
+    return np.dot(majority > no_qubits / 2, diagonal)
+
+
+def dense_sdm(no_qubits, rng):
+    sdm = SparseDM(no_qubits, backend="numpy")
+    for bit in range(no_qubits):
+        sdm.rotate_y(bit, rng.uniform(0, np.pi))
+    for bit in range(no_qubits - 1):
+        sdm.cphase(bit, bit + 1)
+    sdm.apply_all_pending()
+    return sdm
+
+
+def best_time(function, number):
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-qubits", type=int, default=9)
+    parser.add_argument("--max-qubits", type=int, default=15)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    print("{:>3} {:>10} {:>12} {:>12} {:>8}".format(
+        "n", "readout", "loop [ms]", "new [ms]", "speedup"))
+    for n in range(args.min_qubits, args.max_qubits + 1):
+        sdm = dense_sdm(n, rng)
+        # measure every other qubit, as for the ancillas of a surface code
+        bits = list(range(0, n, 2))
+        mask = sum(1 << sdm.idx_in_full_dm[b] for b in bits)
+        number = max(1, 2**(12 - n))
+
+        cases = [
+            ("marginal",
+             lambda: loop_marginal(sdm.full_dm.get_diag(), mask),
+             lambda: sdm.peak_multiple_measurements(bits)),
+            ("majority",
+             lambda: loop_majority(sdm.full_dm.get_diag(), n, 0),
+             lambda: sdm.majority_vote(bits)),
+        ]
+        for name, old, new in cases:
+            t_old = best_time(old, number)
+            t_new = best_time(new, number)
+            print("{:>3} {:>10} {:>12.3f} {:>12.3f} {:>8.1f}".format(
+                n, name, 1e3 * t_old, 1e3 * t_new, t_old / t_new))
+
+
+if __name__ == "__main__":
+    main()
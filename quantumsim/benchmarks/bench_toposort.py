@@ -0,0 +1,111 @@
+"""Scaling of tp.partial_greedy_toposort, as used by Circuit.order(), with
+the number of gates, compared to the former implementation.
+
+Usage: python benchmarks/bench_toposort.py [--qubits 17] [--max-gates 20000]
+                                           [--max-reference-gates 200]
+"""
+
+import argparse
+import random
+import time
+
+from quantumsim import tp
+
+
+def reference_toposort(partial_orders, targets=set()):
+    """The implementation of tp.partial_greedy_toposort before it was
+    rewritten with incremental bookkeeping."""
+
+    targets = set(targets)
+
+    # drop out empty lists
+    partial_orders = [po for po in partial_orders if po]
+
+    order_dicts = []
+    for n, p in enumerate(partial_orders):
+        order_dict = {i: j for i, j in zip(p[1:], p)}
+        order_dicts.append(order_dict)
+
+    trees = []
+    for n, p in enumerate(partial_orders):
+        tree = []
+        to_do = [(None, p[-1])]
+        while to_do:
+            n, x = to_do.pop()
+            tree.append((n, x))
+            for n2, o2 in enumerate(order_dicts):
+                x2 = o2.get(x)
+                if x2 is not None:
+                    to_do.append((n2, x2))
+
+        lists_used = {n for n, x in tree if n in targets}
+        trees.append((tree, lists_used))
+
+    result = []
+    all_used = set()
+    while trees != []:
+        trees.sort(key=lambda xy: len(all_used | xy[1]), reverse=True)
+        smallest = trees.pop()
+        all_used |= smallest[1]
+        smallest = smallest[0]
+        smallest.reverse()
+        smallest = [x for n, x in smallest]
+
+        new_trees = []
+        for layer, i in trees:
+            layer2 = [(n, x) for n, x in layer if x not in smallest]
+            new_trees.append((layer2, i))
+
+        trees = new_trees
+
+        for s in smallest:
+            if s not in result:
+                result.append(s)
+
+    return result
+
+
+def random_circuit(no_qubits, no_gates, rng):
+    """Per-qubit lists of gate numbers of a random circuit of single and
+    two-qubit gates, and every second qubit as a measured target."""
+    lists = [[] for _ in range(no_qubits)]
+    for gate in range(no_gates):
+        for qubit in rng.sample(range(no_qubits), rng.choice([1, 2])):
+            lists[qubit].append(gate)
+    return lists, list(range(0, no_qubits, 2))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--qubits", type=int, default=17)
+    parser.add_argument("--max-gates", type=int, default=20000)
+    parser.add_argument("--max-reference-gates", type=int, default=200,
+                        help="the former implementation is exponential in "
+                             "the worst case, skip it above this size")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print("{:>8} {:>16} {:>12} {:>6}".format(
+        "gates", "reference [ms]", "new [ms]", "same"))
+    no_gates = 25
+    while no_gates <= args.max_gates:
+        lists, targets = random_circuit(args.qubits, no_gates, rng)
+        t_new, new = timed(tp.partial_greedy_toposort, lists, targets)
+        if no_gates <= args.max_reference_gates:
+            t_ref, ref = timed(reference_toposort, lists, targets)
+            print("{:>8} {:>16.2f} {:>12.2f} {:>6}".format(
+                no_gates, 1e3 * t_ref, 1e3 * t_new, str(ref == new)))
+        else:
+            print("{:>8} {:>16} {:>12.2f} {:>6}".format(
+                no_gates, "-", 1e3 * t_new, "-"))
+        no_gates *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2016 Brian Tarasinski
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+"""Registry of the density matrix backends that SparseDM can use.
+
+A backend is a callable `density_class(no_qubits, data=None)` returning an
+object with the interface of dm_np.DensityNP. Backends are registered by
+name with a loader and only imported when first requested, so that e.g. the
+CUDA backend does not cost a pycuda import on machines that never use it.
+
+If no backend is requested, the one named by the environment variable
+QUANTUMSIM_BACKEND is used, otherwise "cuda" if it can be loaded, and
+"numpy" if not.
+"""
+
+import functools
+import os
+
+ENVIRONMENT_VARIABLE = "QUANTUMSIM_BACKEND"
+
+_loaders = {}
+_loaded = {}
+_default_name = None
+
+
+def register(name, loader):
+    """Register a backend under `name`.
+
+    loader: a callable without arguments that imports the backend and returns
+    its density class. It is called on the first `get(name)`, and may raise
+    ImportError if the backend is not available on this machine.
+    """
+    _loaders[name] = loader
+    _loaded.pop(name, None)
+
+
+def get(name=None):
+    """Return the density class of the backend `name`, or of the default
+    backend if `name` is None.
+    """
+    if name is None:
+        name = default_name()
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    try:
+        loader = _loaders[name]
+    except KeyError:
+        raise ValueError("Unknown backend '{}', registered backends are "
+                         "{}".format(name, sorted(_loaders)))
+    _loaded[name] = loader()
+    return _loaded[name]
+
+
+def available():
+    """Return the names of all registered backends that can be loaded."""
+    names = []
+    for name in sorted(_loaders):
+        try:
+            get(name)
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def default_name():
+    """Return the name of the backend used if none is requested."""
+    global _default_name
+    name = os.environ.get(ENVIRONMENT_VARIABLE)
+    if name:
+        return name
+    if _default_name is None:
+        try:
+            get("cuda")
+            _default_name = "cuda"
+        except Exception:
+            _default_name = "numpy"
+    return _default_name
+
+
+def _load_numpy():
+    from . import dm_np
+    return dm_np.DensityNP
+
+
+def _load_numpy_threaded():
+    from . import dm_np
+    return functools.partial(dm_np.DensityNP, num_threads=None)
+
+
+def _load_cuda():
+    from . import dm10
+    return dm10.Density
+
+
+register("numpy", _load_numpy)
+register("numpy-threaded", _load_numpy_threaded)
+register("cuda", _load_cuda)
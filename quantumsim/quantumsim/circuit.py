@@ -10,10 +10,12 @@ import numpy as np
 
 from . import tp
 from . import ptm
+from . import profiling
 
 import functools
 import copy
 import warnings
+from collections import namedtuple
 
 
 class Qubit:
@@ -101,6 +103,97 @@ class VariableDecoherenceQubit(Qubit):
             1 / deph_rate)
 
 
+def _rotate_x_ptm(angle, dephasing_angle, dephasing_axis):
+    p = ptm.rotate_x_ptm(angle)
+    if dephasing_angle:
+        p = np.dot(p, ptm.dephasing_ptm(0, dephasing_angle, dephasing_angle))
+    if dephasing_axis:
+        p = np.dot(p, ptm.dephasing_ptm(dephasing_axis, 0, 0))
+    return p
+
+
+def _rotate_y_ptm(angle, dephasing_angle, dephasing_axis):
+    p = ptm.rotate_y_ptm(angle)
+    if dephasing_angle:
+        p = np.dot(p, ptm.dephasing_ptm(dephasing_angle, 0, dephasing_angle))
+    if dephasing_axis:
+        p = np.dot(p, ptm.dephasing_ptm(0, dephasing_axis, 0))
+    return p
+
+
+def _rotate_z_ptm(angle, dephasing):
+    p = ptm.rotate_z_ptm(angle)
+    if dephasing:
+        p = np.dot(p, ptm.dephasing_ptm(dephasing, dephasing, 0))
+    return p
+
+
+def _amp_ph_damp_ptm(duration, t1, t2):
+    if np.allclose(t2, 2 * t1):
+        t_phi = np.inf
+    else:
+        t_phi = 1 / (1 / t2 - 1 / (2 * t1)) / 2
+
+    gamma = 1 - np.exp(-duration / t1)
+    lamda = 1 - np.exp(-duration / t_phi)
+    return ptm.amp_ph_damping_ptm(gamma, lamda)
+
+
+def _iswap_rotation_ptm(angle, dephase_var):
+    if angle != 0:
+        d = np.exp(-dephase_var * (2*angle/np.pi)**2 / 2)
+        d4 = np.exp(-dephase_var * (2*angle/np.pi)**2 / 8)
+    else:
+        d = 1
+        d4 = 1
+    assert d >= 0
+    assert d <= 1
+
+    kraus0 = np.array([
+        [1, 0, 0, 0],
+        [0, np.cos(angle)*d, 1j*np.sin(angle)*d, 0],
+        [0, 1j*np.sin(angle)*d, np.cos(angle)*d, 0],
+        [0, 0, 0, 1]
+    ])
+    kraus1 = np.exp(1j*angle)*np.sqrt(1-d**2)/2*np.array([
+        [0, 0, 0, 0],
+        [0, 1, 1, 0],
+        [0, 1, 1, 0],
+        [0, 0, 0, 0]
+    ])
+    kraus2 = np.exp(-1j*angle)*np.sqrt(1-d**2)/2*np.array([
+        [0, 0, 0, 0],
+        [0, 1, -1, 0],
+        [0, -1, 1, 0],
+        [0, 0, 0, 0]
+    ])
+
+    p0 = ptm.double_krauses_to_ptm([
+        np.diag([1, 1, d4, d4]),
+        np.diag([0, 0, np.sqrt(1-d4**2), np.sqrt(1-d4**2)])])
+    p1 = ptm.double_krauses_to_ptm([kraus0, kraus1, kraus2])
+    return p0 @ p1 @ p0
+
+
+def _cphase_rotation_ptm(angle, dephase_var):
+    if angle != 0:
+        d = np.exp(-dephase_var * (angle/np.pi)**2 / 2)
+        d2 = np.exp(-dephase_var * (angle/np.pi)**2 / 4)
+    else:
+        d = 1
+        d2 = 1
+    assert d >= 0
+    assert d <= 1
+
+    p0 = ptm.double_krauses_to_ptm([
+        np.diag([1, 1, 1, np.exp(1j * angle)*d]),
+        np.diag([0, 0, 0, np.exp(1j * angle) * np.sqrt(1-d**2)])])
+    p1 = ptm.double_krauses_to_ptm([
+        np.diag([1, 1, d2, d2]),
+        np.diag([0, 0, np.sqrt(1-d2**2), np.sqrt(1-d2**2)])])
+    return p0 @ p1
+
+
 class Gate:
 
     def __init__(self, time, conditional_bit=None):
@@ -180,16 +273,9 @@ class RotateY(SinglePTMGate):
             **kwargs):
         """ A rotation around the y-axis on the bloch sphere by `angle`.
         """
-        p = ptm.rotate_y_ptm(angle)
-        if dephasing_angle:
-            p = np.dot(
-                p,
-                ptm.dephasing_ptm(
-                    dephasing_angle,
-                    0,
-                    dephasing_angle))
-        if dephasing_axis:
-            p = np.dot(p, ptm.dephasing_ptm(0, dephasing_axis, 0))
+        p = ptm.ptm_cache.get(
+            "RotateY", (angle, dephasing_angle, dephasing_axis),
+            _rotate_y_ptm)
 
         self.dephasing_axis = dephasing_axis
         self.dephasing_angle = dephasing_angle
@@ -211,17 +297,9 @@ class RotateY(SinglePTMGate):
             self.label = r"$R_y(%g)$" % angle
 
     def adjust(self, angle):
-        p = ptm.rotate_y_ptm(angle)
-        if self.dephasing_angle:
-            p = np.dot(
-                p,
-                ptm.dephasing_ptm(
-                    self.dephasing_angle,
-                    0,
-                    self.dephasing_angle))
-        if self.dephasing_axis:
-            p = np.dot(p, ptm.dephasing_ptm(0, self.dephasing_axis, 0))
-        self.ptm = p
+        self.ptm = ptm.ptm_cache.get(
+            "RotateY", (angle, self.dephasing_angle, self.dephasing_axis),
+            _rotate_y_ptm)
         self.set_labels(angle)
 
 
@@ -247,16 +325,9 @@ class RotateX(SinglePTMGate):
         """ A rotation around the x-axis on the bloch sphere by `angle`.
         """
 
-        p = ptm.rotate_x_ptm(angle)
-        if dephasing_angle:
-            p = np.dot(
-                p,
-                ptm.dephasing_ptm(
-                    0,
-                    dephasing_angle,
-                    dephasing_angle))
-        if dephasing_axis:
-            p = np.dot(p, ptm.dephasing_ptm(dephasing_axis, 0, 0))
+        p = ptm.ptm_cache.get(
+            "RotateX", (angle, dephasing_angle, dephasing_axis),
+            _rotate_x_ptm)
 
         self.dephasing_axis = dephasing_axis
         self.dephasing_angle = dephasing_angle
@@ -279,17 +350,9 @@ class RotateX(SinglePTMGate):
             self.label = r"$R_x(%g)$" % angle
 
     def adjust(self, angle):
-        p = ptm.rotate_x_ptm(angle)
-        if self.dephasing_angle:
-            p = np.dot(
-                p,
-                ptm.dephasing_ptm(
-                    self.dephasing_angle,
-                    0,
-                    self.dephasing_angle))
-        if self.dephasing_axis:
-            p = np.dot(p, ptm.dephasing_ptm(0, self.dephasing_axis, 0))
-        self.ptm = p
+        self.ptm = ptm.ptm_cache.get(
+            "RotateX", (angle, self.dephasing_angle, self.dephasing_axis),
+            _rotate_x_ptm)
         self.set_labels(angle)
 
 
@@ -298,9 +361,7 @@ class RotateZ(SinglePTMGate):
     def __init__(self, bit, time, angle, dephasing=None, **kwargs):
         """ A rotation around the z-axis on the bloch sphere by `angle`.
         """
-        p = ptm.rotate_z_ptm(angle)
-        if dephasing:
-            p = np.dot(p, ptm.dephasing_ptm(dephasing, dephasing, 0))
+        p = ptm.ptm_cache.get("RotateZ", (angle, dephasing), _rotate_z_ptm)
 
         self.dephasing = dephasing
 
@@ -321,10 +382,8 @@ class RotateZ(SinglePTMGate):
             self.label = r"$R_z(%g)$" % angle
 
     def adjust(self, angle):
-        p = ptm.rotate_z_ptm(angle)
-        if self.dephasing:
-            p = np.dot(p, ptm.dephasing_ptm(self.dephasing, self.dephasing, 0))
-        self.ptm = p
+        self.ptm = ptm.ptm_cache.get(
+            "RotateZ", (angle, self.dephasing), _rotate_z_ptm)
 
         self.set_labels(angle)
 
@@ -393,15 +452,9 @@ class AmpPhDamp(SinglePTMGate, IdlingGate):
 
         self.duration = duration
 
-        if np.allclose(t2, 2 * t1):
-            t_phi = np.inf
-        else:
-            t_phi = 1 / (1 / t2 - 1 / (2 * t1)) / 2
-
-        gamma = 1 - np.exp(-duration / t1)
-        lamda = 1 - np.exp(-duration / t_phi)
-        super().__init__(bit, time, ptm.amp_ph_damping_ptm(gamma, lamda),
-                         **kwargs)
+        p = ptm.ptm_cache.get("AmpPhDamp", (duration, t1, t2),
+                              _amp_ph_damp_ptm)
+        super().__init__(bit, time, p, **kwargs)
         self.label = r"$%g\,\mathrm{ns}$" % self.duration
 
     def plot_gate(self, ax, coords):
@@ -598,13 +651,10 @@ class ISwap(TwoPTMGate):
             [0, 0, 0, 0]
         ])
 
-        p1 = ptm.double_kraus_to_ptm(kraus0) +\
-            ptm.double_kraus_to_ptm(kraus1) +\
-            ptm.double_kraus_to_ptm(kraus2)
-
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, d4, d4])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d4**2),
-                                             np.sqrt(1-d4**2)]))
+        p1 = ptm.double_krauses_to_ptm([kraus0, kraus1, kraus2])
+        p0 = ptm.double_krauses_to_ptm([
+            np.diag([1, 1, d4, d4]),
+            np.diag([0, 0, np.sqrt(1-d4**2), np.sqrt(1-d4**2)])])
 
         super().__init__(bit0, bit1, p0 @ p1 @ p0, time, **kwargs)
 
@@ -632,45 +682,12 @@ class ISwapRotation(TwoPTMGate):
         0  i*sin(theta)     cos(theta)      0
         0  0                0               1
         """
-        if angle != 0:
-            d = np.exp(-dephase_var * (2*angle/np.pi)**2 / 2)
-            d4 = np.exp(-dephase_var * (2*angle/np.pi)**2 / 8)
-        else:
-            d = 1
-            d4 = 1
-        assert d >= 0
-        assert d <= 1
-
-        kraus0 = np.array([
-            [1, 0, 0, 0],
-            [0, np.cos(angle)*d, 1j*np.sin(angle)*d, 0],
-            [0, 1j*np.sin(angle)*d, np.cos(angle)*d, 0],
-            [0, 0, 0, 1]
-        ])
-        kraus1 = np.exp(1j*angle)*np.sqrt(1-d**2)/2*np.array([
-            [0, 0, 0, 0],
-            [0, 1, 1, 0],
-            [0, 1, 1, 0],
-            [0, 0, 0, 0]
-        ])
-        kraus2 = np.exp(-1j*angle)*np.sqrt(1-d**2)/2*np.array([
-            [0, 0, 0, 0],
-            [0, 1, -1, 0],
-            [0, -1, 1, 0],
-            [0, 0, 0, 0]
-        ])
-
         self.angle = angle
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, d4, d4])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d4**2),
-                                             np.sqrt(1-d4**2)]))
-        p1 = ptm.double_kraus_to_ptm(kraus0) +\
-            ptm.double_kraus_to_ptm(kraus1) +\
-            ptm.double_kraus_to_ptm(kraus2)
-
         self.dephase_var = dephase_var
 
-        super().__init__(bit0, bit1, p0 @ p1 @ p0, time, **kwargs)
+        p = ptm.ptm_cache.get("ISwapRotation", (angle, dephase_var),
+                              _iswap_rotation_ptm)
+        super().__init__(bit0, bit1, p, time, **kwargs)
 
     def plot_gate(self, ax, coords):
         bit0 = self.involved_qubits[-2]
@@ -685,44 +702,9 @@ class ISwapRotation(TwoPTMGate):
         ax.add_line(line)
 
     def adjust(self, angle):
-
-        if angle != 0:
-            d = np.exp(-self.dephase_var * (2*angle/np.pi)**2 / 2)
-            d4 = np.exp(-self.dephase_var * (2*angle/np.pi)**2 / 8)
-        else:
-            d = 1
-            d4 = 1
-        assert d >= 0
-        assert d <= 1
-
-        kraus0 = np.array([
-            [1, 0, 0, 0],
-            [0, np.cos(angle)*d, 1j*np.sin(angle)*d, 0],
-            [0, 1j*np.sin(angle)*d, np.cos(angle)*d, 0],
-            [0, 0, 0, 1]
-        ])
-        kraus1 = np.exp(1j*angle)*np.sqrt(1-d**2)/2*np.array([
-            [0, 0, 0, 0],
-            [0, 1, 1, 0],
-            [0, 1, 1, 0],
-            [0, 0, 0, 0]
-        ])
-        kraus2 = np.exp(-1j*angle)*np.sqrt(1-d**2)/2*np.array([
-            [0, 0, 0, 0],
-            [0, 1, -1, 0],
-            [0, -1, 1, 0],
-            [0, 0, 0, 0]
-        ])
-
         self.angle = angle
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, d4, d4])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d4**2),
-                                             np.sqrt(1-d4**2)]))
-        p1 = ptm.double_kraus_to_ptm(kraus0) +\
-            ptm.double_kraus_to_ptm(kraus1) +\
-            ptm.double_kraus_to_ptm(kraus2)
-
-        self.two_ptm = p0 @ p1 @ p0
+        self.two_ptm = ptm.ptm_cache.get(
+            "ISwapRotation", (angle, self.dephase_var), _iswap_rotation_ptm)
 
 
 class Swap(TwoPTMGate):
@@ -768,11 +750,12 @@ class NoisyCPhase(TwoPTMGate):
         assert d >= 0
         assert d <= 1
 
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -d])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, 0, -np.sqrt(1-d**2)]))
-        p1 = ptm.double_kraus_to_ptm(np.diag([1, 1, d2, d2])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d2**2),
-                                             np.sqrt(1-d2**2)]))
+        p0 = ptm.double_krauses_to_ptm([
+            np.diag([1, 1, 1, -d]),
+            np.diag([0, 0, 0, -np.sqrt(1-d**2)])])
+        p1 = ptm.double_krauses_to_ptm([
+            np.diag([1, 1, d2, d2]),
+            np.diag([0, 0, np.sqrt(1-d2**2), np.sqrt(1-d2**2)])])
 
         super().__init__(bit0, bit1, p0 @ p1, time, **kwargs)
 
@@ -781,52 +764,17 @@ class CPhaseRotation(TwoPTMGate):
 
     def __init__(self, bit0, bit1, angle, time, dephase_var=0, **kwargs):
 
-        if angle != 0:
-            d = np.exp(-dephase_var * (angle/np.pi)**2 / 2)
-            d2 = np.exp(-dephase_var * (angle/np.pi)**2 / 4)
-        else:
-            d = 1
-            d2 = 1
-        assert d >= 0
-        assert d <= 1
-
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, 1,
-                                              np.exp(1j * angle)*d])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, 0,
-                                             np.exp(1j * angle) *
-                                             np.sqrt(1-d**2)]))
-
-        p1 = ptm.double_kraus_to_ptm(np.diag([1, 1, d2, d2])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d2**2),
-                                             np.sqrt(1-d2**2)]))
-
         self.angle = angle
         self.dephase_var = dephase_var
 
-        super().__init__(bit0, bit1, p0 @ p1, time, **kwargs)
+        p = ptm.ptm_cache.get("CPhaseRotation", (angle, dephase_var),
+                              _cphase_rotation_ptm)
+        super().__init__(bit0, bit1, p, time, **kwargs)
 
     def adjust(self, angle):
-
-        if angle != 0:
-            d = np.exp(-self.dephase_var * (angle/np.pi)**2 / 2)
-            d2 = np.exp(-self.dephase_var * (angle/np.pi)**2 / 4)
-        else:
-            d = 1
-            d2 = 1
-        assert d >= 0
-        assert d <= 1
-
-        p0 = ptm.double_kraus_to_ptm(np.diag([1, 1, 1,
-                                              np.exp(1j * angle)*d])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, 0,
-                                             np.exp(1j * angle) *
-                                             np.sqrt(1-d**2)]))
-
-        p1 = ptm.double_kraus_to_ptm(np.diag([1, 1, d2, d2])) +\
-            ptm.double_kraus_to_ptm(np.diag([0, 0, np.sqrt(1-d2**2),
-                                             np.sqrt(1-d2**2)]))
         self.angle = angle
-        self.two_ptm = p0 @ p1
+        self.two_ptm = ptm.ptm_cache.get(
+            "CPhaseRotation", (angle, self.dephase_var), _cphase_rotation_ptm)
 
 
 class Measurement(Gate):
@@ -1055,6 +1003,12 @@ class ClassicalNOT(Gate):
         sdm.classical[self.bit] = 1 - sdm.classical[self.bit]
 
 
+DenseWidth = namedtuple("DenseWidth", ["peak", "integrated"])
+CostEstimate = namedtuple("CostEstimate", [
+    "sweeps", "peak_qubits", "mean_qubits", "peak_bytes", "gate_bytes",
+    "bytes", "flops"])
+
+
 class Circuit:
 
     gate_classes = {"cphase": CPhase,
@@ -1073,6 +1027,10 @@ class Circuit:
         self.gates = []
         self.title = title
 
+        # qubit name -> gates involving it, see gates_by_qubit
+        self._qubit_index = {}
+        self._indexed_ids = ()
+
     def get_qubit_names(self):
         """Return the names of all qubits in the circuit
         """
@@ -1175,6 +1133,29 @@ class Circuit:
 
         return super().__getattribute__(name)
 
+    def gates_by_qubit(self):
+        """Return a dictionary from qubit names to the gates involving that
+        qubit, sorted by time.
+
+        The underlying index is updated incrementally with the gates appended
+        to `self.gates` since the last call, and rebuilt if any of the gates
+        indexed before were replaced, removed or reordered (compared by
+        identity). Changes to the qubits of a gate already in the list are
+        not detected.
+        """
+        ids = tuple(map(id, self.gates))
+        no_indexed = len(self._indexed_ids)
+        if ids[:no_indexed] != self._indexed_ids:
+            self._qubit_index = {}
+            no_indexed = 0
+        for gate in self.gates[no_indexed:]:
+            for qb in dict.fromkeys(_gate_qubits(gate)):
+                self._qubit_index.setdefault(qb, []).append(gate)
+        self._indexed_ids = ids
+
+        return {qb: sorted(gates, key=lambda g: g.time)
+                for qb, gates in self._qubit_index.items()}
+
     def add_waiting_gates(self, tmin=None, tmax=None, only_qubits=None):
         """Add waiting gates to all qubits in the circuit.
 
@@ -1193,15 +1174,15 @@ class Circuit:
         for each qubit.
 
         """
-        all_gates = list(sorted(self.gates, key=lambda g: g.time))
-
-        if not all_gates and (tmin is None or tmax is None):
+        if not self.gates and (tmin is None or tmax is None):
             return
 
         if tmin is None:
-            tmin = all_gates[0].time
+            tmin = min(gate.time for gate in self.gates)
         if tmax is None:
-            tmax = all_gates[-1].time
+            tmax = max(gate.time for gate in self.gates)
+
+        gates_by_qubit = self.gates_by_qubit()
 
         if not isinstance(tmin, dict):
             tmin = {qb.name: tmin for qb in self.qubits}
@@ -1214,9 +1195,8 @@ class Circuit:
                             if qb.name in only_qubits]
 
         for b in qubits_to_do:
-            gts = [
-                gate for gate in all_gates if gate.involves_qubit(
-                    str(b)) and tmin[b.name] <= gate.time <= tmax[b.name]]
+            gts = [gate for gate in gates_by_qubit.get(b.name, ())
+                   if tmin[b.name] <= gate.time <= tmax[b.name]]
 
             if not gts:
                 gate = b.make_idling_gate(tmin[b.name], tmax[b.name])
@@ -1254,31 +1234,51 @@ class Circuit:
                             gate.autogenerated = True
                             self.add_gate(gate)
 
-    def order(self):
+    def order(self, strategy="measurements_first"):
         """ Reorder the gates in the circuit so that they are applied in
         temporal order. If any freedom exists when choosing the order of
-        commuting gates, the order is chosen so that measurement gates are
+        commuting gates, it is used according to `strategy`:
+
+        "measurements_first" (default): measurement gates are
         applied "as soon as possible"; this means that when applying to a
         SparseDM, the measured qubits can be removed, which reduces
         computational cost.
 
+        "min_width": gates are ordered so that the number of qubits in the
+        dense part of a SparseDM stays small, delaying gates that entangle
+        further qubits and advancing measurements. Use dense_width to
+        compare the predicted cost of both orders.
+
         This function should always be called after defining the circuit and
         before applying it.
 
-        See also: Circuit.apply_to
+        See also: Circuit.apply_to, Circuit.dense_width
         """
         all_gates = list(enumerate(sorted(self.gates, key=lambda g: g.time)))
 
-        gts_list = []
-        targets = []
-        for n, b in enumerate(self.qubits):
-            gts = [n for n, gate in all_gates if gate.involves_qubit(str(b))]
-            if any(all_gates[g][1].is_measurement and all_gates[g][
-                   1].involved_qubits[-1] == b.name for g in gts):
-                targets.append(n)
-            gts_list.append(gts)
-
-        order = tp.partial_greedy_toposort(gts_list, targets=targets)
+        qubit_numbers = {b.name: n for n, b in enumerate(self.qubits)}
+        gts_list = [[] for _ in self.qubits]
+        targets = set()
+        for n, gate in all_gates:
+            for qb in dict.fromkeys(_gate_qubits(gate)):
+                if qb in qubit_numbers:
+                    gts_list[qubit_numbers[qb]].append(n)
+            if gate.is_measurement and \
+                    gate.involved_qubits[-1] in qubit_numbers:
+                targets.add(qubit_numbers[gate.involved_qubits[-1]])
+
+        if strategy == "measurements_first":
+            order = tp.partial_greedy_toposort(gts_list, targets=targets)
+        elif strategy == "min_width":
+            classical = self._classical_bit_names()
+            effects = [_dense_effect(gate, classical)
+                       for n, gate in all_gates]
+            order = tp.min_width_toposort(
+                gts_list,
+                entangles=[qbs if len(qbs) > 1 else () for qbs, m in effects],
+                measures=[m for qbs, m in effects])
+        else:
+            raise ValueError("Unknown ordering strategy '{}'".format(strategy))
 
         for n, i in enumerate(order):
             all_gates[i][1].annotation = "%d" % n
@@ -1289,20 +1289,231 @@ class Circuit:
 
         self.gates = new_order
 
+    def dense_width(self):
+        """Predict the number of qubits in the dense part of a SparseDM while
+        the gates are applied in their current order.
+
+        A qubit is counted as dense from the first gate entangling it with
+        another qubit until it is measured; single qubit gates are assumed
+        to be cached by SparseDM. Returns a DenseWidth tuple of the peak
+        number of dense qubits and its sum over all gates, which
+        approximate the memory and the run time of the simulation. Pending
+        gates applied after the last gate (see SparseDM.apply_all_pending)
+        are not counted.
+
+        See also: Circuit.estimate_cost
+        """
+        replay = _DenseReplay(self._classical_bit_names())
+        peak = integrated = 0
+        for gate in self.gates:
+            width = replay.apply_gate(gate)
+            peak = max(peak, width)
+            integrated += width
+        return DenseWidth(peak, integrated)
+
+    def estimate_cost(self, initial_dense=(), apply_all_pending=True):
+        """Estimate the cost of applying the circuit to a SparseDM, without
+        touching any density matrix.
+
+        The transitions of the SparseDM (ensure_dense, cached single qubit
+        gates, project_measurement) are replayed on the qubit names only.
+        initial_dense: the qubits that are already in the dense part of the
+        SparseDM, e.g. `sdm.idx_in_full_dm`. A cached gate on a classical
+        qubit is assumed to make it dense at its measurement if it can
+        create coherences, and conditional gates are counted as if their
+        control bit were 1.
+
+        Returns a CostEstimate with
+            sweeps: the number of passes over the dense density matrix (PTM
+                applications, added ancillas and measurement projections),
+            peak_qubits, mean_qubits: the peak and the average over gates of
+                `full_dm.no_qubits`,
+            peak_bytes: the size of the dense density matrix at its peak
+                (DensityNP keeps a second buffer of the same size),
+            gate_bytes: the bytes read and written for each gate,
+            bytes, flops: the totals over the whole circuit.
+
+        The arithmetic is the same for all backends, which store float64
+        tensors in the Pauli basis, so the estimate does not depend on it.
+        Costs of pending gates applied at the end (if `apply_all_pending`)
+        are included in the totals, but not in gate_bytes.
+
+        See also: Circuit.apply_to, Circuit.dense_width
+        """
+        replay = _DenseReplay(self._classical_bit_names(), initial_dense)
+        peak = replay.no_qubits
+        integrated = 0
+        gate_bytes = []
+        for gate in self.gates:
+            width = replay.apply_gate(gate)
+            peak = max(peak, width)
+            integrated += width
+            gate_bytes.append(replay.take_cost()[1])
+        if apply_all_pending:
+            peak = max(peak, replay.apply_all_pending())
+
+        mean = integrated / len(self.gates) if self.gates else 0.
+        return CostEstimate(
+            sweeps=replay.sweeps, peak_qubits=peak, mean_qubits=mean,
+            peak_bytes=8 * 4**peak, gate_bytes=gate_bytes,
+            bytes=replay.total_bytes, flops=replay.total_flops)
+
+    def _classical_bit_names(self):
+        return {qb.name for qb in self.qubits if isinstance(qb, ClassicalBit)}
+
+    def fuse_two_qubit_blocks(self):
+        """Merge every block of consecutive gates acting only on the same
+        two qubits into a single TwoPTMGate, so that applying the block
+        costs one two qubit PTM application on the full density matrix.
+
+        A block starts at a two qubit PTM (or unconditional CPhase) gate and
+        contains the following two qubit and single qubit PTM gates on the
+        same pair, up to the last two qubit gate before any other gate
+        touches either qubit. The fused gate is placed where the last two
+        qubit gate of the block was, and keeps the merged gates in
+        `fused_gates`. Its PTM is computed now, so fuse again after
+        adjusting any of the merged gates.
+
+        Call this after Circuit.order().
+
+        Returns the number of two qubit PTM applications eliminated.
+        """
+        blocks = []
+        open_blocks = {}
+
+        def close(block):
+            if block is not None:
+                for bit in block["pair"]:
+                    if open_blocks.get(bit) is block:
+                        del open_blocks[bit]
+
+        for n, gate in enumerate(self.gates):
+            kind = _compiled_kind(gate)
+            if kind == CompiledCircuit.TWO_PTM:
+                bit0, bit1 = gate.involved_qubits
+                block = open_blocks.get(bit0)
+                if block is not None and block is open_blocks.get(bit1):
+                    block["members"].extend(block["singles"])
+                    block["members"].append(n)
+                    block["singles"] = []
+                    block["two_qubit_gates"] += 1
+                    continue
+                close(open_blocks.get(bit0))
+                close(open_blocks.get(bit1))
+                block = {"pair": (bit0, bit1), "members": [n], "singles": [],
+                         "two_qubit_gates": 1}
+                open_blocks[bit0] = open_blocks[bit1] = block
+                blocks.append(block)
+            elif kind == CompiledCircuit.PTM:
+                block = open_blocks.get(gate.involved_qubits[0])
+                if block is not None:
+                    block["singles"].append(n)
+            else:
+                for bit in _gate_qubits(gate):
+                    close(open_blocks.get(bit))
+
+        replaced = {}
+        removed = set()
+        eliminated = 0
+        for block in blocks:
+            if block["two_qubit_gates"] < 2:
+                continue
+            gates = [self.gates[n] for n in block["members"]]
+            fused = TwoPTMGate(*block["pair"],
+                               two_ptm=_block_two_ptm(block["pair"], gates),
+                               time=gates[-1].time)
+            fused.fused_gates = gates
+            fused.label = "fused"
+            replaced[block["members"][-1]] = fused
+            removed.update(block["members"])
+            eliminated += block["two_qubit_gates"] - 1
+
+        self.gates = [replaced.get(n, gate)
+                      for n, gate in enumerate(self.gates)
+                      if n in replaced or n not in removed]
+        return eliminated
+
     def apply_to(self, sdm, apply_all_pending=True):
         """Apply the gates in the Circuit to a sparsedm.SparseDM density
         matrix.  The gates are applied in the order given in self.gates, which
         is the order in which they are added to the Circuit. To reorder them to
         reflect the temporal order, call self.order()
 
+        While a profiling.Profiler is active, every gate is timed.
+
         See also: Circuit.order()
         """
+        profiler = profiling.active()
+        if profiler is not None:
+            steps = [(type(gate).__name__, functools.partial(gate.apply_to,
+                                                             sdm))
+                     for gate in self.gates]
+            if apply_all_pending:
+                steps.append(("apply_all_pending", sdm.apply_all_pending))
+            profiler.profile(sdm, steps)
+            return
+
         for gate in self.gates:
             gate.apply_to(sdm)
 
         if apply_all_pending:
             sdm.apply_all_pending()
 
+    def compile(self):
+        """Compile the circuit to a CompiledCircuit, a flat instruction list
+        that applies to a SparseDM like this circuit, but faster.
+
+        Runs of single qubit PTMs are multiplied at compile time, and fused
+        into the following two qubit PTM on the same qubit where there is
+        one.
+
+        The program holds the PTMs of the gates at the time of compilation;
+        compile again after changing gates, e.g. with `adjust`.
+
+        Qubits are kept as names and looked up in `sdm.idx_in_full_dm`
+        when the program runs, since their positions in the dense part
+        depend on the SparseDM the program is applied to, and change when
+        qubits are measured or become dense.
+
+        See also: Circuit.apply_to, Circuit.order
+        """
+        instructions = []
+        pending = {}
+
+        def flush(bit):
+            single_ptm = pending.pop(bit, None)
+            if single_ptm is not None:
+                instructions.append(
+                    (CompiledCircuit.PTM, bit, None, _frozen(single_ptm)))
+
+        for gate in self.gates:
+            kind = _compiled_kind(gate)
+            if kind == CompiledCircuit.PTM:
+                bit = gate.involved_qubits[0]
+                if bit in pending:
+                    pending[bit] = gate.ptm.dot(pending[bit])
+                else:
+                    pending[bit] = gate.ptm
+            elif kind == CompiledCircuit.TWO_PTM:
+                bit0, bit1 = gate.involved_qubits
+                if type(gate) is CPhase:
+                    two_ptm = _cphase_ptm()
+                else:
+                    two_ptm = gate.two_ptm
+                two_ptm = two_ptm.dot(np.kron(pending.pop(bit1, np.eye(4)),
+                                              pending.pop(bit0, np.eye(4))))
+                instructions.append(
+                    (CompiledCircuit.TWO_PTM, bit0, bit1, _frozen(two_ptm)))
+            else:
+                for bit in _gate_qubits(gate):
+                    flush(bit)
+                instructions.append((CompiledCircuit.GATE, gate, None, None))
+
+        for bit in list(pending):
+            flush(bit)
+
+        return CompiledCircuit(self.title, instructions)
+
     def plot(self, show_annotations=False):
         """
         Plot the circuit using matplotlib.
@@ -1420,6 +1631,262 @@ class Circuit:
         return full_PTM
 
 
+class CompiledCircuit:
+
+    PTM, TWO_PTM, GATE = range(3)
+
+    def __init__(self, title, instructions):
+        """A program produced by Circuit.compile.
+
+        Each instruction is a tuple (opcode, arg0, arg1, matrix):
+        (PTM, bit, None, ptm) and (TWO_PTM, bit0, bit1, two_ptm) apply the
+        (pre-fused, read-only) PTM to the qubits with the given names,
+        (GATE, gate, None, None) calls gate.apply_to for gates that cannot
+        be compiled, such as measurements and classical or conditional
+        gates.
+
+        The instruction tuple and the matrices are immutable, but GATE
+        instructions hold the Gate objects of the circuit, not copies:
+        changes to these gates, and their state such as the samplers of
+        measurements, are shared with the circuit.
+        """
+        self.title = title
+        self.instructions = tuple(instructions)
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def apply_to(self, sdm, apply_all_pending=True):
+        """Apply the program to a sparsedm.SparseDM density matrix, like
+        Circuit.apply_to.
+
+        Two qubit PTMs on qubits that are already dense and have no cached
+        single qubit PTMs are applied to sdm.full_dm directly.
+        """
+        profiler = profiling.active()
+        if profiler is not None:
+            steps = [(self._instruction_name(instruction),
+                      functools.partial(self._run, sdm, (instruction,)))
+                     for instruction in self.instructions]
+            if apply_all_pending:
+                steps.append(("apply_all_pending", sdm.apply_all_pending))
+            profiler.profile(sdm, steps)
+            return
+
+        self._run(sdm, self.instructions)
+
+        if apply_all_pending:
+            sdm.apply_all_pending()
+
+    def _instruction_name(self, instruction):
+        opcode, arg0 = instruction[:2]
+        if opcode == self.PTM:
+            return "PTM"
+        if opcode == self.TWO_PTM:
+            return "TWO_PTM"
+        return type(arg0).__name__
+
+    def _run(self, sdm, instructions):
+        PTM, TWO_PTM = self.PTM, self.TWO_PTM
+        idx_in_full_dm = sdm.idx_in_full_dm
+        single_ptms_to_do = sdm.single_ptms_to_do
+
+        for opcode, arg0, arg1, matrix in instructions:
+            if opcode == TWO_PTM:
+                if (arg0 in idx_in_full_dm and arg1 in idx_in_full_dm and
+                        arg0 not in single_ptms_to_do and
+                        arg1 not in single_ptms_to_do):
+                    sdm.full_dm.apply_two_ptm(idx_in_full_dm[arg0],
+                                              idx_in_full_dm[arg1], matrix)
+                else:
+                    sdm.apply_two_ptm(arg0, arg1, matrix)
+            elif opcode == PTM:
+                sdm.apply_ptm(arg0, matrix)
+            else:
+                arg0.apply_to(sdm)
+
+
+def _compiled_kind(gate):
+    """The CompiledCircuit opcode a gate compiles to."""
+    if gate.conditional_bit is None:
+        if type(gate).apply_to is SinglePTMGate.apply_to:
+            return CompiledCircuit.PTM
+        if type(gate).apply_to is TwoPTMGate.apply_to:
+            return CompiledCircuit.TWO_PTM
+        if type(gate) is CPhase:
+            return CompiledCircuit.TWO_PTM
+    return CompiledCircuit.GATE
+
+
+def _gate_qubits(gate):
+    """All qubits a gate acts on, including those of the gates inside a
+    ConditionalGate."""
+    qubits = list(gate.involved_qubits)
+    if isinstance(gate, ConditionalGate):
+        for g in gate.zero_gates + gate.one_gates:
+            qubits.extend(_gate_qubits(g))
+    return qubits
+
+
+def _dense_effect(gate, classical):
+    """The qubits, except the classical bits `classical`, that `gate` acts on
+    in a SparseDM, and the qubit it measures (or None)."""
+    if gate.is_measurement:
+        return (), gate.involved_qubits[-1]
+    qubits = [qb for qb in dict.fromkeys(_gate_qubits(gate))
+              if qb not in classical]
+    if isinstance(gate, ConditionalGate):
+        qubits = [qb for qb in qubits if qb != gate.control_bit]
+    return qubits, None
+
+
+class _DenseReplay:
+
+    def __init__(self, classical, dense=()):
+        """Follows which qubits a SparseDM keeps dense while gates are
+        applied, and the cost of the operations on its dense part, without
+        any density matrix.
+
+        classical: the names of the classical bits, which never become
+        dense.
+        """
+        self.classical = classical
+        self.dense = set(dense)
+        # cached single qubit PTMs, in the order SparseDM keeps them
+        self.pending = {}
+        self.sweeps = 0
+        self.total_bytes = self.total_flops = 0
+        self._bytes = self._flops = 0
+        self._width = 0
+
+    @property
+    def no_qubits(self):
+        return len(self.dense)
+
+    def take_cost(self):
+        """Return and reset the (flops, bytes) since the last call."""
+        cost = self._flops, self._bytes
+        self._flops = self._bytes = 0
+        return cost
+
+    def _op(self, no_qubits, flops, nbytes, sweep=True):
+        self._width = max(self._width, no_qubits)
+        self.sweeps += sweep
+        self._flops += flops
+        self._bytes += nbytes
+        self.total_flops += flops
+        self.total_bytes += nbytes
+
+    def apply_gate(self, gate):
+        """Replay `gate`, and return the largest number of dense qubits
+        while it is applied."""
+        self._width = self.no_qubits
+        if gate.is_measurement:
+            self.measure(gate.involved_qubits[-1])
+        elif isinstance(gate, ConditionalGate):
+            for g in gate.one_gates:
+                self.apply_gate(g)
+        elif _compiled_kind(gate) == CompiledCircuit.PTM:
+            self.apply_ptm(gate.involved_qubits[0], gate.ptm)
+        else:
+            qubits = _dense_effect(gate, self.classical)[0]
+            if len(qubits) == 2:
+                self.apply_two_ptm(*qubits)
+            elif qubits:
+                # an unknown gate, assume that it is applied directly
+                self.apply_dense_ptm(qubits[0])
+        return self._width
+
+    def ensure_dense(self, bit):
+        if bit not in self.dense:
+            n = self.no_qubits
+            self._op(n + 1, 0, 8 * 4**(n + 1))
+            self.dense.add(bit)
+
+    def apply_ptm(self, bit, ptm):
+        if bit in self.classical:
+            return
+        pending = self.pending.get(bit)
+        self.pending[bit] = ptm if pending is None else ptm.dot(pending)
+
+    def apply_dense_ptm(self, bit):
+        self.pending.pop(bit, None)
+        self.ensure_dense(bit)
+        n = self.no_qubits
+        self._op(n, 8 * 4**n, 16 * 4**n)
+
+    def combine_and_apply_single_ptm(self, bit):
+        ptm = self.pending.get(bit)
+        if ptm is None:
+            return
+        if bit in self.dense or not np.allclose(
+                ptm[[1, 2]][:, [0, 3]], 0, rtol=0, atol=1e-12):
+            self.apply_dense_ptm(bit)
+        else:
+            del self.pending[bit]
+
+    def apply_two_ptm(self, bit0, bit1):
+        self.ensure_dense(bit0)
+        self.ensure_dense(bit1)
+        self.pending.pop(bit0, None)
+        self.pending.pop(bit1, None)
+        n = self.no_qubits
+        self._op(n, 32 * 4**n, 16 * 4**n)
+
+    def measure(self, bit):
+        if bit in self.classical:
+            return
+        self.combine_and_apply_single_ptm(bit)
+        if bit in self.dense:
+            n = self.no_qubits
+            # the partial trace only reads the diagonal
+            self._op(n, 2**n, 8 * 2**n, sweep=False)
+            self._op(n, 0, 16 * 4**(n - 1))
+            self.dense.discard(bit)
+
+    def apply_all_pending(self):
+        """Replay SparseDM.apply_all_pending, and return the largest number
+        of dense qubits while it is applied."""
+        self._width = self.no_qubits
+        for bit in list(self.pending):
+            self.combine_and_apply_single_ptm(bit)
+        return self._width
+
+
+def _block_two_ptm(pair, gates):
+    """The product of the PTMs of `gates`, which act on the qubits in `pair`,
+    as a two qubit PTM on (bit0, bit1) = pair."""
+    bit0, bit1 = pair
+    total = np.eye(16)
+    for gate in gates:
+        if _compiled_kind(gate) == CompiledCircuit.PTM:
+            if gate.involved_qubits[0] == bit0:
+                factor = np.kron(np.eye(4), gate.ptm)
+            else:
+                factor = np.kron(gate.ptm, np.eye(4))
+        else:
+            if type(gate) is CPhase:
+                factor = _cphase_ptm()
+            else:
+                factor = gate.two_ptm
+            if gate.involved_qubits[0] != bit0:
+                factor = factor.reshape((4, 4, 4, 4)).transpose(
+                    1, 0, 3, 2).reshape((16, 16))
+        total = factor.dot(total)
+    return total
+
+
+@functools.lru_cache(maxsize=None)
+def _cphase_ptm():
+    return _frozen(ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])))
+
+
+def _frozen(matrix):
+    matrix = np.array(matrix, dtype=np.float64)
+    matrix.setflags(write=False)
+    return matrix
+
+
 def selection_sampler(result=0):
     """ A sampler always returning the measurement result `result`, and not
     making any measurement errors. Useful for testing or state preparation.
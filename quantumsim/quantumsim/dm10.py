@@ -13,6 +13,7 @@ import pycuda.autoinit
 
 # load the kernels
 from pycuda.compiler import SourceModule, DEFAULT_NVCC_FLAGS
+from pycuda.elementwise import ElementwiseKernel
 
 import sys
 import os
@@ -61,6 +62,11 @@ _trace.prepare("Pi")
 _swap = mod.get_function("swap")
 _swap.prepare("PIII")
 
+_gather = ElementwiseKernel(
+    "double *out, const double *data, const long long *indices",
+    "out[i] = data[indices[i]]",
+    "gather")
+
 
 class Density:
 
@@ -190,6 +196,21 @@ class Density:
 
         return self.diag_work.get()
 
+    def get_pauli_elements(self, indices):
+        """Return the elements of the Pauli basis tensor selected by
+        `indices`, a list that holds the 0xy1 basis indices to take for
+        every bit. Axis b of the result belongs to bit b.
+        """
+        assert len(indices) == self.no_qubits
+        # gather the elements on the device, instead of copying the whole
+        # tensor to the host; bit b is the digit of 4**b in the flat index
+        flat = np.zeros([len(i) for i in indices], dtype=np.int64)
+        for b, grid in enumerate(np.ix_(*indices)):
+            flat += np.asarray(grid, dtype=np.int64) * 4**b
+        elements = ga.empty(flat.size, np.float64)
+        _gather(elements, self.data, ga.to_gpu(flat.ravel()))
+        return elements.get().reshape(flat.shape)
+
     def cphase(self, bit0, bit1):
         assert bit0 < self.no_qubits
         assert bit1 < self.no_qubits
@@ -1,160 +1,409 @@
 import numpy as np
 import pytools
+import functools
+import concurrent.futures
+import os
 
 from . import ptm
 import warnings
 
 
+def _dm_to_pauli(data, no_qubits, batched=False):
+    """Transform density matrices `data` of shape (2**n, 2**n) (with a
+    leading batch axis if `batched`) to the 0xy1 Pauli basis tensor.
+    """
+    single_tensor = ptm.single_tensor
+    batch_idx = [3*no_qubits] if batched else []
+    data = data.reshape(data.shape[:len(batch_idx)] + (2, 2) * no_qubits)
+
+    in_indices = list(reversed(range(no_qubits, 3*no_qubits)))
+    out_indices = list(reversed(range(no_qubits)))
+    contraction_indices = [(i, i + no_qubits, i + 2*no_qubits)
+                           for i in reversed(out_indices)]
+
+    transformation_tensors = list(zip([single_tensor]*no_qubits,
+                                      contraction_indices))
+    transformation_tensors = pytools.flatten(transformation_tensors)
+
+    return np.einsum(data, batch_idx + in_indices, *transformation_tensors,
+                     batch_idx + out_indices, optimize=True).real
+
+
+def _pauli_to_dm(pauli, no_qubits, batched=False):
+    """Inverse of `_dm_to_pauli`: return the density matrices represented by
+    the Pauli basis tensor `pauli` as complex arrays of shape (2**n, 2**n).
+    """
+    single_tensor = ptm.single_tensor
+    batch_idx = [3*no_qubits] if batched else []
+
+    in_indices = list(range(no_qubits))
+
+    idx = [[i, no_qubits + i, 2*no_qubits + i]
+           for i in in_indices]
+
+    out_indices = list(range(no_qubits, 3*no_qubits))
+
+    transformation_tensors = list(zip([single_tensor]*no_qubits, idx))
+    transformation_tensors = pytools.flatten(transformation_tensors)
+
+    density_matrix = np.einsum(pauli, batch_idx + in_indices,
+                               *transformation_tensors,
+                               batch_idx + out_indices, optimize=True)
+    return density_matrix.reshape(
+        pauli.shape[:len(batch_idx)] + (2**no_qubits, 2**no_qubits))
+
+
+def _diag_indices(no_qubits):
+    """Return the flat indices of the Pauli basis tensor that hold the
+    diagonal of the density matrix, ordered like `get_diag` (bit 0 is the
+    least significant bit of the position).
+    """
+    positions = np.arange(2**no_qubits)
+    indices = np.zeros(2**no_qubits, dtype=np.intp)
+    for bit in range(no_qubits):
+        indices += ((positions >> bit) & 1) * 3 * 4**bit
+    return indices
+
+
+# Contraction plans only depend on the operation, the number of qubits and
+# the bits involved, so they are computed once and reused for every gate.
+@functools.lru_cache(maxsize=None)
+def _plan(operation, no_qubits, *bits):
+    """Return the precomputed reshaping plan for `operation` on a Pauli basis
+    tensor of `no_qubits` qubits, acting on `bits`.
+    """
+    if operation == "diag":
+        indices = _diag_indices(no_qubits)
+        indices.setflags(write=False)
+        return indices
+    elif operation == "ptm":
+        bit, = bits
+        higher, lower = 4**(no_qubits - bit - 1), 4**bit
+        # for the lowest bits of large states, a kron-expanded ptm turns the
+        # many tiny products of matmul into a single large one
+        use_kron = lower == 1 or (
+            lower <= _KRON_MAX_LOWER and higher >= _KRON_MIN_HIGHER)
+        return higher, lower, use_kron
+    elif operation == "two_ptm":
+        bit0, bit1 = bits
+        hi, lo = max(bit0, bit1), min(bit0, bit1)
+        return (4**(no_qubits - hi - 1), 4**(hi - lo - 1), 4**lo,
+                bit0 > bit1)
+    elif operation == "partial_trace":
+        bit, = bits
+        return 2**(no_qubits - bit - 1), 2, 2**bit
+    elif operation == "project":
+        bit, = bits
+        if bit == no_qubits - 1:
+            return 4, 4**bit
+        return 4, 4**(no_qubits - bit - 2), 4, 4**bit
+    else:
+        raise ValueError("Unknown operation {}".format(operation))
+
+
+_KRON_MAX_LOWER = 4
+_KRON_MIN_HIGHER = 1024
+
+
+# Below this size the thread pool costs more than it gains.
+_PARALLEL_MIN_QUBITS = 8
+
+_thread_pools = {}
+
+
+def _thread_pool(num_threads):
+    """Return a thread pool with `num_threads` workers, shared by all density
+    matrices using the same number of threads."""
+    try:
+        return _thread_pools[num_threads]
+    except KeyError:
+        pool = concurrent.futures.ThreadPoolExecutor(num_threads)
+        _thread_pools[num_threads] = pool
+        return pool
+
+
+def _slabs(length, parts):
+    """Split range(length) into at most `parts` contiguous slices."""
+    parts = max(1, min(parts, length))
+    bounds = [length * i // parts for i in range(parts + 1)]
+    return [slice(b0, b1) for b0, b1 in zip(bounds[:-1], bounds[1:])]
+
+
+def _run(tasks, pool):
+    """Call all `tasks`, on the thread pool `pool` if it is not None.
+    Returns the list of results."""
+    if pool is None or len(tasks) == 1:
+        return [task() for task in tasks]
+    return [future.result()
+            for future in [pool.submit(task) for task in tasks]]
+
+
+def _apply_ptm(dm, one_ptm, plan, out, pool=None, parts=1):
+    """Apply a single qubit ptm to the flat Pauli vector `dm` according to a
+    "ptm" plan, writing the result to the flat buffer `out`.
+
+    The work is split into `parts` slabs along the axes the ptm does not
+    touch, which are processed on `pool`.
+    """
+    higher, lower, use_kron = plan
+    if use_kron:
+        if lower > 1:
+            one_ptm = (one_ptm[:, None, :, None] *
+                       np.eye(lower)[None, :, None, :]).reshape(
+                           4 * lower, 4 * lower)
+        dm, out = dm.reshape(higher, 4 * lower), out.reshape(higher, 4 * lower)
+        tasks = [functools.partial(np.dot, dm[s], one_ptm.T, out=out[s])
+                 for s in _slabs(higher, parts)]
+    else:
+        tasks = _matmul_tasks(one_ptm, dm.reshape(higher, 4, lower),
+                              out.reshape(higher, 4, lower), parts)
+    _run(tasks, pool)
+
+
+def _matmul_tasks(matrix, dm, out, parts):
+    """Tasks multiplying the middle axis of the 3d arrays `dm` by `matrix`,
+    split along the larger one of the outer axes."""
+    if dm.shape[0] >= min(parts, dm.shape[2]):
+        return [functools.partial(np.matmul, matrix, dm[s], out=out[s])
+                for s in _slabs(dm.shape[0], parts)]
+    return [functools.partial(np.matmul, matrix, dm[:, :, s],
+                              out=out[:, :, s])
+            for s in _slabs(dm.shape[2], parts)]
+
+
+def _apply_two_ptm(dm, two_ptm, plan, out, pool=None, parts=1):
+    """Apply a two qubit ptm to the flat Pauli vector `dm` according to a
+    "two_ptm" plan, writing the result to the flat buffer `out`.
+
+    For non-adjacent bits `dm` is used as scratch space and overwritten.
+    The work is split into `parts` slabs processed on `pool`.
+    """
+    higher, middle, lower, swapped = plan
+    # two_ptm acts on (bit1, bit0) pairs with bit1 the major index; bring it
+    # to (higher bit, lower bit) order
+    if swapped:
+        two_ptm = two_ptm.reshape((4, 4, 4, 4)).transpose(
+            1, 0, 3, 2).reshape((16, 16))
+    if middle == 1:
+        # adjacent bits form a single axis of length 16
+        _run(_matmul_tasks(two_ptm, dm.reshape(higher, 16, lower),
+                           out.reshape(higher, 16, lower), parts), pool)
+        return
+    # gather both bits next to each other, apply the ptm as a single matrix
+    # product and scatter the result back
+    natural = dm.reshape(higher, 4, middle, 4, lower)
+    gathered = out.reshape(higher, 4, 4, middle, lower)
+    if pool is None:
+        np.copyto(gathered, np.moveaxis(natural, 3, 2))
+        np.matmul(two_ptm, out.reshape(higher, 16, middle * lower),
+                  out=dm.reshape(higher, 16, middle * lower))
+        np.copyto(out.reshape(natural.shape),
+                  np.moveaxis(dm.reshape(gathered.shape), 2, 3))
+        return
+
+    # in parallel, the copies are split by the values of both bits and
+    # along the largest untouched axis
+    untouched = (higher, middle, lower)
+    axis = untouched.index(max(untouched))
+    copy_slabs = []
+    for s in _slabs(untouched[axis], -(-parts // 16)):
+        index = [slice(None)] * 3
+        index[axis] = s
+        copy_slabs.append(index)
+
+    def copy_tasks(natural, gathered, to_gathered):
+        tasks = []
+        for i in range(4):
+            for j in range(4):
+                for h, m, l in copy_slabs:
+                    dst, src = gathered[h, i, j, m, l], natural[h, i, m, j, l]
+                    if not to_gathered:
+                        dst, src = src, dst
+                    tasks.append(functools.partial(np.copyto, dst, src))
+        return tasks
+
+    _run(copy_tasks(natural, gathered, True), pool)
+    matrix_in = out.reshape(higher, 16, middle * lower)
+    matrix_out = dm.reshape(higher, 16, middle * lower)
+    _run(_matmul_tasks(two_ptm, matrix_in, matrix_out, parts), pool)
+    _run(copy_tasks(out.reshape(natural.shape),
+                    dm.reshape(gathered.shape), False), pool)
+
+
 class DensityNP:
-    def __init__(self, no_qubits, data=None):
+    def __init__(self, no_qubits, data=None, num_threads=1):
+        """Create a new density matrix for several qubits, stored in the
+        Pauli basis.
+
+        The state lives in one of two preallocated buffers; gates write their
+        result to the other one and swap. Like dm10.Density, the buffers are
+        kept when qubits are removed and reused when ancillas are added, up
+        to `allocated_qubits`.
+
+        num_threads: number of threads used for gates, get_diag and trace on
+        states of at least _PARALLEL_MIN_QUBITS qubits. None uses all cores.
+        """
 
         if no_qubits > 15:
             raise ValueError(
                 "no_qubits=%d is way too many qubits, are you sure?" %
                 no_qubits)
 
-        self.no_qubits = no_qubits
-        self.shape = [4] * no_qubits
+        if num_threads is None:
+            num_threads = os.cpu_count() or 1
+        self.num_threads = num_threads
+
+        self.allocated_qubits = 0
+        self._buffers = None
+        self._active = 0
+        self._set_no_qubits(no_qubits)
 
         if isinstance(data, np.ndarray):
-            single_tensor = ptm.single_tensor
             assert data.size == 4**self.no_qubits
-
-            data = data.reshape((2, 2) * self.no_qubits)
-
-            in_indices = list(reversed(range(self.no_qubits, 3*self.no_qubits)))
-            out_indices = list(reversed(range(self.no_qubits)))
-            contraction_indices = [(i, i + self.no_qubits, i + 2*self.no_qubits) for i in reversed(out_indices)]
-
-            transformation_tensors = list(zip([single_tensor]*self.no_qubits, contraction_indices))
-            transformation_tensors = pytools.flatten(transformation_tensors)
-
-            self.dm = np.einsum(data, in_indices, *transformation_tensors, out_indices, optimize=True).real
+            self.dm = _dm_to_pauli(data, self.no_qubits)
         elif data is None:
-            self.dm = np.zeros(self.shape)
-            self.dm[tuple([0] * self.no_qubits)] = 1
+            self._buffers[self._active][:self._size] = 0
+            self._buffers[self._active][0] = 1
         else:
             raise ValueError("type of data not understood")
 
-    def renormalize(self):
-        self.dm = self.dm / self.trace()
-
-    def copy(self):
-        cp = DensityNP(no_qubits=self.no_qubits)
-        cp.dm = self.dm.copy()
-        return cp
+    def _set_no_qubits(self, no_qubits):
+        if self._buffers is None or no_qubits > self.allocated_qubits:
+            buffers = [np.empty(4**no_qubits), np.empty(4**no_qubits)]
+            if self._buffers is not None:
+                buffers[0][:self._size] = self._data()
+            self._buffers = buffers
+            self._active = 0
+            self.allocated_qubits = no_qubits
+        self.no_qubits = no_qubits
+        self.shape = [4] * no_qubits
+        self._size = 4**no_qubits
 
-    def to_array(self):
-        single_tensor = ptm.single_tensor
+    def _data(self):
+        return self._buffers[self._active][:self._size]
 
-        in_indices = list(range(self.no_qubits))
+    def _idle(self):
+        return self._buffers[1 - self._active][:self._size]
 
-        idx = [[i, self.no_qubits + i, 2*self.no_qubits + i]
-               for i in in_indices]
+    def _swap(self):
+        self._active = 1 - self._active
 
-        out_indices = list(range(self.no_qubits, 3*self.no_qubits))
+    def _parallel(self):
+        """Return the thread pool and the number of slabs to use for the
+        current state; no pool if it is too small to be worth it."""
+        if self.num_threads > 1 and self.no_qubits >= _PARALLEL_MIN_QUBITS:
+            return _thread_pool(self.num_threads), self.num_threads
+        return None, 1
 
-        transformation_tensors = list(zip([single_tensor]*self.no_qubits, idx))
-        transformation_tensors = pytools.flatten(transformation_tensors)
+    @property
+    def dm(self):
+        """A copy of the Pauli basis tensor, of shape [4]*no_qubits.
 
-        density_matrix = np.einsum(self.dm, in_indices, *transformation_tensors, out_indices, optimize=True)
-        density_matrix = density_matrix.reshape((2**self.no_qubits, 2**self.no_qubits))
-        return density_matrix
+        The gates write into reused buffers, so the copy is needed for a
+        snapshot that is not overwritten by later gates.
+        """
+        return self._data().reshape(self.shape).copy()
 
-    def get_diag(self):
+    @dm.setter
+    def dm(self, value):
+        assert np.size(value) == self._size
+        self._data()[:] = np.reshape(value, -1)
 
-        no_trace_tensor = np.array([[1, 0, 0, 0], [0, 0, 0, 1]]).T
+    def renormalize(self):
+        self._data()[:] /= self.trace()
 
-        trace_argument = []
-        for i in range(self.no_qubits):
-            trace_argument.append(no_trace_tensor)
-            trace_argument.append([i, i + self.no_qubits])
+    def copy(self):
+        cp = DensityNP(no_qubits=self.no_qubits, num_threads=self.num_threads)
+        cp.dm = self._data()
+        return cp
 
-        indices = list(reversed(range(self.no_qubits)))
-        out_indices = list(reversed(range(self.no_qubits, 2*self.no_qubits)))
+    def to_array(self):
+        return _pauli_to_dm(self._data().reshape(self.shape), self.no_qubits)
 
-        return np.einsum(self.dm, indices, *trace_argument, out_indices, optimize=True).reshape(2**self.no_qubits)
+    def get_diag(self):
+        indices = _plan("diag", self.no_qubits)
+        pool, parts = self._parallel()
+        if pool is None:
+            return self._data()[indices]
+        diag = np.empty(indices.size)
+        _run([functools.partial(np.take, self._data(), indices[s],
+                                out=diag[s])
+              for s in _slabs(indices.size, parts)], pool)
+        return diag
+
+    def get_pauli_elements(self, indices):
+        """Return the elements of the Pauli basis tensor selected by
+        `indices`, a list that holds the 0xy1 basis indices to take for
+        every bit. Axis b of the result belongs to bit b.
+        """
+        assert len(indices) == self.no_qubits
+        elements = self._data().reshape(self.shape)[
+            np.ix_(*reversed(indices))]
+        return elements.transpose()
 
     def apply_two_ptm(self, bit0, bit1, two_ptm):
-        two_ptm = two_ptm.reshape((4, 4, 4, 4))
-        dummy_idx0, dummy_idx1 = self.no_qubits, self.no_qubits + 1
-        out_indices = list(reversed(range(self.no_qubits)))
-        in_indices = list(reversed(range(self.no_qubits)))
-        in_indices[self.no_qubits - bit0 - 1] = dummy_idx0
-        in_indices[self.no_qubits - bit1 - 1] = dummy_idx1
-        two_ptm_indices = [
-            bit1, bit0,
-            dummy_idx1, dummy_idx0
-        ]
-        self.dm = np.einsum(
-            self.dm, in_indices, two_ptm, two_ptm_indices, out_indices, optimize=True)
+        assert bit0 < self.no_qubits
+        assert bit1 < self.no_qubits
+
+        plan = _plan("two_ptm", self.no_qubits, bit0, bit1)
+        _apply_two_ptm(self._data(), two_ptm, plan, self._idle(),
+                       *self._parallel())
+        self._swap()
 
     def apply_ptm(self, bit, one_ptm):
         assert bit < self.no_qubits
 
-        dummy_idx = self.no_qubits
-        out_indices = list(reversed(range(self.no_qubits)))
-        in_indices = list(reversed(range(self.no_qubits)))
-        in_indices[self.no_qubits - bit - 1] = dummy_idx
-        ptm_indices = [bit, dummy_idx]
-        self.dm = np.einsum(self.dm, in_indices, one_ptm, ptm_indices, out_indices, optimize=True)
+        plan = _plan("ptm", self.no_qubits, bit)
+        _apply_ptm(self._data(), one_ptm, plan, self._idle(),
+                   *self._parallel())
+        self._swap()
 
     def add_ancilla(self, anc_st):
-        anc_dm = np.zeros(4)
+        """Add an ancilla in the ground or excited state as the highest new
+        bit.
+        """
+        size = self._size
+        self._set_no_qubits(self.no_qubits + 1)
+        data = self._data()
         if anc_st == 1:
-            anc_dm[3] = 1
+            data[3 * size:] = data[:size]
+            data[:3 * size] = 0
         else:
-            anc_dm[0] = 1
-        self.dm = np.einsum(
-            anc_dm, [0], self.dm, list(range(1, self.no_qubits + 1)), optimize=True)
-        self.no_qubits = len(self.dm.shape)
+            data[size:] = 0
 
     def partial_trace(self, bit):
         if bit >= self.no_qubits:
             raise ValueError("bit does not exist")
 
-        trace_tensor = np.array([1, 0, 0, 1])
-        no_trace_tensor = np.array([[1, 0, 0, 0], [0, 0, 0, 1]])
-
-        trace_argument = []
-        for i in range(self.no_qubits):
-            if i == bit:
-                trace_argument.append(no_trace_tensor)
-                trace_argument.append([self.no_qubits + 1, i])
-            else:
-                trace_argument.append(trace_tensor)
-                trace_argument.append([i])
-
-        indices = list(reversed(range(self.no_qubits)))
-
-        return np.einsum(self.dm, indices, *trace_argument, optimize=True)
+        return self.get_diag().reshape(
+            _plan("partial_trace", self.no_qubits, bit)).sum(axis=(0, 2))
 
     def trace(self):
-        tensor = np.array([1, 0, 0, 1])
-        trace_argument = pytools.flatten(
-            [[tensor, [i]] for i in range(self.no_qubits)])
-        return np.einsum(self.dm, list(range(self.no_qubits)), *trace_argument, optimize=True)
+        indices = _plan("diag", self.no_qubits)
+        pool, parts = self._parallel()
+        if pool is None:
+            return self._data()[indices].sum()
+        data = self._data()
+        return sum(_run([lambda s=s: data[indices[s]].sum()
+                         for s in _slabs(indices.size, parts)], pool))
 
     def project_measurement(self, bit, state):
 
         assert bit < self.no_qubits
 
-        # the behaviour is a bit weird: swap the MSB to bit and then project out the highest one!
-        projector = np.zeros(4)
-        if state == 1:
-            projector[3] = 1
+        # the behaviour is a bit weird: swap the MSB to bit and then project
+        # out the highest one!
+        shape = _plan("project", self.no_qubits, bit)
+        data = self._data().reshape(shape)
+        self._set_no_qubits(self.no_qubits - 1)
+        if bit == self.no_qubits:
+            # the remaining block is contiguous, move it to the front
+            if state == 1:
+                self._data()[:] = data[3]
         else:
-            projector[0] = 1
-
-        in_indices = list(reversed(range(self.no_qubits)))
-        projector_indices = [bit]
-        out_indices = list(reversed(range(self.no_qubits - 1)))
-        if bit != self.no_qubits - 1:
-            out_indices[-bit-1] = self.no_qubits - 1
-
-        self.dm = np.einsum(self.dm, in_indices, projector, projector_indices, out_indices, optimize=True)
-
-        self.no_qubits = len(self.dm.shape)
+            np.copyto(self._idle().reshape(shape[1:]),
+                      data[:, :, 3 * state, :].transpose(1, 0, 2))
+            self._swap()
 
     def hadamard(self, bit):
         warnings.warn("hadamard deprecated, use apply_ptm", DeprecationWarning)
@@ -183,3 +432,136 @@ class DensityNP:
         warnings.warn("cphase deprecated, use apply_ptm", DeprecationWarning)
         two_ptm = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1]))
         self.apply_two_ptm(bit0, bit1, two_ptm)
+
+
+class BatchedDensityNP:
+    def __init__(self, no_qubits, batch_size=1, data=None):
+        """A stack of `batch_size` density matrices on `no_qubits` qubits,
+        stored as one Pauli basis tensor with a leading batch axis.
+
+        All operations act on every element of the batch in a single numpy
+        call, which amortizes the interpreter overhead of a gate over many
+        Monte Carlo shots. Measurement projections can select a different
+        outcome for every element, so each element follows its own
+        trajectory while all of them share the same qubit layout.
+
+        data: a numpy.ndarray of shape (batch_size, 2**no_qubits,
+              2**no_qubits), or (2**no_qubits, 2**no_qubits) to start all
+              elements from the same state.
+              If data is None, all elements are in the ground state.
+        """
+        if no_qubits > 15:
+            raise ValueError(
+                "no_qubits=%d is way too many qubits, are you sure?" %
+                no_qubits)
+
+        self.no_qubits = no_qubits
+        self.batch_size = batch_size
+
+        if isinstance(data, np.ndarray):
+            assert data.size in (4**no_qubits, batch_size * 4**no_qubits)
+            if data.size == 4**no_qubits:
+                data = np.broadcast_to(
+                    data.reshape(2**no_qubits, 2**no_qubits),
+                    (batch_size, 2**no_qubits, 2**no_qubits))
+            self.dm = _dm_to_pauli(data, no_qubits, batched=True)
+        elif data is None:
+            self.dm = np.zeros([batch_size] + [4] * no_qubits)
+            self.dm.reshape(batch_size, -1)[:, 0] = 1
+        else:
+            raise ValueError("type of data not understood")
+
+    def _split_at(self, bit):
+        """View of the tensor as (batch, higher bits, bit, lower bits)."""
+        return self.dm.reshape(self.batch_size, 4**(self.no_qubits - bit - 1),
+                               4, 4**bit)
+
+    def renormalize(self):
+        tr = self.trace()
+        self.dm = self.dm / tr.reshape((-1,) + (1,) * self.no_qubits)
+
+    def copy(self):
+        cp = BatchedDensityNP(no_qubits=self.no_qubits,
+                              batch_size=self.batch_size)
+        cp.dm = self.dm.copy()
+        return cp
+
+    def to_array(self):
+        return _pauli_to_dm(self.dm, self.no_qubits, batched=True)
+
+    def get_diag(self):
+        return self.dm.reshape(self.batch_size, -1)[
+            :, _plan("diag", self.no_qubits)]
+
+    def trace(self):
+        return self.get_diag().sum(axis=1)
+
+    def partial_trace(self, bit):
+        """Return the probabilities (p0, p1) to measure `bit` in state 0 or
+        1, as an array of shape (2, batch_size).
+        """
+        if bit >= self.no_qubits:
+            raise ValueError("bit does not exist")
+        diag = self.get_diag().reshape(
+            self.batch_size, 2**(self.no_qubits - bit - 1), 2, 2**bit)
+        return diag.sum(axis=(1, 3)).T
+
+    def apply_ptm(self, bit, one_ptm):
+        """Apply the 4x4 ptm `one_ptm` to `bit` in every element.
+        `one_ptm` can also be a stack of shape (batch_size, 4, 4), applying
+        a different ptm to each element.
+        """
+        assert bit < self.no_qubits
+
+        if one_ptm.ndim == 3:
+            one_ptm = one_ptm[:, None, :, :]
+        self.dm = np.matmul(one_ptm, self._split_at(bit)).reshape(
+            self.dm.shape)
+
+    def apply_two_ptm(self, bit0, bit1, two_ptm):
+        assert bit0 < self.no_qubits
+        assert bit1 < self.no_qubits
+
+        # two_ptm acts on (bit1, bit0) pairs, bit1 being the major index
+        two_ptm = two_ptm.reshape((4, 4, 4, 4))
+        if bit0 > bit1:
+            two_ptm = two_ptm.transpose(1, 0, 3, 2)
+        hi, lo = max(bit0, bit1), min(bit0, bit1)
+
+        dm = self.dm.reshape(
+            self.batch_size, 4**(self.no_qubits - hi - 1), 4,
+            4**(hi - lo - 1), 4, 4**lo)
+        dm = np.tensordot(dm, two_ptm, axes=([2, 4], [2, 3]))
+        dm = np.moveaxis(dm, (4, 5), (2, 4))
+        self.dm = np.ascontiguousarray(dm).reshape(self.dm.shape)
+
+    def add_ancilla(self, anc_st):
+        """Add an ancilla as the highest new bit. `anc_st` is 0 or 1, or an
+        array of length batch_size with the state for each element.
+        """
+        anc_st = np.broadcast_to(anc_st, (self.batch_size,))
+        dm = np.zeros((self.batch_size, 4) + self.dm.shape[1:])
+        dm[np.arange(self.batch_size), 3 * anc_st] = self.dm
+        self.dm = dm
+        self.no_qubits += 1
+
+    def project_measurement(self, bit, state):
+        """Project `bit` to `state`, which is 0 or 1, or an array of length
+        batch_size with the outcome for each element. The bit is removed; as
+        in DensityNP, the highest bit takes its place.
+        """
+        assert bit < self.no_qubits
+
+        state = np.broadcast_to(state, (self.batch_size,))
+        batch = np.arange(self.batch_size)
+
+        if bit == self.no_qubits - 1:
+            dm = self._split_at(bit)[batch, :, 3 * state, :]
+        else:
+            dm = self.dm.reshape(
+                self.batch_size, 4, 4**(self.no_qubits - bit - 2), 4, 4**bit)
+            dm = dm[batch, :, :, 3 * state, :].transpose(0, 2, 1, 3)
+
+        self.no_qubits -= 1
+        self.dm = np.ascontiguousarray(dm).reshape(
+            [self.batch_size] + [4] * self.no_qubits)
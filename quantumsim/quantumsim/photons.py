@@ -5,8 +5,6 @@
 
 import numpy as np
 
-from collections import defaultdict
-
 from . import circuit
 
 import copy
@@ -62,18 +60,14 @@ def add_waiting_gates_photons(c, tmin, tmax, chi, kappa, alpha0):
     # assert min(times) >= tmin
     # assert max(times) <= tmax
 
-    gates_per_qubit = defaultdict(list)
-
-    for g in c.gates:
-        for qb in c.qubits:
-            if g.involves_qubit(qb.name):
-                gates_per_qubit[qb].append(g)
+    gates_by_qubit = c.gates_by_qubit()
 
-    for qb in gates_per_qubit:
+    for qb in c.qubits:
         if qb.t1 == np.inf and qb.t2 == np.inf:
             continue
-        gs = gates_per_qubit[qb]
-        gs.sort(key=lambda g: g.time)
+        gs = gates_by_qubit.get(qb.name)
+        if not gs:
+            continue
 
         # at what times to measurements occur
         meas_times = [g.time for g in gs if g.is_measurement]
@@ -0,0 +1,225 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2016 Brian Tarasinski
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+"""Opt-in timing instrumentation of Circuit.apply_to.
+
+While a Profiler is active, Circuit.apply_to and CompiledCircuit.apply_to
+time every gate, and record the calls to the dense backend of the SparseDM
+the gate makes:
+
+    with profiling.Profiler() as prof:
+        circuit.apply_to(sdm)
+    print(prof.table())
+    prof.save_chrome_trace("trace.json")
+
+The trace can be opened in chrome://tracing or https://ui.perfetto.dev.
+Without an active Profiler, apply_to only checks `profiling.active()` once
+per call.
+"""
+
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+
+GateRecord = namedtuple("GateRecord", [
+    "name", "start", "duration", "dense_qubits", "allocated", "calls"])
+BackendCall = namedtuple("BackendCall", [
+    "name", "start", "duration", "no_qubits"])
+
+_active = None
+
+
+def active():
+    """Return the active Profiler, or None."""
+    return _active
+
+
+class _BackendProxy:
+
+    def __init__(self, density, profiler):
+        """Stands in for `sdm.full_dm` while a circuit is profiled, and
+        records the calls to the methods of `density`."""
+        self._density = density
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._density, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            no_qubits = self._density.no_qubits
+            start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                # the larger of the qubit counts before and after the call
+                no_qubits = max(no_qubits, self._density.no_qubits)
+                self._profiler._calls.append(BackendCall(
+                    name, start - self._profiler._t0, end - start,
+                    no_qubits))
+        return call
+
+
+class Profiler:
+
+    def __init__(self, trace_memory=True, callback=None):
+        """Record wall time, dense qubit count, backend calls and allocated
+        bytes of every gate applied while the profiler is active, i.e. in a
+        `with` block.
+
+        trace_memory: measure the bytes allocated during each gate with
+        tracemalloc, which slows the simulation down. This is the peak of
+        the traced memory during the gate on Python 3.9 and later, and the
+        net change of the traced memory on older versions, which lack
+        tracemalloc.reset_peak. Otherwise, the allocated bytes are recorded
+        as None.
+        callback: called with every GateRecord when it is complete.
+
+        The records are collected in `self.records`, and summarized with
+        `table` and `chrome_trace`.
+        """
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records = []
+        self._calls = []
+        self._t0 = time.perf_counter()
+        self._previous = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = self._previous
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    def clear(self):
+        """Discard all records."""
+        self.records = []
+        self._t0 = time.perf_counter()
+
+    def profile(self, sdm, steps):
+        """Run `steps`, an iterable over (name, function) pairs, on the
+        SparseDM `sdm`, and record a GateRecord for each of them."""
+        density = sdm.full_dm
+        sdm.full_dm = _BackendProxy(density, self)
+        try:
+            for name, function in steps:
+                self._record(name, function, density)
+        finally:
+            sdm.full_dm = density
+
+    def _record(self, name, function, density):
+        self._calls = []
+        before = density.no_qubits
+        reset_peak = getattr(tracemalloc, "reset_peak", None)
+        if self.trace_memory:
+            if reset_peak is not None:
+                reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        function()
+        end = time.perf_counter()
+        allocated = None
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            allocated = (current if reset_peak is None else peak) - memory
+
+        dense_qubits = max([before, density.no_qubits] +
+                           [c.no_qubits for c in self._calls])
+        record = GateRecord(name, start - self._t0, end - start,
+                            dense_qubits, allocated, tuple(self._calls))
+        self._calls = []
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self):
+        """Aggregate the records by name.
+
+        Returns a dict {name: stats}, where stats is a dict with the number
+        of gates ("count"), their total and maximal duration in seconds
+        ("time", "max_time"), the largest dense qubit count
+        ("dense_qubits"), the total allocated bytes ("allocated", None if
+        not traced) and the number of backend calls of each type
+        ("calls").
+        """
+        summary = {}
+        for record in self.records:
+            stats = summary.setdefault(record.name, {
+                "count": 0, "time": 0., "max_time": 0., "dense_qubits": 0,
+                "allocated": None, "calls": {}})
+            stats["count"] += 1
+            stats["time"] += record.duration
+            stats["max_time"] = max(stats["max_time"], record.duration)
+            stats["dense_qubits"] = max(stats["dense_qubits"],
+                                        record.dense_qubits)
+            if record.allocated is not None:
+                stats["allocated"] = (stats["allocated"] or 0) + \
+                    record.allocated
+            for call in record.calls:
+                stats["calls"][call.name] = \
+                    stats["calls"].get(call.name, 0) + 1
+        return summary
+
+    def table(self):
+        """Return the summary as a text table, with the most expensive gate
+        class first."""
+        summary = self.summary()
+        total = sum(stats["time"] for stats in summary.values()) or 1.
+        lines = ["{:<20} {:>7} {:>11} {:>11} {:>6} {:>5} {:>12}  {}".format(
+            "gate", "count", "total [ms]", "mean [us]", "share", "dense",
+            "alloc [kB]", "backend calls")]
+        for name, stats in sorted(summary.items(),
+                                  key=lambda item: -item[1]["time"]):
+            allocated = "-" if stats["allocated"] is None else \
+                "{:.1f}".format(stats["allocated"] / 1024)
+            calls = ", ".join("{} {}".format(call, n)
+                              for call, n in sorted(stats["calls"].items()))
+            lines.append(
+                "{:<20} {:>7} {:>11.3f} {:>11.1f} {:>5.1f}% {:>5} {:>12}  "
+                "{}".format(
+                    name, stats["count"], 1e3 * stats["time"],
+                    1e6 * stats["time"] / stats["count"],
+                    100 * stats["time"] / total, stats["dense_qubits"],
+                    allocated, calls))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Return the records in the Chrome trace event format, with a
+        complete event for every gate and every backend call."""
+        events = []
+        for record in self.records:
+            events.append({
+                "name": record.name, "cat": "gate", "ph": "X",
+                "ts": 1e6 * record.start, "dur": 1e6 * record.duration,
+                "pid": 0, "tid": 0,
+                "args": {"dense_qubits": record.dense_qubits,
+                         "allocated": record.allocated}})
+            for call in record.calls:
+                events.append({
+                    "name": call.name, "cat": "backend", "ph": "X",
+                    "ts": 1e6 * call.start, "dur": 1e6 * call.duration,
+                    "pid": 0, "tid": 0,
+                    "args": {"no_qubits": call.no_qubits}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, filename):
+        """Write `chrome_trace` to the JSON file `filename`."""
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
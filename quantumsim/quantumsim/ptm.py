@@ -5,6 +5,8 @@
 
 import numpy as np
 
+from collections import OrderedDict, namedtuple
+
 "The transformation matrix between the two basis. Its essentially a Hadamard, so its its own inverse."
 basis_transformation_matrix = np.array([[np.sqrt(0.5), 0, 0, np.sqrt(0.5)],
                                         [0, 1, 0, 0],
@@ -152,9 +154,115 @@ def rotate_z_ptm(angle):
     return to_0xy1_basis(ptm)
 
 
+def _transfer_tensor(tensor):
+    """Precompute the real-valued product of two copies of `tensor`, so that
+    a ptm is a single matrix product with the flattened real and imaginary
+    parts of sum_k K_k[b, c] K_k*[a, d].
+    """
+    n, dim = tensor.shape[:2]
+    product = np.einsum("xab, ycd -> xyabcd", tensor, tensor)
+    product = product.reshape((n * n, dim**4))
+    return np.hstack((product.real, -product.imag))
+
+
+_single_transfer = _transfer_tensor(single_tensor)
+_double_transfer = _transfer_tensor(double_tensor)
+
+
+def _krauses_to_ptm(krauses, transfer, dim, summed):
+    krauses = np.asarray(krauses)
+    assert krauses.shape[-2:] == (dim, dim)
+    if summed:
+        assert krauses.ndim >= 3
+        products = np.einsum("...kbc, ...kad -> ...abcd",
+                             krauses, krauses.conj())
+    else:
+        products = np.einsum("...bc, ...ad -> ...abcd",
+                             krauses, krauses.conj())
+    batch = products.shape[:-4]
+    products = products.reshape(batch + (dim**4,))
+    products = np.concatenate((products.real, products.imag), axis=-1)
+    n = dim * dim
+    return np.dot(products, transfer.T).reshape(batch + (n, n))
+
+
+def single_krauses_to_ptm(krauses, summed=True):
+    """Given a stack of Kraus operators in z-basis with shape (..., k, 2, 2),
+    obtain the single-qubit ptm in 0xy1 basis of the channel they form, with
+    shape (..., 4, 4). Leading axes enumerate independent channels.
+
+    If summed is False, every 2x2 operator is converted separately, and a ptm
+    is returned for each of them.
+    """
+    return _krauses_to_ptm(krauses, _single_transfer, 2, summed)
+
+
+def double_krauses_to_ptm(krauses, summed=True):
+    """Two-qubit version of single_krauses_to_ptm, for Kraus operators with
+    shape (..., k, 4, 4) and ptms with shape (..., 16, 16).
+    """
+    return _krauses_to_ptm(krauses, _double_transfer, 4, summed)
+
+
 def single_kraus_to_ptm(kraus):
     """Given a Kraus operator in z-basis, obtain the corresponding single-qubit ptm in 0xy1 basis"""
-    return np.einsum("xab, bc, ycd, ad -> xy", single_tensor, kraus, single_tensor, kraus.conj()).real
+    return single_krauses_to_ptm(kraus, summed=False)
+
 
 def double_kraus_to_ptm(kraus):
-    return np.einsum("xab, bc, ycd, ad -> xy", double_tensor, kraus, double_tensor, kraus.conj()).real
+    return double_krauses_to_ptm(kraus, summed=False)
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class PTMCache:
+    def __init__(self, maxsize=4096, decimals=12):
+        """A bounded least-recently-used cache of Pauli transfer matrices,
+        keyed by a gate name and its parameters.
+
+        Float parameters are rounded to `decimals` decimals, so that
+        parameters differing only by rounding errors share an entry.
+        The cached matrices are read-only.
+        """
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def key(self, name, params):
+        return (name,) + tuple(
+            round(float(p), self.decimals) if isinstance(p, (float, int))
+            else p for p in params)
+
+    def get(self, name, params, factory):
+        """Return the ptm of gate `name` with parameters `params`, calling
+        `factory(*params)` to construct it if it is not cached."""
+        key = self.key(name, params)
+        try:
+            p = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            p = np.array(factory(*params))
+            p.setflags(write=False)
+            self._cache[key] = p
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return p
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return p
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self._cache))
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+"The cache used by the gates in quantumsim.circuit."
+ptm_cache = PTMCache()
@@ -1,2 +1,12 @@
-from .universal import QASMParser
 from .configurable import ConfigurableParser
+from .streaming import StreamingQASMParser
+
+
+def __getattr__(name):
+    # QASMParser is built on parsimonious, which is only imported when the
+    # grammar based parser is actually used.
+    if name == 'QASMParser':
+        from .universal import QASMParser
+        return QASMParser
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
@@ -2,6 +2,8 @@ import json
 import numpy as np
 import re
 import warnings
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from itertools import chain
 
 from .. import circuit as ct
@@ -20,6 +22,47 @@ class NotSupportedError(RuntimeError):
     pass
 
 
+class GatePrototype(namedtuple('GatePrototype',
+                               ['qubits', 'duration', 'label', 'factory'])):
+    """A precompiled entry of the "instructions" config. `factory(time)`
+    returns a new gate at `time`, sharing the precomputed PTM of all gates
+    made from this prototype, or None if the instruction is ignored.
+    """
+    __slots__ = ()
+
+    def make_gate(self, time):
+        if self.factory is None:
+            return None
+        gate = self.factory(time)
+        gate.label = self.label
+        return gate
+
+
+def _mnemonic(instr):
+    """Returns the first word of a QASM instruction, or None if it is empty.
+    """
+    words = instr.split(None, 1)
+    return words[0] if words else None
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+# The parser of a worker process of ConfigurableParser.gen_circuits
+_worker_parser = None
+
+
+def _init_worker(parser):
+    global _worker_parser
+    _worker_parser = parser
+
+
+def _parse_circuit_in_worker(*job):
+    return _worker_parser._parse_circuit_seeded(*job)
+
+
 class Decomposer:
     """Instances of this class are callable objects, that take a QASM
     instruction as input and return its expansion, according to definition in
@@ -30,6 +73,11 @@ class Decomposer:
     def __init__(self, alias, expansion):
         s = alias.strip()
         arg_nums = self._arg_matcher.findall(s)
+        # The mnemonic, that an instruction must start with to match this
+        # alias, or None if the alias starts with an argument.
+        self.mnemonic = _mnemonic(s)
+        if self.mnemonic is not None and '%' in self.mnemonic:
+            self.mnemonic = None
         # This RE should match provided alias (for example 'x q0,q1' for
         # alias 'x %0,%1' and, if match is successful, return ('q0', 'q1')
         # tuple.
@@ -161,18 +209,29 @@ class ConfigurableParser:
                 'Could not find "instructions" block in config')
 
         decompositions = configuration.get('gate_decomposition', {})
-        self._decomposers = {Decomposer(al, dec)
-                             for al, dec in decompositions.items()}
+        # Decomposers are indexed by mnemonic, so that an instruction is only
+        # matched against the aliases that can match it.
+        self._decomposers = {}
+        self._wildcard_decomposers = []
+        for al, dec in decompositions.items():
+            decomposer = Decomposer(al, dec)
+            if decomposer.mnemonic is None:
+                self._wildcard_decomposers.append(decomposer)
+            else:
+                self._decomposers.setdefault(
+                    decomposer.mnemonic, []).append(decomposer)
+        self._expansions = {}
 
         self._simulation_settings = configuration.get('simulation_settings',
                                                       None)
+        self._prototypes = {}
         self._gates_order_table = {
             'asap': self._gates_order_asap,
             'alap': self._gates_order_alap,
         }
 
     def parse(self, qasm, rng=None, *, ordering='ALAP',
-              time_start=None, time_end=None):
+              time_start=None, time_end=None, workers=None):
         """Parses QASM to the list of circuits.
 
         Parameters
@@ -194,13 +253,17 @@ class ConfigurableParser:
             Ending time for the circuits.
             Mutually exclusive with `time_start`.
             If both are None, defaults to 0.
+        workers: int or None
+            If provided, circuits are parsed in a pool of `workers`
+            processes. Circuits are still returned in file order, and the
+            result does not depend on the number of workers.
         """
         return list(self.gen_circuits(
             qasm, rng, ordering=ordering,
-            time_start=time_start, time_end=time_end))
+            time_start=time_start, time_end=time_end, workers=workers))
 
     def gen_circuits(self, qasm, rng=None, *, ordering='ALAP',
-                     time_start=None, time_end=None):
+                     time_start=None, time_end=None, workers=None):
         """Returns a generator over the circuits, defined in QASM.
         Circuits are constructed lazily.
 
@@ -223,14 +286,22 @@ class ConfigurableParser:
             Ending time for the circuits.
             Mutually exclusive with `time_start`.
             If both are None, defaults to 0.
+        workers: int or None
+            If provided, circuits are parsed in a pool of `workers`
+            processes. Circuits are still returned in file order, and the
+            result does not depend on the number of workers.
+            At most `2 * workers` circuits are parsed ahead of the consumer.
         """
         rng = ct._ensure_rng(rng)
+        if workers is not None and workers < 1:
+            raise ValueError('Number of workers must be positive, got {}'
+                             .format(workers))
         if isinstance(qasm, str):
             return self._gen_circuits_fn(qasm, rng, ordering,
-                                         time_start, time_end)
+                                         time_start, time_end, workers)
         else:
             return self._gen_circuits_fp(qasm, rng, ordering,
-                                         time_start, time_end)
+                                         time_start, time_end, workers)
 
     @staticmethod
     def _gen_circuits_src(fp):
@@ -261,7 +332,8 @@ class ConfigurableParser:
         else:
             warnings.warn("Could not find any circuits in the QASM file.")
 
-    def _gen_circuits_fp(self, fp, rng, ordering, time_start, time_end):
+    def _gen_circuits_fp(self, fp, rng, ordering, time_start, time_end,
+                         workers=None):
         """Returns a generator over the circuits, provided iterator or
         generator of strings `fp`.
         """
@@ -279,18 +351,51 @@ class ConfigurableParser:
         if not n_qubits:
             raise QasmError('Number of qubits is not specified')
 
-        for title, source in self._gen_circuits_src(fp):
-            # We pass the same rng to avoid correlations between measurements,
-            # everything else must be re-initialized
-            yield self._parse_circuit(title, source, ordering, rng,
-                                      time_start, time_end)
-
-    def _gen_circuits_fn(self, fn, rng, ordering, time_start, time_end):
+        # Every circuit gets its own RNG, seeded from `rng` in file order, so
+        # that the result does not depend on which process parses it.
+        jobs = ((title, source, ordering, rng.randint(2**31),
+                 time_start, time_end)
+                for title, source in self._gen_circuits_src(fp))
+        if workers is None:
+            for job in jobs:
+                yield self._parse_circuit_seeded(*job)
+        else:
+            yield from self._gen_circuits_pool(jobs, workers)
+
+    def _gen_circuits_pool(self, jobs, workers):
+        """Parses circuits from `jobs` in a process pool, yielding them in
+        order and keeping at most `2 * workers` of them in flight."""
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=_init_worker,
+                                   initargs=(self,))
+        try:
+            pending = deque()
+            for job in jobs:
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(_parse_circuit_in_worker, *job))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Future.cancel instead of shutdown(cancel_futures=True), which
+            # needs Python 3.9
+            for future in pending:
+                future.cancel()
+            pool.shutdown()
+
+    def _parse_circuit_seeded(self, title, source, ordering, seed,
+                              time_start, time_end):
+        return self._parse_circuit(title, source, ordering,
+                                   np.random.RandomState(seed),
+                                   time_start, time_end)
+
+    def _gen_circuits_fn(self, fn, rng, ordering, time_start, time_end,
+                         workers=None):
         """Returns a generator over the circuits, provided QASM filename `fn`.
         """
         with open(fn, 'r') as fp:
             generator = self._gen_circuits_fp(fp, rng, ordering,
-                                              time_start, time_end)
+                                              time_start, time_end, workers)
             for circuit in generator:
                 yield circuit
 
@@ -316,15 +421,44 @@ class ConfigurableParser:
             # No simulation settings provided -- assuming ideal qubits
             circuit.add_qubit(qubit_name)
 
-    def _gate_spec_to_gate(self, gate_spec, gate_label, rng):
-        """Returns a tuple of gate with its starting time set to 0 and gate's
-        duration"""
+    def __getstate__(self):
+        # Prototypes hold closures, that can not be pickled for worker
+        # processes. They are cheap to compile again there.
+        state = self.__dict__.copy()
+        state['_prototypes'] = {}
+        return state
+
+    def prototype(self, instruction):
+        """Returns the GatePrototype of `instruction`, a key of the
+        "instructions" config. It is compiled on first use and reused by
+        all later circuits.
+        """
+        try:
+            return self._prototypes[instruction]
+        except KeyError:
+            pass
+        gate_spec = self._instructions[instruction]
+        duration, factory = self._gate_spec_to_factory(gate_spec)
+        prototype = GatePrototype(tuple(gate_spec['qubits']), duration,
+                                  instruction, factory)
+        self._prototypes[instruction] = prototype
+        return prototype
+
+    def precompile(self):
+        """Compiles the prototypes of all instructions in the config, so
+        that parsing does not pay for it later."""
+        for instruction in self._instructions:
+            self.prototype(instruction)
+
+    def _gate_spec_to_factory(self, gate_spec):
+        """Returns a tuple of gate's duration and a function of time that
+        constructs the gate, or None if the gate is ignored."""
         # TODO After fixing https://gitlab.com/quantumsim/quantumsim/issues/7
         # this should be refactored, since duration will be bundled into the
         # gate object itself.
         qubits = gate_spec['qubits']
         if self._gate_is_ignored(gate_spec):
-            return None, 0.
+            return 0., None
         elif self._gate_is_measurement(gate_spec):
             # FIXME VO: To comply with Brian's code, I insert here
             # ButterflyGate. I suppose this is not as this should be, need to
@@ -340,40 +474,36 @@ class ConfigurableParser:
                         .format(qubit_name))
                 p_exc = params['frac1_0']
                 p_dec = 1 - params['frac1_1']
-                gate = ct.ButterflyGate(qubits[0], 0.,
-                                        p_exc=p_exc, p_dec=p_dec)
-                gate.label = gate_label
+
+                def factory(time):
+                    return ct.ButterflyGate(qubits[0], time,
+                                            p_exc=p_exc, p_dec=p_dec)
             else:
-                gate = None
+                factory = None
             duration = 0.
         elif self._gate_is_single_qubit(gate_spec):
             kr_spec = np.array(gate_spec['kraus_repr'], dtype=float)
-            kr_list = [(m[:, 0] + m[:, 1]*1j).reshape((2, 2)) for m in kr_spec]
-            ptm_list = [ptm.single_kraus_to_ptm(kr) for kr in kr_list]
-            gate = ct.SinglePTMGate(
-                qubits[0],
-                0.,
-                np.sum(ptm_list, axis=0),
-            )
-            gate.label = gate_label
+            krauses = (kr_spec[..., 0] + kr_spec[..., 1]*1j).reshape(
+                (-1, 2, 2))
+            gate_ptm = _read_only(ptm.single_krauses_to_ptm(krauses))
+
+            def factory(time):
+                return ct.SinglePTMGate(qubits[0], time, gate_ptm)
             duration = gate_spec['duration']
         elif self._gate_is_two_qubit(gate_spec):
             kr_spec = np.array(gate_spec['kraus_repr'], dtype=float)
-            kr_list = [(m[:, 0] + m[:, 1]*1j).reshape((4, 4)) for m in kr_spec]
-            ptm_list = [ptm.double_kraus_to_ptm(kr) for kr in kr_list]
-            gate = ct.TwoPTMGate(
-                qubits[0],
-                qubits[1],
-                np.sum(ptm_list, axis=0),
-                0.,
-            )
-            gate.label = gate_label
+            krauses = (kr_spec[..., 0] + kr_spec[..., 1]*1j).reshape(
+                (-1, 4, 4))
+            gate_ptm = _read_only(ptm.double_krauses_to_ptm(krauses))
+
+            def factory(time):
+                return ct.TwoPTMGate(qubits[0], qubits[1], gate_ptm, time)
             duration = gate_spec['duration']
         else:
             raise ConfigurationError(
                 'Could not identify gate type from gate_spec')
 
-        return gate, duration
+        return duration, factory
 
     def _parse_circuit(self, title, source, ordering, rng,
                        time_start, time_end):
@@ -381,9 +511,9 @@ class ConfigurableParser:
         to a Quantumsim circuit.
         """
         source_decomposed = list(self._expand_decompositions(source))
-        gate_specs = [self._instructions[line] for line in source_decomposed]
+        prototypes = [self.prototype(line) for line in source_decomposed]
         # Here we get all qubits, that actually participate in circuit
-        qubits = set(chain(*(gs['qubits'] for gs in gate_specs)))
+        qubits = set(chain(*(p.qubits for p in prototypes)))
         circuit = ct.Circuit(title)
         for qubit in qubits:
             self._add_qubit(circuit, qubit)
@@ -393,8 +523,7 @@ class ConfigurableParser:
         except KeyError:
             raise RuntimeError('Unknown ordering: {}'.format(ordering))
         gates, tmin, tmax = order_func(
-            qubits=qubits, gate_specs=gate_specs,
-            gate_labels=source_decomposed, rng=rng,
+            qubits=qubits, prototypes=prototypes, rng=rng,
             time_start=time_start, time_end=time_end)
 
         for gate in gates:
@@ -445,26 +574,22 @@ class ConfigurableParser:
                         ' number of qubits')
         return out
 
-    def _gates_order_alap(self, qubits, gate_specs, gate_labels,
+    def _gates_order_alap(self, qubits, prototypes,
                           rng, time_start, time_end):
-        """Gets list of gate specifications (as parsed from configuration) and
+        """Gets list of gate prototypes (as compiled from configuration) and
         returns list of gates constructed, scheduling each gate as late
         as possible.
         """
-        rng = ct._ensure_rng(rng)
         current_times = {qubit: 0. for qubit in qubits}
         gates = []
-        for spec, label in zip(reversed(gate_specs),
-                               reversed(gate_labels)):
-            gate, duration = self._gate_spec_to_gate(spec, label, rng)
-            # gate is validated already inside `_gate_spec_to_gate`
-            if gate is None:
+        for prototype in reversed(prototypes):
+            if prototype.factory is None:
                 continue
             gate_time_end = min((current_times[qubit]
-                                 for qubit in spec['qubits']))
-            gate_time_start = gate_time_end - duration
-            gate.time = 0.5*(gate_time_start + gate_time_end)
-            for qubit in spec['qubits']:
+                                 for qubit in prototype.qubits))
+            gate_time_start = gate_time_end - prototype.duration
+            gate = prototype.make_gate(0.5*(gate_time_start + gate_time_end))
+            for qubit in prototype.qubits:
                 current_times[qubit] = gate_time_start
             gates.append(gate)
 
@@ -486,25 +611,22 @@ class ConfigurableParser:
 
         return gates, time_min + time_shift, time_shift
 
-    def _gates_order_asap(self, qubits, gate_specs, gate_labels,
+    def _gates_order_asap(self, qubits, prototypes,
                           rng, time_start, time_end):
-        """Gets list of gate specifications (as parsed from configuration) and
+        """Gets list of gate prototypes (as compiled from configuration) and
         returns list of gates constructed, scheduling each gate as soon
         as possible.
         """
-        rng = ct._ensure_rng(rng)
         current_times = {qubit: 0. for qubit in qubits}
         gates = []
-        for spec, label in zip(gate_specs, gate_labels):
-            gate, duration = self._gate_spec_to_gate(spec, label, rng)
-            # gate is validated already inside `_gate_spec_to_gate`
-            if gate is None:
+        for prototype in prototypes:
+            if prototype.factory is None:
                 continue
             gate_time_start = max((current_times[qubit]
-                                   for qubit in spec['qubits']))
-            gate_time_end = gate_time_start + duration
-            gate.time = 0.5*(gate_time_start + gate_time_end)
-            for qubit in spec['qubits']:
+                                   for qubit in prototype.qubits))
+            gate_time_end = gate_time_start + prototype.duration
+            gate = prototype.make_gate(0.5*(gate_time_start + gate_time_end))
+            for qubit in prototype.qubits:
                 current_times[qubit] = gate_time_end
             gates.append(gate)
 
@@ -530,31 +652,48 @@ class ConfigurableParser:
         impossible.
         """
         for s in source:
-            # FIXME Here we filter out prepz gates, based on name. Generally
-            # this should be done, based on gate_spec, in the method
-            # _gate_is_ignored, but it does not get any signature of it yet.
-            if s.startswith('prepz'):
-                continue
-            elif s in self._instructions.keys():
-                yield s
-                continue
+            yield from self._expand_instruction(s)
+
+    def _expand_instruction(self, instr, expanding=frozenset()):
+        """Returns a tuple of instructions from "instructions" field of
+        configuration, that `instr` expands to. Expansions are memoized per
+        instruction. `expanding` is the set of instructions, that are being
+        expanded already, and is used to detect cyclic decompositions.
+        """
+        try:
+            return self._expansions[instr]
+        except KeyError:
+            pass
+        # FIXME Here we filter out prepz gates, based on name. Generally
+        # this should be done, based on gate_spec, in the method
+        # _gate_is_ignored, but it does not get any signature of it yet.
+        if instr.startswith('prepz'):
+            expansion = ()
+        elif instr in self._instructions:
+            expansion = (instr,)
+        else:
+            if instr in expanding:
+                raise ConfigurationError(
+                    'Gate decomposition of "{}" is cyclic'.format(instr))
             # trying to decompose instruction
-            maybe_decomposed = self._try_decompose(s)
-            if maybe_decomposed is not None:
-                # These may be also aliases, so we call here the same
-                # function recursively.
-                # FIXME Would be nice to insert here some protection
-                # against infinite recursion.
-                for s1 in self._expand_decompositions(maybe_decomposed):
-                    yield s1
-                continue
-            raise QasmError("Unknown QASM instruction: {}".format(s))
+            maybe_decomposed = self._try_decompose(instr)
+            if maybe_decomposed is None:
+                raise QasmError("Unknown QASM instruction: {}".format(instr))
+            # These may be also aliases, so we expand them recursively.
+            expanding = expanding | {instr}
+            expansion = tuple(chain.from_iterable(
+                self._expand_instruction(s, expanding)
+                for s in maybe_decomposed))
+        self._expansions[instr] = expansion
+        return expansion
 
     def _try_decompose(self, instr):
         """If instruction matches alias, this method returns expansion of
         instruction with this alias. If it does not match, it returns `None`.
         """
-        for decomposer in self._decomposers:
+        for decomposer in chain(
+                self._decomposers.get(_mnemonic(instr), ()),
+                self._wildcard_decomposers):
             result = decomposer(instr)
             if result is not None:
                 return result
@@ -0,0 +1,250 @@
+import re
+
+from .. import circuit as ct
+from .configurable import QasmError
+from .gates import sgl_qubit_gate_map, dbl_qubit_gate_map
+
+_qubits_re = re.compile(r"^qubits\s+(\S+)$")
+_title_re = re.compile(r"^\.([A-Za-z0-9_]+)$")
+_wait_re = re.compile(r"^qwait\s+([0-9]+)$")
+_measure_re = re.compile(r"^measure\s+([A-Za-z0-9]+)$")
+_single_re = re.compile(r"^([A-Za-z0-9_]+)\s+([A-Za-z0-9]+)$")
+_double_re = re.compile(
+    r"^([A-Za-z0-9_]+)\s+([A-Za-z0-9]+)\s*,\s*([A-Za-z0-9]+)$")
+
+
+def _lines(qasm):
+    if isinstance(qasm, str):
+        return qasm.splitlines()
+    return qasm
+
+
+class StreamingQASMParser:
+    """
+    Line oriented drop-in replacement of QASMParser, that produces the same
+    circuits without building a parse tree of the whole file, and without
+    importing parsimonious.
+
+    Input is read line by line, and `gen_circuits` yields every circuit as
+    soon as its measurement block is complete, so that QASM files of any
+    size can be processed in constant memory.
+
+    qubit_parameters is a dictionary defining the qubit properties:
+        qubit_parameters = {qubit_name: qubit_pars, ...}
+
+    where
+
+        qubit_pars.keys() == ['t1', 't2', 'frac_1_0', 'frac_1_1']
+
+    dt gives gate timings:
+        dt = (single_qubit_gate_time, two_qubit_gate_time)
+    """
+
+    def __init__(self, qubit_parameters, timegrid=20,
+                 gate_1_step=1, gate_2_step=5):
+
+        self.qubit_names = []
+
+        self.timestep = 0
+        self.circuits = []
+        self.qubit_parameters = qubit_parameters
+        self.timestep_increment_sgl = gate_1_step * timegrid
+        self.timestep_increment_dbl = gate_2_step * timegrid
+        self.timestep_increment = timegrid
+
+    def parse(self, qasm):
+        """Parses `qasm`, a string or an iterable over lines, and appends the
+        circuits to `self.circuits`."""
+        self.circuits.extend(self.gen_circuits(qasm))
+
+    def gen_circuits(self, qasm):
+        """Returns a generator over the circuits defined in `qasm`, a string
+        or an iterable over lines, for example an open file."""
+        self._circuit = None
+        self._measured = False
+        self._has_gates = False
+        seen_circuit = False
+
+        for lineno, line in enumerate(_lines(qasm), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+
+            m = _qubits_re.match(line)
+            if m:
+                if seen_circuit:
+                    raise QasmError(
+                        "Line {}: qubits must be specified before the "
+                        "first circuit".format(lineno))
+                self._add_qubits(m.group(1))
+                continue
+            seen_circuit = True
+
+            m = _title_re.match(line)
+            if m:
+                circuit = self._finish_circuit()
+                if circuit is not None:
+                    yield circuit
+                elif self._circuit is not None:
+                    raise QasmError(
+                        "Line {}: circuit '{}' has no measurements".format(
+                            lineno, self._circuit.title))
+                self._start_circuit(m.group(1))
+                continue
+
+            measurements = self._parse_measurements(line)
+            if measurements is not None:
+                if self._circuit is None:
+                    self._start_circuit("unnamed circuit")
+                for qb in measurements:
+                    self._to_be_measured.add(self._check_qubit(qb))
+                self._measured = True
+                continue
+
+            circuit = self._finish_circuit()
+            if circuit is not None:
+                yield circuit
+            if self._circuit is None:
+                self._start_circuit("unnamed circuit")
+            self._parse_gatelist(line, lineno)
+
+        circuit = self._finish_circuit()
+        if circuit is not None:
+            yield circuit
+        elif self._circuit is not None:
+            if self._has_gates or self._circuit.title != "unnamed circuit":
+                raise QasmError("Circuit '{}' has no measurements".format(
+                    self._circuit.title))
+            # Waits after the last measurement are ignored
+            self.timestep_increment = self._saved_timestep_increment
+        self._circuit = None
+
+    def _add_qubits(self, num):
+        try:
+            num_qubits = int(num)
+        except ValueError:
+            raise QasmError("Argument must be a number at 'qubits '" + num)
+        for i in range(num_qubits):
+            self.qubit_names.append("q" + str(i))
+
+        # populate the qubit parameters from a given default, if necessary
+        for qbn in self.qubit_names:
+            if qbn not in self.qubit_parameters:
+                self.qubit_parameters[qbn] = self.qubit_parameters['default']
+
+    def _check_qubit(self, qb):
+        if qb not in self.qubit_names:
+            raise RuntimeError("Qubit '" + qb + "' undefined")
+        return qb
+
+    def _start_circuit(self, title):
+        self.timestep = 0
+        self._circuit = ct.Circuit(title)
+        for qb in self.qubit_names:
+            t1 = self.qubit_parameters[qb]['T1']
+            t2 = self.qubit_parameters[qb]['T2']
+            self._circuit.add_qubit(qb, t1=t1, t2=t2)
+        self._to_be_measured = set()
+        self._measured = False
+        self._has_gates = False
+        self._saved_timestep_increment = self.timestep_increment
+
+    @staticmethod
+    def _parse_measurements(line):
+        """Returns the qubits measured by `line`, or None if it is not a
+        measurement block."""
+        if line.startswith("{") and line.endswith("}"):
+            parts = [p.strip() for p in line[1:-1].split("|")]
+        else:
+            parts = [line]
+        matches = [_measure_re.match(p) for p in parts]
+        if not any(matches):
+            return None
+        if not all(matches):
+            raise QasmError(
+                "Measurements can not be combined with gates: " + line)
+        return [m.group(1) for m in matches]
+
+    def _parse_gatelist(self, line, lineno):
+        if line.startswith("{"):
+            if not line.endswith("}"):
+                raise QasmError("Line {}: unterminated gate list".format(
+                    lineno))
+            gates = [g.strip() for g in line[1:-1].split("|")]
+        else:
+            gates = [line]
+        for gate in gates:
+            self._parse_gate(gate, lineno)
+        self.timestep += self.timestep_increment
+        self.timestep_increment = min(
+            self.timestep_increment_dbl,
+            self.timestep_increment_sgl)
+
+    def _parse_gate(self, gate, lineno):
+        m = _wait_re.match(gate)
+        if m:
+            self.timestep += int(m.group(1))
+            return
+
+        m = _double_re.match(gate)
+        if m:
+            gate_name, arg1, arg2 = m.groups()
+            dt = self.timestep_increment_dbl
+            gate_factory = self._gate_factory(dbl_qubit_gate_map, gate_name,
+                                              lineno)
+            self._circuit.add_gate(gate_factory(
+                bit0=self._check_qubit(arg1), bit1=self._check_qubit(arg2),
+                time=self.timestep + dt / 2))
+            self._has_gates = True
+            self.timestep_increment = max(dt, self.timestep_increment)
+            return
+
+        m = _single_re.match(gate)
+        if m:
+            gate_name, arg = m.groups()
+            dt = self.timestep_increment_sgl
+            gate_factory = self._gate_factory(sgl_qubit_gate_map, gate_name,
+                                              lineno)
+            self._check_qubit(arg)
+            if gate_factory is not None:
+                self._circuit.add_gate(gate_factory(
+                    bit=arg, time=self.timestep + dt / 2))
+            self._has_gates = True
+            self.timestep_increment = max(dt, self.timestep_increment)
+            return
+
+        raise QasmError("Line {}: could not parse '{}'".format(lineno, gate))
+
+    @staticmethod
+    def _gate_factory(gate_map, gate_name, lineno):
+        try:
+            return gate_map[gate_name.lower()]
+        except KeyError:
+            raise QasmError("Line {}: unknown gate '{}'".format(
+                lineno, gate_name))
+
+    def _finish_circuit(self):
+        """If the current circuit is complete, finishes and returns it."""
+        if self._circuit is None or not self._measured:
+            return None
+        circuit = self._circuit
+        self._circuit = None
+
+        actually_used_qubits = set(self._to_be_measured)
+        for g in circuit.gates:
+            for qb in g.involved_qubits:
+                actually_used_qubits.add(qb)
+
+        circuit.qubits = [
+            qb for qb in circuit.qubits
+            if qb.name in actually_used_qubits]
+
+        for b in self.qubit_names:
+            p_exc = self.qubit_parameters[b]['frac1_0']
+            p_dec = 1 - self.qubit_parameters[b]['frac1_1']
+            ro_gate = ct.ButterflyGate(b, p_exc=p_exc, p_dec=p_dec,
+                                       time=self.timestep)
+            circuit.add_gate(ro_gate)
+        circuit.add_waiting_gates(tmin=0, tmax=self.timestep)
+        circuit.order()
+        return circuit
@@ -1,7 +1,6 @@
 import parsimonious
 from .. import circuit as ct
-import numpy as np
-import functools
+from .gates import sgl_qubit_gate_map, dbl_qubit_gate_map
 
 qasm_grammar = parsimonious.Grammar(r"""
         program = nl* (qubit_spec)* nl (circuit_spec)+ (dangling_wait)*
@@ -38,33 +37,6 @@ qasm_grammar = parsimonious.Grammar(r"""
         """)
 
 
-sgl_qubit_gate_map = {
-    "i": None,
-    "mry90": functools.partial(ct.RotateY, angle=-np.pi / 2),
-    "rym90": functools.partial(ct.RotateY, angle=-np.pi / 2),
-    "my90": functools.partial(ct.RotateY, angle=-np.pi / 2),
-    "mY90": functools.partial(ct.RotateY, angle=-np.pi / 2),
-    "ry90": functools.partial(ct.RotateY, angle=np.pi / 2),
-    "y90": functools.partial(ct.RotateY, angle=np.pi / 2),
-    "ry180": functools.partial(ct.RotateY, angle=np.pi),
-    "y180": functools.partial(ct.RotateY, angle=np.pi),
-    "y": functools.partial(ct.RotateY, angle=np.pi),
-    "mrx90": functools.partial(ct.RotateX, angle=-np.pi / 2),
-    "mx90": functools.partial(ct.RotateX, angle=-np.pi / 2),
-    "rx90": functools.partial(ct.RotateX, angle=np.pi / 2),
-    "x90": functools.partial(ct.RotateX, angle=np.pi / 2),
-    "rx180": functools.partial(ct.RotateX, angle=np.pi),
-    "x180": functools.partial(ct.RotateX, angle=np.pi),
-    "x": functools.partial(ct.RotateX, angle=np.pi),
-    "prepz": None
-}
-
-dbl_qubit_gate_map = {
-    "cz": ct.CPhase,
-    "fl_cw_01": ct.CPhase
-}
-
-
 def dropnil(lst):
     return [a for a in lst if a is not None]
 
@@ -3,24 +3,72 @@
 # Distributed under the GNU GPLv3. See LICENSE.txt or
 # https://www.gnu.org/licenses/gpl.txt
 
-import numpy as np
+import functools
 
-from collections import defaultdict
+import numpy as np
 
 from . import ptm
+from . import backends
+
+
+def __getattr__(name):
+    # resolved on first use, so that importing this module does not probe
+    # for a GPU
+    if name == "default_density_class":
+        return backends.get()
+    if name == "using_gpu":
+        return backends.default_name() == "cuda"
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+_identity_ptm = np.eye(4)
+
 
-try:
-    from . import dm10
-    default_density_class = dm10.Density
-    using_gpu = True
-except BaseException:
-    from . import dm_np
-    default_density_class = dm_np.DensityNP
-    using_gpu = False
+@functools.lru_cache(maxsize=64)
+def _compressed_indices(no_qubits, positions):
+    """For every index into the diagonal of a `no_qubits` density matrix,
+    the number formed by its bits at `positions` (least significant
+    first)."""
+    indices = np.arange(2**no_qubits)
+    compressed = np.zeros_like(indices)
+    for k, pos in enumerate(positions):
+        compressed |= ((indices >> pos) & 1) << k
+    compressed.setflags(write=False)
+    return compressed
+
+
+@functools.lru_cache(maxsize=64)
+def _popcounts(no_qubits, mask, flip):
+    """For every index into the diagonal of a `no_qubits` density matrix,
+    the number of bits in `mask` that differ from the ones in `flip`."""
+    indices = (np.arange(2**no_qubits) ^ flip) & mask
+    counts = np.zeros_like(indices)
+    while mask:
+        counts += indices & 1
+        indices >>= 1
+        mask >>= 1
+    counts.setflags(write=False)
+    return counts
+
+
+# the 0xy1 basis elements with a non-zero overlap with the Pauli matrices,
+# and the overlaps
+_pauli_weights = {
+    "I": ([0, 3], np.array([1., 1.])),
+    "X": ([1], np.array([np.sqrt(2)])),
+    "Y": ([2], np.array([np.sqrt(2)])),
+    "Z": ([0, 3], np.array([1., -1.])),
+}
+
+
+# tolerance below which coherences and populations of a classical bit are
+# considered to vanish
+_classical_atol = 1e-12
 
 
 class SparseDM:
-    def __init__(self, names=None, density_class=default_density_class):
+    def __init__(self, names=None, density_class=None, backend=None):
         """A sparse density matrix for a set of qubits with names `names`.
 
         Each qubit can be in a "classical state", where it is in a basis state
@@ -28,22 +76,37 @@ class SparseDM:
         can be written as a product state. This is the case after a measurement projection,
         meaning that a measurement turns a qubit classical.
 
+        A classical qubit can also be in a mixture of the two basis states, e.g. after decay
+        or a reset. Its populations (p0, p1) are then stored in `self.classical_populations`,
+        and `self.classical` holds the more likely state.
+
         If a qubit is not classical, it is quantum, which means that it is part of the
         full dense density matrix `self.full_dm`.
+
+        The dense part is stored with `density_class`, or with the backend
+        named `backend` in the registry `quantumsim.backends`. If neither is
+        given, the default backend is used.
         """
+        if density_class is None:
+            density_class = backends.get(backend)
+        elif backend is not None:
+            raise ValueError("Specify either density_class or backend")
+
         if isinstance(names, int):
             names = list(range(names))
 
         self.names = names
         self.no_qubits = len(names)
         self.classical = {bit: 0 for bit in names}
+        self.classical_populations = {}
         self.idx_in_full_dm = {}
+        self.density_class = density_class
         self.full_dm = density_class(0)
         self.max_bits_in_full_dm = 0
 
         self.classical_probability = 1
 
-        self.single_ptms_to_do = defaultdict(list)
+        self.single_ptms_to_do = {}
 
         self._cphase_ptm = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1]))
 
@@ -58,8 +121,16 @@ class SparseDM:
             raise ValueError("ensure_dense: Unknown qubit '{}'.".format(bit))
         if bit not in self.idx_in_full_dm:
             state = self.classical[bit]
+            populations = self.classical_populations.pop(bit, None)
             idx = self.full_dm.no_qubits
-            self.full_dm.add_ancilla(state)
+            if populations is None:
+                self.full_dm.add_ancilla(state)
+            else:
+                # prepare the mixture from the ground state
+                self.full_dm.add_ancilla(0)
+                p0, p1 = populations
+                self.full_dm.apply_ptm(
+                    idx, np.outer([p0, 0, 0, p1], [1, 0, 0, 1]))
             del self.classical[bit]
             self.idx_in_full_dm[bit] = idx
 
@@ -74,7 +145,7 @@ class SparseDM:
         if bit not in self.names:
             raise ValueError(
                 "ensure_classical: Unknown qubit '{}'.".format(bit))
-        if bit in self.idx_in_full_dm:
+        if bit in self.idx_in_full_dm or bit in self.classical_populations:
             p0, p1 = self.peak_measurement(bit)
             if p0 < epsilon:
                 self.project_measurement(bit, 1)
@@ -87,22 +158,34 @@ class SparseDM:
     def peak_measurement(self, bit):
         """Obtain the two partial traces (p0, p1) that define the probabilities for measuring bit in state (0, 1).
         The state of the system is not changed. Use project_measurement to perform the actual measurement projection.
+
+        A pending single qubit ptm is taken into account without applying it to the density matrix if
+        the probabilities after it only depend on the probabilities before it.
         """
-        self.combine_and_apply_single_ptm(bit)
-        if bit in self.idx_in_full_dm:
-            qbit = self.idx_in_full_dm[bit]
-            p0, p1 = self.full_dm.partial_trace(qbit)
+        ptm = self.single_ptms_to_do.get(bit)
+        if bit in self.classical:
+            pauli_vector = self._classical_pauli_vector(bit)
+            if ptm is not None:
+                pauli_vector = ptm.dot(pauli_vector)
+            return (pauli_vector[0], pauli_vector[3])
+        if ptm is not None and np.allclose(ptm[[0, 3]][:, [1, 2]], 0):
+            p0, p1 = self.full_dm.partial_trace(self.idx_in_full_dm[bit])
+            p0, p1 = ptm[[0, 3]][:, [0, 3]].dot([p0, p1])
             return (p0, p1)
-        elif self.classical[bit] == 0:
-            return (1, 0)
-        elif self.classical[bit] == 1:
-            return (0, 1)
+
+        self.combine_and_apply_single_ptm(bit)
+        qbit = self.idx_in_full_dm[bit]
+        p0, p1 = self.full_dm.partial_trace(qbit)
+        return (p0, p1)
 
     def project_measurement(self, bit, state):
         """Project a bit to a fixed state, making it classical and
         reducing the size of the full density matrix.
         The reduced density matrix is not normalized, so that
         its trace after projection represents the probability for that event.
+
+        Projecting a classical bit onto the other state gives probability 0,
+        projecting a classical mixture multiplies by the population of `state`.
         """
         self.combine_and_apply_single_ptm(bit)
         if bit in self.idx_in_full_dm:
@@ -112,9 +195,16 @@ class SparseDM:
                 if self.idx_in_full_dm[b] == self.full_dm.no_qubits:
                     self.idx_in_full_dm[b] = self.idx_in_full_dm[bit]
             del self.idx_in_full_dm[bit]
+        elif bit in self.classical:
+            populations = self.classical_populations.pop(bit, None)
+            if populations is not None:
+                self.classical_probability *= populations[state]
+            elif self.classical[bit] != state:
+                self.classical_probability = 0
+            self.classical[bit] = state
         else:
             raise ValueError(
-                "Trying to measure classical bit '{}'.".format(bit))
+                "project_measurement: Unknown qubit '{}'.".format(bit))
 
     def peak_multiple_measurements(self, bits):
         """Obtain the probabilities for all combinations of a multiple
@@ -135,59 +225,152 @@ class SparseDM:
         for bit in bits:
             self.combine_and_apply_single_ptm(bit)
 
-        classical_bits = {bit: self.classical[bit]
-                          for bit in bits if bit in self.classical}
+        classical_bits = {bit: self.classical[bit] for bit in bits
+                          if bit in self.classical and
+                          bit not in self.classical_populations}
+
+        # the dense bits sorted by position, so that the outcomes are in the
+        # order of their indices in the diagonal, followed by the classical
+        # mixtures, which are combined with them by marginal
+        dense_bits = sorted(
+            (bit for bit in bits if bit in self.idx_in_full_dm),
+            key=self.idx_in_full_dm.get)
+        bits = dense_bits + [bit for bit in bits
+                             if bit in self.classical_populations]
+        # the first bit is the least significant one of the index
+        probs = self.marginal(bits).transpose().reshape(-1)
 
-        res = [(classical_bits, self.full_dm.copy())]
-
-        bits = [bit for bit in bits if bit not in self.classical]
-
-        # commented out because apparently unused...
-        # bit_idxs = [(bit, self.idx_in_full_dm[bit])
-        #   for i, bit in enumerate(bits)]
+        res = []
+        for idx, prob in enumerate(probs):
+            outcome = classical_bits.copy()
+            for k, bit in enumerate(bits):
+                outcome[bit] = (idx >> k) & 1
 
-        mask = 0
-        for bit in bits:
-            mask |= 1 << self.idx_in_full_dm[bit]
+            res.append((outcome, prob))
 
-        diagonal = self.full_dm.get_diag()
+        return res
 
-        probs = {}
+    def marginal(self, bits):
+        """Return the probabilities of all outcomes of measuring `bits`, a
+        list of qubit names, as an array of shape (2,) * len(bits), where
+        element [r0, r1, ...] is the probability of bits[0] giving r0,
+        bits[1] giving r1, and so on.
 
-        for idx, prob in enumerate(diagonal):
-            if idx & mask in probs:
-                probs[idx & mask] += prob
-            else:
-                probs[idx & mask] = prob
+        Like peak_multiple_measurements, this reads the diagonal of the
+        density matrix, does not change the state and sums up to the trace.
+        """
+        for bit in bits:
+            if bit not in self.names:
+                raise ValueError("marginal: Unknown qubit '{}'.".format(bit))
+            self.combine_and_apply_single_ptm(bit)
 
-        res = []
-        for idx in probs:
-            outcome = classical_bits.copy()
-            for bit in bits:
-                outcome[bit] = int(idx & (1 << self.idx_in_full_dm[bit]) > 0)
+        dense_bits = [bit for bit in bits if bit in self.idx_in_full_dm]
+        positions = tuple(self.idx_in_full_dm[bit] for bit in dense_bits)
+        probs = np.bincount(
+            _compressed_indices(self.full_dm.no_qubits, positions),
+            weights=self.full_dm.get_diag(), minlength=2**len(dense_bits))
+        # the compressed index has the first bit as least significant one
+        probs = probs.reshape((2,) * len(dense_bits)).transpose()
+
+        factor = self.classical_probability
+        for bit, populations in self.classical_populations.items():
+            if bit not in bits:
+                factor *= populations.sum()
+
+        # an outer product with the populations of the classical bits
+        operands = [probs, [bits.index(bit) for bit in dense_bits]]
+        for n, bit in enumerate(bits):
+            if bit in self.classical:
+                operands += [self._classical_pauli_vector(bit)[[0, 3]], [n]]
+        return factor * np.einsum(*operands, list(range(len(bits))))
+
+    def expectation(self, pauli_strings):
+        """Return the expectation values Tr(P rho) of Pauli operators P.
+
+        pauli_strings: a list of Pauli strings, each of which is either a
+        dict {qubit_name: "X", "Y" or "Z"}, where missing qubits are
+        identities, or a string over "IXYZ" with a character for each
+        qubit in self.names.
+
+        The values are read from the Pauli basis tensor of the dense part
+        without constructing the density matrix, and are not normalized:
+        divide by trace() for the expectation values of the normalized
+        state. The state is not changed.
+        """
+        strings = []
+        for pauli_string in pauli_strings:
+            if isinstance(pauli_string, str):
+                if len(pauli_string) != self.no_qubits:
+                    raise ValueError(
+                        "expectation: Pauli string '{}' does not have a "
+                        "character for each of the {} qubits".format(
+                            pauli_string, self.no_qubits))
+                pauli_string = dict(zip(self.names, pauli_string))
+            pauli_string = {bit: p for bit, p in pauli_string.items()
+                            if p != "I"}
+            for bit, p in pauli_string.items():
+                if bit not in self.names:
+                    raise ValueError(
+                        "expectation: Unknown qubit '{}'.".format(bit))
+                if p not in _pauli_weights:
+                    raise ValueError(
+                        "expectation: Pauli operators must be I, X, Y or Z, "
+                        "not '{}'".format(p))
+            strings.append(pauli_string)
 
-            res.append((outcome, probs[idx] * self.classical_probability))
+        for bit in {bit for pauli_string in strings for bit in pauli_string}:
+            self.combine_and_apply_single_ptm(bit)
 
-        return res
+        results = np.empty(len(strings))
+        for n, pauli_string in enumerate(strings):
+            value = self.classical_probability
+            for bit, populations in self.classical_populations.items():
+                if bit not in pauli_string:
+                    value *= populations.sum()
+
+            indices = [[0, 3]] * self.full_dm.no_qubits
+            weights = [np.ones(2)] * self.full_dm.no_qubits
+            for bit, p in pauli_string.items():
+                if bit in self.classical:
+                    value *= _pauli_weights[p][1].dot(
+                        self._classical_pauli_vector(bit)[
+                            _pauli_weights[p][0]])
+                else:
+                    idx = self.idx_in_full_dm[bit]
+                    indices[idx], weights[idx] = _pauli_weights[p]
+
+            elements = self.full_dm.get_pauli_elements(indices)
+            for w in reversed(weights):
+                elements = elements.dot(w)
+            results[n] = value * elements
+        return results
 
     def trace(self):
         """Return the trace of the density matrix, which is the probability for all measurement projections in its history.
         """
-        return self.classical_probability * self.full_dm.trace()
+        trace = self.classical_probability * self.full_dm.trace()
+        for populations in self.classical_populations.values():
+            trace *= populations.sum()
+        return trace
 
     def renormalize(self):
         """Renormalize the density matrix to trace 1.
         """
         self.full_dm.renormalize()
         self.classical_probability = 1
+        for bit, populations in self.classical_populations.items():
+            self.classical_populations[bit] = populations / populations.sum()
 
     def copy(self):
         """Return an identical but distinct copy of this object.
         """
 
-        cp = SparseDM(self.names)
-        cp.single_ptms_to_do = self.single_ptms_to_do
+        cp = SparseDM(self.names, density_class=self.density_class)
+        cp.single_ptms_to_do = self.single_ptms_to_do.copy()
         cp.classical = self.classical.copy()
+        cp.classical_populations = self.classical_populations.copy()
+        cp.classical_probability = self.classical_probability
+        cp.max_bits_in_full_dm = self.max_bits_in_full_dm
         cp.idx_in_full_dm = self.idx_in_full_dm.copy()
         cp.full_dm = self.full_dm.copy()
 
@@ -218,14 +401,42 @@ class SparseDM:
         """Apply all cached single qubit gates that are cached for bit `bit`.
         Should not be necessary to call directly except for testing purposes.
         """
-        if bit in self.single_ptms_to_do:
-            self.ensure_dense(bit)
-            ptm = self.single_ptms_to_do[bit][0]
-            for ptm2 in self.single_ptms_to_do[bit][1:]:
-                ptm = ptm2.dot(ptm)
-            self.full_dm.apply_ptm(self.idx_in_full_dm[bit], ptm)
+        ptm = self.single_ptms_to_do.pop(bit, None)
+        if ptm is None:
+            return
+
+        if bit in self.classical:
+            # a ptm that does not create coherences leaves the bit classical,
+            # possibly as a mixture
+            pauli_vector = ptm.dot(self._classical_pauli_vector(bit))
+            if np.allclose(pauli_vector[1:3], 0, rtol=0, atol=_classical_atol):
+                self._set_classical_populations(
+                    bit, pauli_vector[0], pauli_vector[3])
+                return
 
-            del self.single_ptms_to_do[bit]
+        self.ensure_dense(bit)
+        self.full_dm.apply_ptm(self.idx_in_full_dm[bit], ptm)
+
+    def _classical_pauli_vector(self, bit):
+        """The state of the classical bit `bit` in 0xy1 basis."""
+        if bit in self.classical_populations:
+            p0, p1 = self.classical_populations[bit]
+            return np.array([p0, 0, 0, p1])
+        pauli_vector = np.zeros(4)
+        pauli_vector[3 * self.classical[bit]] = 1
+        return pauli_vector
+
+    def _set_classical_populations(self, bit, p0, p1):
+        """Set the classical bit `bit` to the mixture (p0, p1), or to a
+        definite state if that is what the populations describe."""
+        for state, populations in ((0, (1, 0)), (1, (0, 1))):
+            if np.allclose((p0, p1), populations, rtol=0,
+                           atol=_classical_atol):
+                self.classical[bit] = state
+                self.classical_populations.pop(bit, None)
+                return
+        self.classical[bit] = int(p1 > p0)
+        self.classical_populations[bit] = np.array([p0, p1])
 
     def apply_ptm(self, bit, ptm):
         """Apply the Pauli transfer matrix `ptm` to qubit `bit`.
@@ -237,7 +448,11 @@ class SparseDM:
         This behaviour is essentially transparent to the user, except that this means that often sdm.classical still
         contains the last classical state of the qubit.
         """
-        self.single_ptms_to_do[bit].append(ptm)
+        pending = self.single_ptms_to_do.get(bit)
+        if pending is None:
+            self.single_ptms_to_do[bit] = ptm
+        else:
+            self.single_ptms_to_do[bit] = ptm.dot(pending)
 
     def apply_two_ptm(self, bit0, bit1, two_ptm):
         """Apply a two_bit_ptm between bit0 and bit1.
@@ -245,17 +460,8 @@ class SparseDM:
         self.ensure_dense(bit0)
         self.ensure_dense(bit1)
 
-        ptm0 = np.eye(4)
-        if bit0 in self.single_ptms_to_do:
-            for ptm2 in self.single_ptms_to_do[bit0]:
-                ptm0 = ptm2.dot(ptm0)
-            del self.single_ptms_to_do[bit0]
-
-        ptm1 = np.eye(4)
-        if bit1 in self.single_ptms_to_do:
-            for ptm2 in self.single_ptms_to_do[bit1]:
-                ptm1 = ptm2.dot(ptm1)
-            del self.single_ptms_to_do[bit1]
+        ptm0 = self.single_ptms_to_do.pop(bit0, _identity_ptm)
+        ptm1 = self.single_ptms_to_do.pop(bit1, _identity_ptm)
 
         full_two_ptm = np.dot(two_ptm, np.kron(ptm1, ptm0))
         self.full_dm.apply_two_ptm(self.idx_in_full_dm[bit0],
@@ -317,11 +523,11 @@ class SparseDM:
               return the probabilty for the majority of the measurements coinciding with the given result.
         """
 
-        dense_bits = {b for b in bits if b in self.idx_in_full_dm}
-
         for bit in bits:
             self.combine_and_apply_single_ptm(bit)
 
+        dense_bits = {b for b in bits if b in self.idx_in_full_dm}
+
         bit_result = {}
         for b in bits:
             try:
@@ -334,7 +540,20 @@ class SparseDM:
                 bit_result[b] = 1
 
         classical_bits_sum = sum(self.classical[b] ^ (1 - bit_result[b])
-                                 for b in bits if b in self.classical)
+                                 for b in bits if b in self.classical and
+                                 b not in self.classical_populations)
+
+        # the distribution of the number of classical mixtures giving their
+        # result, which is independent of the dense part
+        mixture_sums = np.ones(1)
+        factor = self.classical_probability
+        for b, populations in self.classical_populations.items():
+            if b in bit_result:
+                mixture_sums = np.convolve(
+                    mixture_sums, populations[[1 - bit_result[b],
+                                               bit_result[b]]])
+            else:
+                factor *= populations.sum()
 
         mask = 0
         result_mask = 0
@@ -342,24 +561,13 @@ class SparseDM:
             mask += 1 << self.idx_in_full_dm[b]
             result_mask |= ((1 - bit_result[b]) << self.idx_in_full_dm[b])
 
-        if 1:  # mask != self._last_majority_vote_mask:
-            adresses = np.arange(2**len(self.idx_in_full_dm)) ^ result_mask
-            majority = np.zeros_like(adresses)
-            for _ in range(len(self.idx_in_full_dm)):
-                majority += adresses & 1
-                adresses >>= 1
-
-            self._last_majority_vote_mask = mask
-            self._last_majority_vote_array = majority
-        else:
-            majority = self._last_majority_vote_array
-
-        majority = (
-            majority +
-            classical_bits_sum > len(bits) /
-            2).astype(
-            np.int)
+        majority = _popcounts(self.full_dm.no_qubits, mask, result_mask)
+        self._last_majority_vote_mask = mask
+        self._last_majority_vote_array = majority
 
         diag = self.full_dm.get_diag()
 
-        return np.dot(majority, diag) * self.classical_probability
+        return factor * sum(
+            p * np.dot(majority + classical_bits_sum + k > len(bits) / 2,
+                       diag)
+            for k, p in enumerate(mixture_sums))
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import quantumsim.backends as backends
+import quantumsim.dm_np as dm_np
+import quantumsim.sparsedm as sparsedm
+from quantumsim.sparsedm import SparseDM
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(backends, "_loaders", dict(backends._loaders))
+    monkeypatch.setattr(backends, "_loaded", {})
+    monkeypatch.setattr(backends, "_default_name", None)
+    monkeypatch.delenv(backends.ENVIRONMENT_VARIABLE, raising=False)
+
+
+class TestRegistry:
+
+    def test_numpy_is_available(self, registry):
+        assert "numpy" in backends.available()
+        assert backends.get("numpy") is dm_np.DensityNP
+
+    def test_threaded_numpy(self, registry):
+        dm = backends.get("numpy-threaded")(3)
+        assert isinstance(dm, dm_np.DensityNP)
+        assert dm.num_threads >= 1
+
+    def test_unknown_backend(self, registry):
+        with pytest.raises(ValueError):
+            backends.get("abacus")
+
+    def test_loaded_lazily(self, registry):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return dm_np.DensityNP
+
+        backends.register("lazy", loader)
+        assert calls == []
+        backends.get("lazy")
+        backends.get("lazy")
+        assert calls == [1]
+
+    def test_unavailable_backend(self, registry):
+        def loader():
+            raise ImportError("no such hardware")
+
+        backends.register("broken", loader)
+        assert "broken" not in backends.available()
+        with pytest.raises(ImportError):
+            backends.get("broken")
+
+    def test_default_falls_back_to_numpy(self, registry):
+        def loader():
+            raise ImportError("no gpu")
+
+        backends.register("cuda", loader)
+        assert backends.default_name() == "numpy"
+        assert sparsedm.default_density_class is dm_np.DensityNP
+        assert not sparsedm.using_gpu
+
+    def test_environment_variable(self, registry, monkeypatch):
+        monkeypatch.setenv(backends.ENVIRONMENT_VARIABLE, "numpy-threaded")
+        assert backends.default_name() == "numpy-threaded"
+        sdm = SparseDM(2)
+        assert sdm.full_dm.num_threads >= 1
+
+
+class TestSparseDMBackend:
+
+    def test_select_by_name(self):
+        sdm = SparseDM(3, backend="numpy")
+        assert isinstance(sdm.full_dm, dm_np.DensityNP)
+
+    def test_name_and_class_conflict(self):
+        with pytest.raises(ValueError):
+            SparseDM(3, density_class=dm_np.DensityNP, backend="numpy")
+
+    def test_copy_keeps_backend(self):
+        sdm = SparseDM(3, backend="numpy-threaded")
+        sdm.hadamard(0)
+        cp = sdm.copy()
+        assert cp.density_class is sdm.density_class
+        assert np.allclose(cp.full_dm.to_array(), sdm.full_dm.to_array())
@@ -1,5 +1,7 @@
 import quantumsim.circuit as circuit
 import quantumsim.ptm as ptm
+import quantumsim.sparsedm as sparsedm
+import quantumsim.dm_np as dm_np
 from unittest.mock import MagicMock, patch, call, ANY
 import numpy as np
 import pytest
@@ -91,6 +93,116 @@ class TestCircuit:
 
         c.order()
 
+    def test_order_min_width(self):
+        c = circuit.Circuit()
+        for qb in "ABCD":
+            c.add_qubit(qb)
+        sampler = circuit.selection_sampler(0)
+        c.add_cphase("A", "B", time=0)
+        c.add_cphase("C", "D", time=0)
+        c.add_measurement("A", time=1, sampler=sampler)
+        c.add_measurement("B", time=1, sampler=sampler)
+        c.add_measurement("C", time=1, sampler=sampler)
+        c.add_measurement("D", time=1, sampler=sampler)
+
+        c.order()
+        default = c.dense_width()
+        c.order(strategy="min_width")
+        width = c.dense_width()
+
+        assert width.peak == 2
+        assert width.peak <= default.peak
+        assert width.integrated <= default.integrated
+        # one pair is entangled and measured before the other one
+        pair = set(c.gates[0].involved_qubits)
+        assert {c.gates[1].involved_qubits[0],
+                c.gates[2].involved_qubits[0]} == pair
+
+        sdm = sparsedm.SparseDM(c.get_qubit_names())
+        c.apply_to(sdm)
+        assert sdm.max_bits_in_full_dm == width.peak
+
+    def test_order_unknown_strategy(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        with pytest.raises(ValueError):
+            c.order(strategy="fastest")
+
+    def test_dense_width(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        c.add_qubit("B")
+        c.add_hadamard("A", time=0)
+        c.add_cphase("A", "B", time=1)
+        c.add_hadamard("B", time=2)
+        c.order()
+        assert c.dense_width() == (2, 4)
+        assert c.dense_width().peak == 2
+
+    def test_estimate_cost(self):
+        calls = []
+
+        class CountingDensity(dm_np.DensityNP):
+            def apply_ptm(self, *args):
+                calls.append(self.no_qubits)
+                super().apply_ptm(*args)
+
+            def apply_two_ptm(self, *args):
+                calls.append(self.no_qubits)
+                super().apply_two_ptm(*args)
+
+            def add_ancilla(self, *args):
+                calls.append(self.no_qubits + 1)
+                super().add_ancilla(*args)
+
+            def project_measurement(self, *args):
+                calls.append(self.no_qubits)
+                super().project_measurement(*args)
+
+        c = circuit.Circuit()
+        for qb in "ABC":
+            c.add_qubit(qb)
+        sampler = circuit.selection_sampler(0)
+        c.add_hadamard("A", time=0)
+        c.add_cphase("A", "B", time=1)
+        c.add_cphase("B", "C", time=2)
+        c.add_measurement("A", time=3, sampler=sampler)
+        c.add_hadamard("C", time=4)
+        c.add_rotate_y("A", time=4, angle=np.pi / 2)
+        c.order()
+
+        cost = c.estimate_cost()
+        sdm = sparsedm.SparseDM(c.get_qubit_names(),
+                                density_class=CountingDensity)
+        c.apply_to(sdm)
+
+        assert cost.sweeps == len(calls)
+        assert cost.peak_qubits == max(calls) == sdm.max_bits_in_full_dm
+        assert cost.peak_bytes == 8 * 4**3
+        assert len(cost.gate_bytes) == len(c.gates)
+        assert cost.bytes > sum(cost.gate_bytes) > 0
+        assert cost.flops > 0
+        assert cost.mean_qubits == c.dense_width().integrated / len(c.gates)
+
+        # the last gates are applied at the end, the rotation makes the
+        # measured qubit A dense again
+        no_pending = c.estimate_cost(apply_all_pending=False)
+        assert no_pending.sweeps == cost.sweeps - 3
+        assert no_pending.bytes == sum(no_pending.gate_bytes)
+
+    def test_estimate_cost_initial_dense(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        c.add_qubit("B")
+        c.add_cphase("A", "B", time=0)
+
+        assert c.estimate_cost().sweeps == 3
+        cost = c.estimate_cost(initial_dense=["A", "B", "C"])
+        assert cost.sweeps == 1
+        assert cost.peak_qubits == 3
+        assert cost.flops == 32 * 4**3
+        assert cost.gate_bytes == [16 * 4**3]
+
     def test_add_waiting_full(self):
         c = circuit.Circuit()
 
@@ -111,6 +223,40 @@ class TestCircuit:
         assert c.gates[1].time == 0.5
         assert c.gates[1].duration == 1.0
 
+    def test_gates_by_qubit(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        c.add_qubit("B")
+        h1 = c.add_hadamard("A", time=2)
+        cp = c.add_cphase("A", "B", time=1)
+        assert c.gates_by_qubit() == {"A": [cp, h1], "B": [cp]}
+
+        # new gates are indexed incrementally
+        h2 = c.add_hadamard("B", time=0)
+        assert c.gates_by_qubit()["B"] == [h2, cp]
+
+        # the index follows changed gate times and a replaced gate list
+        h2.time = 3
+        c.gates = [h1, h2]
+        assert c.gates_by_qubit() == {"A": [h1], "B": [h2]}
+
+        # an item assignment, and a removal followed by an append, that
+        # keep the length of the list
+        h3 = circuit.Hadamard("A", time=4)
+        c.gates[1] = h3
+        assert c.gates_by_qubit() == {"A": [h1, h3]}
+        c.gates.remove(h1)
+        c.gates.append(h2)
+        assert c.gates_by_qubit() == {"A": [h3], "B": [h2]}
+
+    def test_gates_by_qubit_conditional(self):
+        c = circuit.Circuit()
+        g = c.add_gate(circuit.ConditionalGate(
+            time=1, control_bit="O",
+            zero_gates=[circuit.Hadamard("A", 0)],
+            one_gates=[circuit.Hadamard("A", 0), circuit.RotateX("B", 0, 1)]))
+        assert c.gates_by_qubit() == {"O": [g], "A": [g], "B": [g]}
+
     def test_add_waiting_empty(self):
         c = circuit.Circuit()
 
@@ -353,6 +499,22 @@ class TestRotateYGate:
         assert np.allclose(g.ptm, g2.ptm)
         assert np.allclose(g3.ptm, ptm.dephasing_ptm(1, 0, 1))
 
+    def test_shares_cached_ptm(self):
+        ptm.ptm_cache.clear()
+        g1 = circuit.RotateY("A", angle=0.3, time=0)
+        g2 = circuit.RotateY("B", angle=0.3, time=5)
+        assert g1.ptm is g2.ptm
+        assert ptm.ptm_cache.info().hits == 1
+        assert np.allclose(g1.ptm, ptm.rotate_y_ptm(0.3))
+
+    def test_adjust_matches_init(self):
+        g = circuit.RotateX("A", angle=0.1, time=0, dephasing_angle=0.2,
+                            dephasing_axis=0.3)
+        g.adjust(0.7)
+        g2 = circuit.RotateX("A", angle=0.7, time=0, dephasing_angle=0.2,
+                             dephasing_axis=0.3)
+        assert np.allclose(g.ptm, g2.ptm)
+
 
 class TestCPhaseGate:
 
@@ -392,6 +554,15 @@ class TestAmpPhDamping:
 
         sdm.apply_ptm.assert_called_once_with("A", ptm=ANY)
 
+    def test_shares_cached_ptm(self):
+        ptm.ptm_cache.clear()
+        apd1 = circuit.AmpPhDamp("A", 0, 1, 10, 5)
+        apd2 = circuit.AmpPhDamp("B", 3, 1, 10, 5)
+        apd3 = circuit.AmpPhDamp("B", 3, 2, 10, 5)
+        assert apd1.ptm is apd2.ptm
+        assert apd1.ptm is not apd3.ptm
+        assert ptm.ptm_cache.info().misses == 2
+
 
 class TestMeasurement:
 
@@ -631,3 +802,131 @@ class TestSamplers:
             dec, proj, prob = s.send((0.9, 0.1))
             assert (proj, dec, prob) == (0, 1, 0.7)
         assert s.p_twiddle < 1 and s.p_twiddle > 0
+
+
+class TestCompiledCircuit:
+
+    def make_circuit(self):
+        c = circuit.Circuit("compile")
+        for qb in ["D1", "A", "D2"]:
+            c.add_qubit(qb, 3000, 2000)
+        c.add_qubit("M")
+
+        c.add_rotate_y("A", time=0, angle=np.pi / 2)
+        c.add_rotate_x("D1", time=0, angle=0.3)
+        c.add_cphase("A", "D1", time=100)
+        c.add_rotate_y("D1", time=150, angle=0.2)
+        c.add_gate(circuit.CNOT("D2", "A", time=200))
+        c.add_rotate_y("A", time=300, angle=-np.pi / 2)
+        c.add_gate(circuit.Measurement("A", time=400, output_bit="M",
+                                       sampler=circuit.selection_sampler(1)))
+        c.add_gate(circuit.ConditionalGate(
+            time=450, control_bit="M",
+            one_gates=[circuit.RotateX("D2", time=450, angle=np.pi)]))
+        c.add_waiting_gates()
+        c.order()
+        return c
+
+    def test_same_result_as_circuit(self):
+        from quantumsim.sparsedm import SparseDM
+
+        c = self.make_circuit()
+        compiled = c.compile()
+        assert len(compiled) < len(c.gates)
+
+        sdm1 = SparseDM(c.get_qubit_names())
+        sdm2 = SparseDM(c.get_qubit_names())
+        for _ in range(2):
+            c.apply_to(sdm1)
+            compiled.apply_to(sdm2)
+
+        assert sdm1.classical == sdm2.classical
+        assert np.allclose(sdm1.trace(), sdm2.trace())
+        assert np.allclose(sdm1.full_dm.to_array(), sdm2.full_dm.to_array())
+
+    def test_instructions_are_immutable(self):
+        compiled = self.make_circuit().compile()
+        assert isinstance(compiled.instructions, tuple)
+        for opcode, _, _, matrix in compiled.instructions:
+            if opcode != circuit.CompiledCircuit.GATE:
+                assert not matrix.flags.writeable
+
+    def test_single_ptms_fused_into_two_ptm(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        c.add_qubit("B")
+        c.add_hadamard("A", time=0)
+        c.add_rotate_x("B", time=0, angle=0.4)
+        c.add_cphase("A", "B", time=10)
+        c.add_hadamard("A", time=20)
+
+        compiled = c.compile()
+        opcodes = [i[0] for i in compiled.instructions]
+        assert opcodes == [circuit.CompiledCircuit.TWO_PTM,
+                           circuit.CompiledCircuit.PTM]
+
+
+class TestFuseTwoQubitBlocks:
+
+    def make_circuit(self):
+        c = circuit.Circuit("fuse")
+        for qb in ["A", "B", "C"]:
+            c.add_qubit(qb, 3000, 2000)
+        c.add_rotate_y("A", time=0, angle=np.pi / 2)
+        c.add_gate(circuit.CNOT("A", "B", time=10))
+        c.add_rotate_x("B", time=20, angle=0.3)
+        c.add_rotate_y("C", time=20, angle=0.7)
+        c.add_gate(circuit.CPhaseRotation("B", "A", angle=0.4, time=30))
+        c.add_cphase("A", "B", time=40)
+        c.add_rotate_x("A", time=50, angle=0.1)
+        c.add_cphase("A", "C", time=60)
+        c.add_gate(circuit.ISwap("C", "A", time=70))
+        c.add_gate(circuit.Measurement("C", time=80,
+                                       sampler=circuit.selection_sampler(0)))
+        c.add_gate(circuit.ISwap("C", "A", time=90))
+        c.order()
+        return c
+
+    def test_same_state(self):
+        from quantumsim.sparsedm import SparseDM
+
+        c = self.make_circuit()
+        sdm1 = SparseDM(c.get_qubit_names())
+        c.apply_to(sdm1)
+
+        c = self.make_circuit()
+        no_gates = len(c.gates)
+        assert c.fuse_two_qubit_blocks() == 3
+        assert len(c.gates) == no_gates - 4
+        sdm2 = SparseDM(c.get_qubit_names())
+        c.apply_to(sdm2)
+
+        assert np.allclose(sdm1.trace(), sdm2.trace())
+        probs1 = {tuple(sorted(o.items())): p for o, p in
+                  sdm1.peak_multiple_measurements(["A", "B", "C"])}
+        probs2 = {tuple(sorted(o.items())): p for o, p in
+                  sdm2.peak_multiple_measurements(["A", "B", "C"])}
+        assert probs1.keys() == probs2.keys()
+        for outcome in probs1:
+            assert np.isclose(probs1[outcome], probs2[outcome])
+        assert np.allclose(sdm1.full_dm.to_array(), sdm2.full_dm.to_array())
+
+    def test_fused_gates_kept(self):
+        c = self.make_circuit()
+        c.fuse_two_qubit_blocks()
+        fused = [g for g in c.gates if hasattr(g, "fused_gates")]
+        assert [len(g.fused_gates) for g in fused] == [4, 2]
+        assert fused[0].involved_qubits == ["A", "B"]
+
+    def test_nothing_to_fuse(self):
+        c = circuit.Circuit()
+        c.add_qubit("A")
+        c.add_qubit("B")
+        c.add_cphase("A", "B", time=0)
+        c.add_gate(circuit.Measurement("A", time=10,
+                                       sampler=circuit.selection_sampler(0)))
+        c.add_cphase("A", "B", time=20)
+        c.order()
+        gates = list(c.gates)
+        assert c.fuse_two_qubit_blocks() == 0
+        assert c.gates == gates
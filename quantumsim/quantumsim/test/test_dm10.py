@@ -1,36 +1,32 @@
 import numpy as np
 import pytest
 
-import quantumsim.dm_np as dm_np
+import quantumsim.backends as backends
 
-# There are two implementations for the backend (on CPU and on GPU)
-# here we collect the classes we want to test
+# This is the conformance suite for density matrix backends: every backend
+# in the registry that can be loaded on this machine has to pass it.
 
-implementations_to_test = []
-implementations_to_test.append(dm_np.DensityNP)
+backends_to_test = backends.available()
+implementations_to_test = [backends.get(name) for name in backends_to_test]
 
-hascuda = False
-try:
+hascuda = "cuda" in backends_to_test
+if hascuda:
     import pycuda.gpuarray as ga
     import quantumsim.dm10 as dm10
-    implementations_to_test.append(dm10.Density)
-    hascuda = True
-except ImportError:
-    pass
 # We automatically only test the backends available by using the fixtures here
 
 
-@pytest.fixture(params=implementations_to_test)
+@pytest.fixture(params=implementations_to_test, ids=backends_to_test)
 def dm(request):
     return request.param(5)
 
 
-@pytest.fixture(params=implementations_to_test)
+@pytest.fixture(params=implementations_to_test, ids=backends_to_test)
 def dmclass(request):
     return request.param
 
 
-@pytest.fixture(params=implementations_to_test)
+@pytest.fixture(params=implementations_to_test, ids=backends_to_test)
 def dm_random(request):
     n = 5
     a = np.random.random((2**n, 2**n)) * 1j
@@ -41,7 +37,7 @@ def dm_random(request):
     dm = request.param(n, a)
     return dm
 
-@pytest.fixture(params=implementations_to_test)
+@pytest.fixture(params=implementations_to_test, ids=backends_to_test)
 def dm_random_small(request):
     n = 2
     a = np.random.random((2**n, 2**n)) * 1j
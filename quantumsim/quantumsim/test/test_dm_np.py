@@ -0,0 +1,247 @@
+import numpy as np
+import pytest
+
+import quantumsim.dm_np as dm_np
+import quantumsim.ptm as ptm
+
+
+def random_dm(n, rng):
+    a = rng.random_sample((2**n, 2**n)) * 1j
+    a += rng.random_sample((2**n, 2**n))
+    a += a.transpose().conj()
+    return a / np.trace(a)
+
+
+@pytest.fixture
+def batch():
+    rng = np.random.RandomState(42)
+    n = 4
+    arrays = np.array([random_dm(n, rng) for _ in range(3)])
+    bdm = dm_np.BatchedDensityNP(n, 3, arrays)
+    singles = [dm_np.DensityNP(n, a) for a in arrays]
+    return bdm, singles
+
+
+def assert_batch_equal(bdm, singles):
+    assert bdm.no_qubits == singles[0].no_qubits
+    assert np.allclose(bdm.to_array(), [s.to_array() for s in singles])
+
+
+class TestBatchedDensityNP:
+
+    def test_ground_state(self):
+        bdm = dm_np.BatchedDensityNP(3, batch_size=5)
+        diag = np.zeros((5, 8))
+        diag[:, 0] = 1
+        assert np.allclose(bdm.get_diag(), diag)
+        assert np.allclose(bdm.trace(), 1)
+
+    def test_dont_make_huge_matrix(self):
+        with pytest.raises(ValueError):
+            dm_np.BatchedDensityNP(200)
+
+    def test_broadcast_data(self):
+        a = random_dm(3, np.random.RandomState(1))
+        bdm = dm_np.BatchedDensityNP(3, 4, a)
+        assert np.allclose(bdm.to_array(), [a] * 4)
+
+    def test_apply_ptm(self, batch):
+        bdm, singles = batch
+        p = ptm.rotate_x_ptm(0.3).dot(ptm.hadamard_ptm())
+        bdm.apply_ptm(2, p)
+        for s in singles:
+            s.apply_ptm(2, p)
+        assert_batch_equal(bdm, singles)
+
+    def test_apply_ptm_per_element(self, batch):
+        bdm, singles = batch
+        ptms = [ptm.rotate_y_ptm(angle) for angle in (0.1, 0.5, 2.)]
+        bdm.apply_ptm(0, np.array(ptms))
+        for s, p in zip(singles, ptms):
+            s.apply_ptm(0, p)
+        assert_batch_equal(bdm, singles)
+
+    @pytest.mark.parametrize("bit0,bit1", [(0, 1), (3, 1), (2, 0), (1, 3)])
+    def test_apply_two_ptm(self, batch, bit0, bit1):
+        bdm, singles = batch
+        p = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])).dot(
+            np.kron(ptm.rotate_x_ptm(0.3), ptm.hadamard_ptm()))
+        bdm.apply_two_ptm(bit0, bit1, p)
+        for s in singles:
+            s.apply_two_ptm(bit0, bit1, p)
+        assert_batch_equal(bdm, singles)
+
+    def test_partial_trace(self, batch):
+        bdm, singles = batch
+        p0, p1 = bdm.partial_trace(1)
+        assert np.allclose(p0, [s.partial_trace(1)[0] for s in singles])
+        assert np.allclose(p1, [s.partial_trace(1)[1] for s in singles])
+
+    def test_add_ancilla_per_element(self, batch):
+        bdm, singles = batch
+        states = [0, 1, 0]
+        bdm.add_ancilla(states)
+        for s, st in zip(singles, states):
+            s.add_ancilla(st)
+        assert_batch_equal(bdm, singles)
+
+    @pytest.mark.parametrize("bit", [0, 2, 3])
+    def test_project_measurement_per_element(self, batch, bit):
+        bdm, singles = batch
+        states = [0, 1, 1]
+        bdm.project_measurement(bit, states)
+        for s, st in zip(singles, states):
+            s.project_measurement(bit, st)
+        assert_batch_equal(bdm, singles)
+        assert np.allclose(bdm.trace(), [s.trace() for s in singles])
+
+    def test_renormalize(self, batch):
+        bdm, _ = batch
+        bdm.project_measurement(0, [0, 1, 0])
+        bdm.renormalize()
+        assert np.allclose(bdm.trace(), 1)
+
+    def test_copy(self, batch):
+        bdm, _ = batch
+        cp = bdm.copy()
+        cp.apply_ptm(0, ptm.hadamard_ptm())
+        assert not np.allclose(cp.to_array(), bdm.to_array())
+
+
+class TestDensityNPKernels:
+
+    @pytest.mark.parametrize("bit", range(5))
+    def test_apply_ptm_matches_einsum(self, bit):
+        n = 5
+        dm = dm_np.DensityNP(n, random_dm(n, np.random.RandomState(bit)))
+        p = ptm.rotate_x_ptm(0.3).dot(ptm.amp_ph_damping_ptm(0.1, 0.2))
+        in_indices = list(reversed(range(n)))
+        in_indices[n - bit - 1] = n
+        expected = np.einsum(dm.dm, in_indices, p, [bit, n],
+                             list(reversed(range(n))))
+        dm.apply_ptm(bit, p)
+        assert dm.dm.shape == (4,) * n
+        assert np.allclose(dm.dm, expected)
+
+    @pytest.mark.parametrize("bit0,bit1",
+                             [(b0, b1) for b0 in range(4)
+                              for b1 in range(4) if b0 != b1])
+    def test_apply_two_ptm_matches_einsum(self, bit0, bit1):
+        n = 4
+        dm = dm_np.DensityNP(n, random_dm(n, np.random.RandomState(7)))
+        p = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])).dot(
+            np.kron(ptm.rotate_x_ptm(0.3), ptm.hadamard_ptm()))
+        in_indices = list(reversed(range(n)))
+        in_indices[n - bit0 - 1] = n
+        in_indices[n - bit1 - 1] = n + 1
+        expected = np.einsum(dm.dm, in_indices, p.reshape((4, 4, 4, 4)),
+                             [bit1, bit0, n + 1, n],
+                             list(reversed(range(n))))
+        dm.apply_two_ptm(bit0, bit1, p)
+        assert np.allclose(dm.dm, expected)
+
+    def test_get_pauli_elements(self):
+        dm = dm_np.DensityNP(3, random_dm(3, np.random.RandomState(2)))
+        indices = [[0, 3], [1], [2, 0, 1]]
+        elements = dm.get_pauli_elements(indices)
+        assert elements.shape == (2, 1, 3)
+        for i0, p0 in enumerate(indices[0]):
+            for i2, p2 in enumerate(indices[2]):
+                assert elements[i0, 0, i2] == dm.dm[p2, 1, p0]
+
+    def test_plans_are_cached(self):
+        dm_np._plan.cache_clear()
+        dm = dm_np.DensityNP(3)
+        for _ in range(3):
+            dm.apply_ptm(1, ptm.hadamard_ptm())
+            dm.get_diag()
+        info = dm_np._plan.cache_info()
+        assert info.misses == 2
+        assert info.hits == 4
+
+
+class TestDensityNPBuffers:
+
+    def test_gates_reuse_buffers(self):
+        dm = dm_np.DensityNP(4, random_dm(4, np.random.RandomState(3)))
+        buffers = [id(b) for b in dm._buffers]
+        dm.apply_ptm(0, ptm.hadamard_ptm())
+        dm.apply_two_ptm(0, 3, ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])))
+        dm.apply_two_ptm(2, 1, ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])))
+        assert [id(b) for b in dm._buffers] == buffers
+
+    @pytest.mark.parametrize("bit,state", [(0, 0), (1, 1), (3, 0), (3, 1)])
+    def test_measure_and_reset_reuses_capacity(self, bit, state):
+        dm = dm_np.DensityNP(4, random_dm(4, np.random.RandomState(5)))
+        buffers = [id(b) for b in dm._buffers]
+        p = dm.partial_trace(bit)[state]
+        dm.project_measurement(bit, state)
+        assert np.isclose(dm.trace(), p)
+
+        fresh = dm_np.DensityNP(3, dm.to_array())
+        assert fresh.allocated_qubits == 3
+        fresh.add_ancilla(1 - state)
+        dm.add_ancilla(1 - state)
+        assert dm.allocated_qubits == 4
+        assert [id(b) for b in dm._buffers] == buffers
+        assert np.allclose(dm.to_array(), fresh.to_array())
+
+    def test_add_ancilla_grows_buffers(self):
+        dm = dm_np.DensityNP(2)
+        dm.add_ancilla(1)
+        assert dm.allocated_qubits == 3
+        diag = np.zeros(8)
+        diag[4] = 1
+        assert np.allclose(dm.get_diag(), diag)
+
+    def test_set_dm(self):
+        dm = dm_np.DensityNP(2)
+        dm.dm = np.arange(16.)
+        assert np.allclose(dm.dm, np.arange(16).reshape(4, 4))
+
+    def test_dm_is_snapshot(self):
+        dm = dm_np.DensityNP(2)
+        snapshot = dm.dm
+        expected = snapshot.copy()
+        dm.hadamard(0)
+        dm.hadamard(1)
+        dm.rotate_x(0, 0.3)
+        assert np.array_equal(snapshot, expected)
+        assert not np.allclose(dm.dm, expected)
+
+
+class TestDensityNPThreads:
+
+    @pytest.fixture
+    def dms(self):
+        n = dm_np._PARALLEL_MIN_QUBITS
+        a = random_dm(n, np.random.RandomState(11))
+        return dm_np.DensityNP(n, a), dm_np.DensityNP(n, a, num_threads=3)
+
+    @pytest.mark.parametrize("bit", [0, 1, 4, 7])
+    def test_apply_ptm(self, dms, bit):
+        serial, threaded = dms
+        p = ptm.rotate_y_ptm(0.7).dot(ptm.amp_ph_damping_ptm(0.1, 0.2))
+        serial.apply_ptm(bit, p)
+        threaded.apply_ptm(bit, p)
+        assert np.allclose(serial.dm, threaded.dm)
+
+    @pytest.mark.parametrize("bit0,bit1",
+                             [(0, 1), (6, 7), (0, 7), (5, 2), (1, 3)])
+    def test_apply_two_ptm(self, dms, bit0, bit1):
+        serial, threaded = dms
+        p = ptm.double_kraus_to_ptm(np.diag([1, 1, 1, -1])).dot(
+            np.kron(ptm.rotate_x_ptm(0.3), ptm.hadamard_ptm()))
+        serial.apply_two_ptm(bit0, bit1, p)
+        threaded.apply_two_ptm(bit0, bit1, p)
+        assert np.allclose(serial.dm, threaded.dm)
+
+    def test_diag_and_trace(self, dms):
+        serial, threaded = dms
+        assert np.allclose(serial.get_diag(), threaded.get_diag())
+        assert np.isclose(serial.trace(), threaded.trace())
+        assert np.allclose(serial.partial_trace(3), threaded.partial_trace(3))
+
+    def test_copy_keeps_threads(self, dms):
+        _, threaded = dms
+        assert threaded.copy().num_threads == 3
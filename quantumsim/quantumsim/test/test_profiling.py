@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+
+import quantumsim.circuit as circuit
+import quantumsim.profiling as profiling
+from quantumsim.sparsedm import SparseDM
+
+
+@pytest.fixture
+def c():
+    c = circuit.Circuit()
+    for qb in "ABC":
+        c.add_qubit(qb, t1=10, t2=5)
+    c.add_hadamard("A", time=0)
+    c.add_cphase("A", "B", time=1)
+    c.add_cphase("B", "C", time=2)
+    c.add_measurement("A", time=3, sampler=circuit.selection_sampler(0))
+    c.add_waiting_gates()
+    c.order()
+    return c
+
+
+class TestProfiler:
+
+    def test_inactive_by_default(self):
+        assert profiling.active() is None
+        with profiling.Profiler() as prof:
+            assert profiling.active() is prof
+        assert profiling.active() is None
+
+    def test_records_gates(self, c):
+        sdm = SparseDM(c.get_qubit_names())
+        with profiling.Profiler() as prof:
+            c.apply_to(sdm)
+
+        names = [record.name for record in prof.records]
+        assert names == [type(g).__name__ for g in c.gates] + \
+            ["apply_all_pending"]
+        assert all(record.duration >= 0 for record in prof.records)
+        assert all(record.allocated is not None for record in prof.records)
+
+        cphase = [r for r in prof.records if r.name == "CPhase"]
+        assert [r.dense_qubits for r in cphase] == [2, 3]
+        assert [call.name for call in cphase[0].calls] == \
+            ["add_ancilla", "add_ancilla", "apply_two_ptm"]
+        assert "project_measurement" in [
+            call.name for r in prof.records for call in r.calls]
+
+        # the backend is restored, and the result is not changed
+        assert sdm.full_dm.__class__ is not profiling._BackendProxy
+        sdm2 = SparseDM(c.get_qubit_names())
+        c.apply_to(sdm2)
+        assert np.allclose(sdm.full_dm.to_array(), sdm2.full_dm.to_array())
+        assert sdm.classical == sdm2.classical
+
+    def test_without_reset_peak(self, c, monkeypatch):
+        # Python < 3.9
+        monkeypatch.delattr(profiling.tracemalloc, "reset_peak")
+        with profiling.Profiler() as prof:
+            c.apply_to(SparseDM(c.get_qubit_names()))
+        assert all(record.allocated is not None for record in prof.records)
+
+    def test_compiled_circuit(self, c):
+        program = c.compile()
+        sdm = SparseDM(c.get_qubit_names())
+        records = []
+        with profiling.Profiler(trace_memory=False,
+                                callback=records.append) as prof:
+            program.apply_to(sdm)
+
+        assert records == prof.records
+        assert len(records) == len(program) + 1
+        assert {r.name for r in records} <= \
+            {"PTM", "TWO_PTM", "Measurement", "apply_all_pending"}
+        assert all(r.allocated is None for r in records)
+
+    def test_summary_and_table(self, c):
+        with profiling.Profiler() as prof:
+            c.apply_to(SparseDM(c.get_qubit_names()))
+
+        summary = prof.summary()
+        assert summary["CPhase"]["count"] == 2
+        assert summary["CPhase"]["calls"] == {"add_ancilla": 3,
+                                              "apply_two_ptm": 2}
+        assert summary["CPhase"]["dense_qubits"] == 3
+        table = prof.table()
+        assert "CPhase" in table
+        assert len(table.splitlines()) == len(summary) + 1
+
+        prof.clear()
+        assert prof.records == []
+
+    def test_chrome_trace(self, c, tmp_path):
+        with profiling.Profiler() as prof:
+            c.apply_to(SparseDM(c.get_qubit_names()))
+
+        filename = str(tmp_path / "trace.json")
+        prof.save_chrome_trace(filename)
+        with open(filename) as f:
+            trace = json.load(f)
+        events = trace["traceEvents"]
+        assert len(events) == len(prof.records) + sum(
+            len(r.calls) for r in prof.records)
+        assert all(e["ph"] == "X" for e in events)
+        assert {e["cat"] for e in events} == {"gate", "backend"}
@@ -1,4 +1,5 @@
 import quantumsim.ptm as ptm
+import pytest
 import numpy as np
 
 
@@ -147,3 +148,85 @@ class TestKrausToPTM:
         ptm_b = ptm.double_kraus_to_ptm(b)
         ptm_ab = ptm.double_kraus_to_ptm(np.matmul(a, b))
         assert np.allclose(ptm_ab, np.matmul(ptm_a, ptm_b))
+
+
+class TestKrausesToPTM:
+    def test_summed_single(self):
+        krauses = np.random.random((3, 2, 2)) + 1j*np.random.random((3, 2, 2))
+        expected = sum(ptm.single_kraus_to_ptm(k) for k in krauses)
+        assert np.allclose(ptm.single_krauses_to_ptm(krauses), expected)
+
+    def test_summed_double(self):
+        krauses = np.random.random((3, 4, 4)) + 1j*np.random.random((3, 4, 4))
+        expected = sum(ptm.double_kraus_to_ptm(k) for k in krauses)
+        assert np.allclose(ptm.double_krauses_to_ptm(krauses), expected)
+
+    def test_unitary_is_identity(self):
+        assert np.allclose(ptm.single_krauses_to_ptm([np.eye(2)]), np.eye(4))
+        assert np.allclose(ptm.double_krauses_to_ptm([np.eye(4)]), np.eye(16))
+
+    def test_not_summed(self):
+        krauses = np.random.random((5, 2, 2))
+        ptms = ptm.single_krauses_to_ptm(krauses, summed=False)
+        assert ptms.shape == (5, 4, 4)
+        for k, p in zip(krauses, ptms):
+            assert np.allclose(p, ptm.single_kraus_to_ptm(k))
+
+    def test_stack_of_channels(self):
+        channels = np.random.random((2, 3, 3, 2, 2))
+        ptms = ptm.single_krauses_to_ptm(channels)
+        assert ptms.shape == (2, 3, 4, 4)
+        assert np.allclose(ptms[1, 2], ptm.single_krauses_to_ptm(channels[1, 2]))
+
+    def test_amplitude_damping(self):
+        gamma = 0.3
+        krauses = [np.array([[1, 0], [0, np.sqrt(1 - gamma)]]),
+                   np.array([[0, np.sqrt(gamma)], [0, 0]])]
+        assert np.allclose(ptm.single_krauses_to_ptm(krauses),
+                           ptm.amp_ph_damping_ptm(gamma, 0))
+
+
+class TestPTMCache:
+    def test_hits_and_misses(self):
+        cache = ptm.PTMCache()
+        p1 = cache.get("rx", (0.5,), ptm.rotate_x_ptm)
+        p2 = cache.get("rx", (0.5,), ptm.rotate_x_ptm)
+        assert p1 is p2
+        assert np.allclose(p1, ptm.rotate_x_ptm(0.5))
+        assert cache.info() == ptm.CacheInfo(1, 1, 4096, 1)
+
+    def test_quantized_parameters(self):
+        cache = ptm.PTMCache(decimals=8)
+        p1 = cache.get("rx", (0.1 + 0.2,), ptm.rotate_x_ptm)
+        p2 = cache.get("rx", (0.3,), ptm.rotate_x_ptm)
+        assert p1 is p2
+
+    def test_name_is_part_of_key(self):
+        cache = ptm.PTMCache()
+        px = cache.get("rx", (0.5,), ptm.rotate_x_ptm)
+        py = cache.get("ry", (0.5,), ptm.rotate_y_ptm)
+        assert not np.allclose(px, py)
+
+    def test_read_only(self):
+        cache = ptm.PTMCache()
+        p = cache.get("rx", (0.5,), ptm.rotate_x_ptm)
+        with pytest.raises(ValueError):
+            p[0, 0] = 2
+
+    def test_evicts_least_recently_used(self):
+        cache = ptm.PTMCache(maxsize=2)
+        cache.get("rx", (0.1,), ptm.rotate_x_ptm)
+        cache.get("rx", (0.2,), ptm.rotate_x_ptm)
+        cache.get("rx", (0.1,), ptm.rotate_x_ptm)
+        cache.get("rx", (0.3,), ptm.rotate_x_ptm)
+        assert cache.info().currsize == 2
+        cache.get("rx", (0.1,), ptm.rotate_x_ptm)
+        assert cache.info().misses == 3
+        cache.get("rx", (0.2,), ptm.rotate_x_ptm)
+        assert cache.info().misses == 4
+
+    def test_clear(self):
+        cache = ptm.PTMCache()
+        cache.get("rx", (0.1,), ptm.rotate_x_ptm)
+        cache.clear()
+        assert cache.info() == ptm.CacheInfo(0, 0, 4096, 0)
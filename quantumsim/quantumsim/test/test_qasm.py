@@ -1,5 +1,13 @@
+import os
+
+import numpy as np
+import pytest
+
 import quantumsim.qasm as qasm
 
+config_qasm = os.path.join(os.path.dirname(__file__), 'config_qasm_5q.json')
+config_sim = os.path.join(os.path.dirname(__file__), 'config_simulator.json')
+
 qubit_test_pars = {
     'T1': 30000,
     'T2': 30000,
@@ -744,3 +752,185 @@ class TestQASMParser:
             assert len(c.qubits) == 2
 
         assert len(parser.circuits) == 42
+
+
+class TestConfigurableParserPrototypes:
+    qasm_src = ["qubits 5", ".c1", "h q1", "cz q1,q2", "h q1",
+                ".c2", "h q1", "cz q1,q2", "measure q2"]
+
+    def test_prototypes_are_shared(self):
+        parser = qasm.ConfigurableParser(config_qasm, config_sim)
+        with pytest.warns(UserWarning):
+            c1, c2 = parser.parse(self.qasm_src)
+        h1 = [g for g in c1.gates if g.label == 'h q1']
+        h2 = [g for g in c2.gates if g.label == 'h q1']
+        assert len(h1) == 2 and len(h2) == 1
+        assert h1[0] is not h1[1]
+        assert h1[0].time != h1[1].time
+        assert h1[0].ptm is h1[1].ptm is h2[0].ptm
+        assert not h1[0].ptm.flags.writeable
+
+    def test_prototype(self):
+        parser = qasm.ConfigurableParser(config_qasm, config_sim)
+        prototype = parser.prototype('cz q1,q2')
+        assert parser.prototype('cz q1,q2') is prototype
+        assert prototype.qubits == ('q1', 'q2')
+        assert prototype.label == 'cz q1,q2'
+        gate = prototype.make_gate(10.)
+        assert gate.time == 10.
+        assert gate.label == 'cz q1,q2'
+        assert gate.two_ptm.shape == (16, 16)
+
+    def test_ignored_prototype(self):
+        parser = qasm.ConfigurableParser(config_qasm)
+        parser.precompile()
+        assert parser.prototype('measure q0').make_gate(0.) is None
+
+
+class TestConfigurableParserDecompositions:
+    instructions = {
+        'h q0': {'qubits': ['q0'], 'type': 'none'},
+        'h q1': {'qubits': ['q1'], 'type': 'none'},
+        'cz q0,q1': {'qubits': ['q0', 'q1'], 'type': 'none'},
+    }
+
+    def parser(self, decompositions):
+        return qasm.ConfigurableParser({
+            'instructions': self.instructions,
+            'gate_decomposition': decompositions})
+
+    def test_nested_expansion(self):
+        parser = self.parser({
+            'cnot %0,%1': ['h %1', 'cz %0,%1', 'h %1'],
+            'twocnot %0,%1': ['cnot %0,%1', 'prepz %0', 'cnot %0,%1'],
+        })
+        expanded = list(parser._expand_decompositions(
+            ['twocnot q0,q1', 'h q0']))
+        assert expanded == ['h q1', 'cz q0,q1', 'h q1'] * 2 + ['h q0']
+
+    def test_expansions_are_memoized(self):
+        parser = self.parser({'cnot %0,%1': ['h %1', 'cz %0,%1', 'h %1']})
+        list(parser._expand_decompositions(['cnot q0,q1']))
+        parser._decomposers.clear()
+        assert list(parser._expand_decompositions(['cnot q0,q1'])) == \
+            ['h q1', 'cz q0,q1', 'h q1']
+
+    def test_dispatch_on_mnemonic(self):
+        parser = self.parser({
+            'cnot %0,%1': ['h %1', 'cz %0,%1', 'h %1'],
+            'hh %0': ['h %0', 'h %0'],
+        })
+        assert [d.mnemonic for d in parser._decomposers['hh']] == ['hh']
+        assert list(parser._expand_decompositions(['hh q1'])) == \
+            ['h q1', 'h q1']
+
+    def test_unknown_instruction(self):
+        parser = self.parser({'hh %0': ['h %0', 'h %0']})
+        with pytest.raises(qasm.configurable.QasmError):
+            list(parser._expand_decompositions(['hh q0,q1']))
+
+    def test_cyclic_decomposition(self):
+        parser = self.parser({
+            'a %0': ['b %0'],
+            'b %0': ['h %0', 'a %0'],
+        })
+        with pytest.raises(qasm.configurable.ConfigurationError):
+            list(parser._expand_decompositions(['a q0']))
+
+
+class TestConfigurableParserWorkers:
+    qasm_src = ["qubits 5"] + [
+        line for i in range(6) for line in (
+            ".c{}".format(i), "h q1", "cz q1,q{}".format(i % 3 + 2), "h q1",
+            "x q0", "measure q1")]
+
+    @staticmethod
+    def gates(circuit):
+        return [(g.label, g.time) for g in circuit.gates]
+
+    def test_same_as_serial(self):
+        parser = qasm.ConfigurableParser(config_qasm, config_sim)
+        serial = parser.parse(self.qasm_src, 42)
+        parallel = parser.parse(self.qasm_src, 42, workers=2)
+        assert [c.title for c in parallel] == \
+            ['c{}'.format(i) for i in range(6)]
+        for c1, c2 in zip(serial, parallel):
+            assert self.gates(c1) == self.gates(c2)
+            for g1, g2 in zip(c1.gates, c2.gates):
+                if hasattr(g1, 'ptm'):
+                    assert np.allclose(g1.ptm, g2.ptm, equal_nan=True)
+
+    def test_stop_early(self):
+        parser = qasm.ConfigurableParser(config_qasm, config_sim)
+        generator = parser.gen_circuits(self.qasm_src, 42, workers=1)
+        assert next(generator).title == 'c0'
+        generator.close()
+
+    def test_invalid_workers(self):
+        parser = qasm.ConfigurableParser(config_qasm, config_sim)
+        with pytest.raises(ValueError):
+            parser.parse(self.qasm_src, 42, workers=0)
+
+
+def circuit_summary(c):
+    return (c.title, [qb.name for qb in c.qubits],
+            [(type(g).__name__, g.involved_qubits, g.time) for g in c.gates])
+
+
+class TestStreamingQASMParser:
+    @staticmethod
+    def parsers():
+        return (qasm.QASMParser(qubit_parameters={'default': qubit_test_pars}),
+                qasm.StreamingQASMParser(
+                    qubit_parameters={'default': qubit_test_pars}))
+
+    @pytest.mark.parametrize('source', [
+        deutsch_josza_test_qasm, allxy1_qasm, test_allxy_fused_qasm])
+    def test_same_as_qasm_parser(self, source):
+        reference, streaming = self.parsers()
+        reference.parse(source)
+        streaming.parse(source)
+        assert len(streaming.circuits) == len(reference.circuits)
+        for c1, c2 in zip(reference.circuits, streaming.circuits):
+            assert circuit_summary(c1) == circuit_summary(c2)
+
+    def test_streaming_input(self):
+        _, streaming = self.parsers()
+        lines = iter(deutsch_josza_test_qasm.splitlines())
+        generator = streaming.gen_circuits(lines)
+        assert next(generator).title == 'DJ1'
+        # the second circuit has not been read yet
+        assert next(lines).strip() == 'prepz q0'
+        assert streaming.circuits == []
+
+    def test_unnamed_circuits(self):
+        source = """
+qubits 2
+ry90 q0 # comment
+measure q0
+cz q0,q1
+{ measure q0 | measure q1 }
+qwait 10
+"""
+        reference, streaming = self.parsers()
+        reference.parse(source)
+        streaming.parse(source)
+        assert [c.title for c in streaming.circuits] == \
+            ['unnamed circuit'] * 2
+        for c1, c2 in zip(reference.circuits, streaming.circuits):
+            assert circuit_summary(c1) == circuit_summary(c2)
+
+    def test_undefined_qubit(self):
+        _, streaming = self.parsers()
+        with pytest.raises(RuntimeError):
+            streaming.parse("qubits 2\n.c\nry90 q2\nmeasure q0\n")
+
+    def test_missing_measurement(self):
+        _, streaming = self.parsers()
+        with pytest.raises(qasm.configurable.QasmError):
+            streaming.parse("qubits 2\n.c1\nry90 q0\n.c2\nmeasure q0\n")
+
+    def test_unknown_gate(self):
+        _, streaming = self.parsers()
+        with pytest.raises(qasm.configurable.QasmError):
+            streaming.parse("qubits 2\n.c\nfoo q0\nmeasure q0\n")
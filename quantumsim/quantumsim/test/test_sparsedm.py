@@ -188,6 +188,20 @@ def test_copy():
     assert np.allclose(sdm.full_dm.to_array(), sdm_copy.full_dm.to_array())
 
 
+def test_copy_keeps_classical_probability():
+    sdm = SparseDM(2)
+    sdm.hadamard(0)
+    sdm.ensure_dense(0)
+    sdm.ensure_dense(1)
+    sdm.classical_probability = 0.4
+
+    sdm_copy = sdm.copy()
+
+    assert sdm_copy.trace() == sdm.trace()
+    assert sdm_copy.classical_probability == 0.4
+    assert sdm_copy.max_bits_in_full_dm == sdm.max_bits_in_full_dm == 2
+
+
 class TestMultipleMeasurement:
 
     def test_multiple_measurement_gs(self):
@@ -247,6 +261,26 @@ class TestMultipleMeasurement:
             else:
                 assert np.allclose(p, 0)
 
+    def test_multiple_measurement_subset(self):
+        sdm = SparseDM(4)
+        sdm.rotate_y(0, 0.3)
+        sdm.rotate_y(1, 1.1)
+        sdm.rotate_y(3, 2.5)
+        sdm.cphase(0, 1)
+        sdm.cphase(3, 2)
+        sdm.apply_all_pending()
+
+        diag = sdm.full_dm.get_diag()
+        meas = sdm.peak_multiple_measurements([3, 1])
+
+        assert len(meas) == 4
+        assert np.isclose(sum(p for _, p in meas), 1)
+        for state, p in meas:
+            idx = [i for i in range(len(diag))
+                   if (i >> sdm.idx_in_full_dm[1]) & 1 == state[1] and
+                   (i >> sdm.idx_in_full_dm[3]) & 1 == state[3]]
+            assert np.isclose(p, diag[idx].sum())
+
     def test_multiple_does_not_change(self):
         sdm = SparseDM(3)
 
@@ -392,6 +426,97 @@ def test_max_no_bits():
     assert sdm.full_dm.no_qubits == 0
 
 
+def dense_reference(sdm):
+    """The density matrix of sdm including its classical bits, with the
+    bits of sdm.names in the order of the kronecker product."""
+    ref = sdm.copy()
+    ref.apply_all_pending()
+    for bit in sdm.names:
+        ref.ensure_dense(bit)
+    dm = ref.full_dm.to_array() * ref.classical_probability
+    n = len(sdm.names)
+    order = [n - 1 - ref.idx_in_full_dm[b] for b in sdm.names]
+    dm = dm.reshape((2,) * 2 * n).transpose(order + [n + o for o in order])
+    return dm.reshape(2**n, 2**n)
+
+
+pauli_matrices = {"I": np.eye(2),
+                  "X": np.array([[0, 1], [1, 0]]),
+                  "Y": np.array([[0, -1j], [1j, 0]]),
+                  "Z": np.diag([1, -1])}
+
+
+@pytest.fixture
+def mixed_sdm():
+    rng = np.random.RandomState(3)
+    sdm = SparseDM(["a", "b", "c", "d", "e"])
+    for b in "abcd":
+        sdm.apply_ptm(b, ptm.rotate_y_ptm(3 * rng.rand()).dot(
+            ptm.rotate_x_ptm(3 * rng.rand())))
+    sdm.cphase("a", "b")
+    sdm.cphase("c", "b")
+    # d stays classical with a pending rotation, e is a classical mixture
+    sdm.apply_ptm("e", ptm.gen_amp_damping_ptm(0.6, 0.4))
+    sdm.combine_and_apply_single_ptm("e")
+    sdm.classical_probability = 0.7
+    return sdm
+
+
+class TestExpectation:
+
+    def test_matches_dense(self, mixed_sdm):
+        strings = ["XZIII", "IIYII", "IIIZZ", "IIIXI", "IIIIX", "IIIII",
+                   "YYZXI", {"b": "Z", "e": "Z"}, {}]
+        dm = dense_reference(mixed_sdm)
+        expected = []
+        for string in strings:
+            if isinstance(string, dict):
+                string = "".join(string.get(b, "I") for b in mixed_sdm.names)
+            op = pauli_matrices[string[0]]
+            for label in string[1:]:
+                op = np.kron(op, pauli_matrices[label])
+            expected.append(np.trace(op @ dm).real)
+
+        values = mixed_sdm.expectation(strings)
+
+        assert np.allclose(values, expected)
+        assert np.isclose(values[5], mixed_sdm.trace())
+
+    def test_does_not_copy_state(self, mixed_sdm):
+        mixed_sdm.apply_all_pending()
+        dm = mixed_sdm.full_dm.to_array()
+        mixed_sdm.expectation(["ZZZII", "XIXII"])
+        assert np.allclose(mixed_sdm.full_dm.to_array(), dm)
+
+    def test_errors(self, mixed_sdm):
+        with pytest.raises(ValueError):
+            mixed_sdm.expectation(["XX"])
+        with pytest.raises(ValueError):
+            mixed_sdm.expectation([{"f": "X"}])
+        with pytest.raises(ValueError):
+            mixed_sdm.expectation([{"a": "W"}])
+
+
+class TestMarginal:
+
+    def test_matches_dense(self, mixed_sdm):
+        diag = np.diag(dense_reference(mixed_sdm)).real.reshape((2,) * 5)
+
+        for bits in (["a"], ["e", "a", "d"], ["b", "c"], ["d", "e"],
+                     ["e", "d", "c", "b", "a"]):
+            marginal = mixed_sdm.marginal(bits)
+            axes = [mixed_sdm.names.index(b) for b in bits]
+            other = tuple(i for i in range(5) if i not in axes)
+            expected = diag.sum(axis=other).transpose(
+                np.argsort(np.argsort(axes)))
+            assert marginal.shape == (2,) * len(bits)
+            assert np.allclose(marginal, expected)
+
+    def test_unknown_bit(self, mixed_sdm):
+        with pytest.raises(ValueError):
+            mixed_sdm.marginal(["f"])
+
+
 class TestMajorityVote:
 
     def test_majority_vote_gs_classical(self):
@@ -508,8 +633,30 @@ class TestMajorityVote:
         assert np.allclose(p, 0.75 * p0)
 
     def test_majority_vote_reuse_of_cached(self):
-        # TODO?!
-        pass
+        bits = [1, 2, 3]
+        sdm = SparseDM(bits)
+        for b in bits:
+            sdm.hadamard(b)
+
+        sdm.majority_vote(bits)
+        cached = sdm._last_majority_vote_array
+        sdm.majority_vote(bits)
+        assert sdm._last_majority_vote_array is cached
+
+        sdm.majority_vote({1: 0, 2: 0, 3: 0})
+        assert sdm._last_majority_vote_array is not cached
+
+    def test_majority_vote_subset_of_dense(self):
+        sdm = SparseDM([1, 2, 3])
+        sdm.rotate_y(1, np.pi)
+        sdm.rotate_y(3, np.pi)
+        for b in [1, 2, 3]:
+            sdm.ensure_dense(b)
+
+        # the excited bit 3 does not vote
+        assert np.allclose(sdm.majority_vote([1, 2]), 0)
+        assert np.allclose(sdm.majority_vote([1, 3]), 1)
+        assert np.allclose(sdm.majority_vote({1: 1, 2: 0}), 1)
 
 
 class TestCachedSinglePTMs:
@@ -542,7 +689,159 @@ class TestCachedSinglePTMs:
 
         assert not np.allclose(sdm.trace(), 1)
 
+    def test_pending_ptms_are_multiplied(self):
+        sdm = SparseDM(1)
+        sdm.ensure_dense(0)
+
+        p1 = ptm.rotate_x_ptm(0.3)
+        p2 = ptm.amp_ph_damping_ptm(0.1, 0.2)
+        sdm.apply_ptm(0, p1)
+        sdm.apply_ptm(0, p2)
+
+        assert np.allclose(sdm.single_ptms_to_do[0], p2.dot(p1))
+
+    def test_peak_on_classical_does_not_densify(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.hadamard_ptm())
+
+        assert np.allclose(sdm.peak_measurement(0), (0.5, 0.5))
+        assert 0 in sdm.classical
+        assert sdm.full_dm.no_qubits == 0
+
+    def test_peak_with_pending_decay(self):
+        sdm = SparseDM(1)
+        sdm.rotate_y(0, np.pi / 2)
+        sdm.apply_ptm(0, ptm.amp_ph_damping_ptm(0.5, 0.3))
+
+        p0, p1 = sdm.peak_measurement(0)
+        assert 0 in sdm.single_ptms_to_do
+        assert np.allclose((p0, p1), (0.75, 0.25))
+
+        sdm.apply_all_pending()
+        assert np.allclose(sdm.peak_measurement(0), (p0, p1))
+
+    def test_classical_bit_flip_stays_classical(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.rotate_x_ptm(np.pi))
+        sdm.apply_ptm(0, ptm.rotate_z_ptm(0.4))
+        sdm.apply_all_pending()
+
+        assert sdm.classical[0] == 1
+        assert sdm.full_dm.no_qubits == 0
 
+    def test_project_classical_bit(self):
+        sdm = SparseDM(2)
+        sdm.project_measurement(0, 0)
+        assert np.allclose(sdm.trace(), 1)
+        sdm.project_measurement(1, 1)
+        assert np.allclose(sdm.trace(), 0)
+        assert sdm.classical[1] == 1
+
+    def test_copy_does_not_share_pending(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.hadamard_ptm())
+        cp = sdm.copy()
+        cp.apply_all_pending()
+        assert 0 in sdm.single_ptms_to_do
+
+
+class TestClassicalMixtures:
+
+    def test_decay_stays_classical(self):
+        sdm = SparseDM(2)
+        sdm.apply_ptm(0, ptm.rotate_x_ptm(np.pi))
+        sdm.apply_ptm(0, ptm.amp_ph_damping_ptm(0.3, 0.1))
+        sdm.apply_all_pending()
 
+        assert sdm.full_dm.no_qubits == 0
+        assert np.allclose(sdm.classical_populations[0], (0.3, 0.7))
+        assert sdm.classical[0] == 1
+        assert np.allclose(sdm.peak_measurement(0), (0.3, 0.7))
+        assert np.allclose(sdm.trace(), 1)
 
+    def test_project_mixture(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.gen_amp_damping_ptm(0.6, 0.4))
+        sdm.project_measurement(0, 1)
+
+        assert 0 not in sdm.classical_populations
+        assert sdm.classical[0] == 1
+        assert np.allclose(sdm.trace(), 0.4)
+
+    def test_ensure_dense_keeps_mixture(self):
+        sdm = SparseDM(2)
+        sdm.apply_ptm(0, ptm.gen_amp_damping_ptm(0.75, 0.25))
+        sdm.apply_all_pending()
+        sdm.ensure_dense(0)
+
+        assert 0 not in sdm.classical_populations
+        assert np.allclose(sdm.full_dm.get_diag(), (0.75, 0.25))
+
+    def test_coherent_gate_densifies_mixture(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.gen_amp_damping_ptm(0.75, 0.25))
+        sdm.apply_all_pending()
+        sdm.apply_ptm(0, ptm.hadamard_ptm())
+        sdm.apply_all_pending()
+
+        assert 0 in sdm.idx_in_full_dm
+        expected = np.array([[1, 0.5], [0.5, 1]]) / 2
+        assert np.allclose(sdm.full_dm.to_array(), expected)
+
+    def test_ensure_classical_on_mixture(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.gen_amp_damping_ptm(0.5, 0.5))
+        with pytest.raises(ValueError):
+            sdm.ensure_classical(0)
+
+    def test_multiple_measurement_with_mixture(self):
+        sdm = SparseDM(2)
+        sdm.apply_ptm(1, ptm.gen_amp_damping_ptm(0.75, 0.25))
+        sdm.apply_ptm(1, ptm.gen_amp_damping_ptm(0.75, 0.25))
+
+        res = sdm.peak_multiple_measurements([0, 1])
+        assert np.isclose(sum(p for _, p in res), 1)
+        assert np.isclose(sum(p for o, p in res if o == {0: 0, 1: 1}), 0.25)
+
+    def mixed_state(self):
+        sdm = SparseDM(4)
+        sdm.hadamard(0)
+        sdm.cphase(0, 1)
+        sdm.rotate_y(1, 0.4)
+        for bit, p in ((2, 0.3), (3, 0.8)):
+            sdm.apply_ptm(bit, ptm.gen_amp_damping_ptm(p, 1 - p))
+        sdm.apply_all_pending()
+        sdm.classical_probability = 0.9
+        assert set(sdm.classical_populations) == {2, 3}
+        reference = sdm.copy()
+        reference.ensure_dense(2)
+        reference.ensure_dense(3)
+        return sdm, reference
+
+    def test_multiple_measurement_keeps_mixtures(self):
+        sdm, reference = self.mixed_state()
+        for bits in ([0, 2], [3, 1, 2], [2]):
+            res = sdm.peak_multiple_measurements(bits)
+            expected = reference.peak_multiple_measurements(bits)
+            assert len(res) == len(expected) == 2**len(bits)
+            for outcome, p in expected:
+                assert np.isclose(
+                    sum(q for o, q in res if o == outcome), p)
+        assert sdm.full_dm.no_qubits == 2
+
+    def test_majority_vote_keeps_mixtures(self):
+        sdm, reference = self.mixed_state()
+        for bits in ([0, 1, 2], [0, 2, 3], {1: 0, 2: 1, 3: 0}, [2, 3]):
+            assert np.isclose(sdm.majority_vote(bits),
+                              reference.majority_vote(bits))
+        assert sdm.full_dm.no_qubits == 2
+
+    def test_renormalize_and_copy(self):
+        sdm = SparseDM(1)
+        sdm.apply_ptm(0, ptm.amp_ph_damping_ptm(0.5, 0) * 0.5)
+        sdm.apply_all_pending()
+        cp = sdm.copy()
+        sdm.renormalize()
 
+        assert np.allclose(sdm.trace(), 1)
+        assert np.allclose(cp.trace(), 0.5)
@@ -1,4 +1,5 @@
 import quantumsim.tp as tp
+import random
 
 test_data_dict = {1: set(),
                   2: {20},
@@ -66,3 +67,51 @@ def test_regression():
 
 
 
+
+
+def test_large_circuit():
+    rng = random.Random(0)
+    no_lists = 17
+    lists = [[] for _ in range(no_lists)]
+    for item in range(5000):
+        for n in rng.sample(range(no_lists), rng.choice([1, 2])):
+            lists[n].append(item)
+
+    result = tp.partial_greedy_toposort(lists, targets=range(0, no_lists, 2))
+
+    assert sorted(result) == list(range(5000))
+    indices = {s: i for i, s in enumerate(result)}
+    for lst in lists:
+        assert all(indices[a] < indices[b] for a, b in zip(lst, lst[1:]))
+
+
+def test_targets_not_interleaved():
+    lists = [[0, 2, 4], [1, 3, 5], [6, 7]]
+    result = tp.partial_greedy_toposort(lists, targets=[0, 1])
+    assert result == [6, 7, 1, 3, 5, 0, 2, 4]
+
+
+def test_min_width_defers_entangling():
+    # items 0, 1 entangle a-b and c-d, item 2 measures a, item 3 measures b
+    lists = [[0, 2], [0, 3], [1]]
+    entangles = [("a", "b"), ("c", "d"), (), ()]
+    measures = [None, None, "a", "b"]
+    result = tp.min_width_toposort(lists, entangles, measures)
+    assert result == [0, 2, 3, 1]
+
+
+def test_min_width_respects_partial_orders():
+    rng = random.Random(1)
+    lists = [[] for _ in range(6)]
+    for item in range(300):
+        for n in rng.sample(range(6), rng.choice([1, 2])):
+            lists[n].append(item)
+    entangles = [(rng.randrange(6), rng.randrange(6)) for _ in range(300)]
+    measures = [rng.choice([None, rng.randrange(6)]) for _ in range(300)]
+
+    result = tp.min_width_toposort(lists, entangles, measures)
+
+    assert sorted(result) == list(range(300))
+    indices = {s: i for i, s in enumerate(result)}
+    for lst in lists:
+        assert all(indices[a] < indices[b] for a, b in zip(lst, lst[1:]))
@@ -18,7 +18,9 @@ def partial_greedy_toposort(partial_orders, targets=set()):
 
     a_10 < a_20 < a_1n < a_2n.
 
-    This is done by a greedy algorithm.
+    This is done by a greedy algorithm: repeatedly, the list whose last item
+    depends on the fewest target lists not used so far is chosen, and all
+    items its last item depends on are appended to the ordering.
 
     Parameters:
 
@@ -33,45 +35,103 @@ def partial_greedy_toposort(partial_orders, targets=set()):
     # drop out empty lists
     partial_orders = [po for po in partial_orders if po]
 
-    order_dicts = []
-    for n, p in enumerate(partial_orders):
-        order_dict = {i: j for i, j in zip(p[1:], p)}
-        order_dicts.append(order_dict)
+    # predecessors of every item, in the order of the lists they come from
+    preds = {}
+    for p in partial_orders:
+        for i, j in zip(p[1:], p):
+            preds.setdefault(i, []).append(j)
 
-    trees = []
+    # Bit n of used[x] is set if x depends on the second item of target list
+    # n, i.e. if choosing x first would use target list n.
+    own_bits = {}
     for n, p in enumerate(partial_orders):
-        tree = []
-        to_do = [(None, p[-1])]
-        while to_do:
-            n, x = to_do.pop()
-            tree.append((n, x))
-            for n2, o2 in enumerate(order_dicts):
-                x2 = o2.get(x)
-                if x2 is not None:
-                    to_do.append((n2, x2))
-
-        lists_used = {n for n, x in tree if n in targets}
-        trees.append((tree, lists_used))
+        if n in targets and len(p) > 1:
+            own_bits[p[1]] = own_bits.get(p[1], 0) | 1 << n
+    used = {}
+    for x in _postorder([p[-1] for p in partial_orders], preds, set()):
+        bits = own_bits.get(x, 0)
+        for y in preds.get(x, ()):
+            bits |= used[y]
+        used[x] = bits
+
+    trees = [(p[-1], used[p[-1]]) for p in partial_orders]
 
     result = []
-    all_used = set()
-    while trees != []:
-        trees.sort(key=lambda xy: len(all_used | xy[1]), reverse=True)
-        smallest = trees.pop()
-        all_used |= smallest[1]
-        smallest = smallest[0]
-        smallest.reverse()
-        smallest = [x for n, x in smallest]
-
-        new_trees = []
-        for l, i in trees:
-            l2 = [(n, x) for n, x in l if x not in smallest]
-            new_trees.append((l2, i))
-
-        trees = new_trees
-
-        for s in smallest:
-            if s not in result:
-                result.append(s)
+    done = set()
+    all_used = 0
+    while trees:
+        # stable sort, so that ties are broken by the previous order
+        trees.sort(key=lambda xy: _popcount(all_used | xy[1]), reverse=True)
+        last, lists_used = trees.pop()
+        all_used |= lists_used
+        result.extend(_postorder([last], preds, done))
+
+    return result
+
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+
+def _postorder(roots, preds, done):
+    """Yield the items the roots depend on, including the roots, that are
+    not in `done` yet, each after all its predecessors. Yielded items are
+    added to `done`."""
+    for root in roots:
+        if root in done:
+            continue
+        stack = [(root, iter(preds.get(root, ())))]
+        while stack:
+            x, it = stack[-1]
+            for y in it:
+                if y not in done:
+                    stack.append((y, iter(preds.get(y, ()))))
+                    break
+            else:
+                stack.pop()
+                if x not in done:
+                    done.add(x)
+                    yield x
+
+
+def min_width_toposort(partial_orders, entangles, measures):
+    """Order the items 0, 1, ..., len(entangles) - 1 consistent with the
+    partial orders (as in partial_greedy_toposort), so that the number of
+    qubits in the dense part of a SparseDM stays small.
+
+    Item i makes the qubits in `entangles[i]` dense, and makes the qubit
+    `measures[i]` classical again, if it is not None. At every step, the
+    available item that makes the fewest new qubits dense is chosen,
+    preferring measurements, and then items that come first.
+
+    Returns the total ordering as a list of items.
+    """
+    no_items = len(entangles)
+    no_preds = [0] * no_items
+    succs = [[] for _ in range(no_items)]
+    for p in partial_orders:
+        for i, j in zip(p, p[1:]):
+            succs[i].append(j)
+            no_preds[j] += 1
+
+    ready = [i for i in range(no_items) if no_preds[i] == 0]
+    dense = set()
+    result = []
+
+    def key(i):
+        new = sum(1 for qb in entangles[i] if qb not in dense)
+        return new, measures[i] is None, i
+
+    while ready:
+        i = min(ready, key=key)
+        ready.remove(i)
+        result.append(i)
+        dense.update(entangles[i])
+        if measures[i] is not None:
+            dense.discard(measures[i])
+        for j in succs[i]:
+            no_preds[j] -= 1
+            if no_preds[j] == 0:
+                ready.append(j)
 
     return result